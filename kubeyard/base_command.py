@@ -5,6 +5,7 @@ import pathlib
 from cached_property import cached_property
 
 from kubeyard import context_factories
+from kubeyard import profiling
 from kubeyard import settings
 
 logger = logging.getLogger(__name__)
@@ -51,7 +52,8 @@ class InitialisedRepositoryCommand(BaseCommand, metaclass=ContextFromClassProper
     @cached_property
     def context(self):
         try:
-            return context_factories.InitialisedRepoContextFactory(self.project_dir).get()
+            with profiling.span('context load'):
+                return context_factories.InitialisedRepoContextFactory(self.project_dir).get()
         except FileNotFoundError:
             logger.error("Invalid project root directory: {}. Exiting.".format(self.project_dir))
             exit(1)
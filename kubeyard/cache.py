@@ -0,0 +1,53 @@
+import json
+import logging
+import os
+import pathlib
+import tempfile
+
+from kubeyard import settings
+
+logger = logging.getLogger(__name__)
+
+
+def get_cache_directory() -> pathlib.Path:
+    return pathlib.Path.home() / settings.DEFAULT_KUBEYARD_CACHE_DIR
+
+
+class JsonCache:
+    """
+    Dictionary persisted as a JSON file, used to remember results of expensive lookups between kubeyard invocations.
+    By default it is kept in ~/.kubeyard/cache/.
+    """
+
+    def __init__(self, name, directory=None):
+        self.path = pathlib.Path(directory or get_cache_directory()) / '{}.json'.format(name)
+
+    def get(self, key, default=None):
+        return self.load().get(key, default)
+
+    def set(self, key, value):
+        data = self.load()
+        data[key] = value
+        self.save(data)
+
+    def delete(self, key):
+        data = self.load()
+        if data.pop(key, None) is not None:
+            self.save(data)
+
+    def load(self) -> dict:
+        try:
+            with self.path.open() as cache_file:
+                return json.load(cache_file)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.debug('Ignoring corrupted cache file {}'.format(self.path))
+            return {}
+
+    def save(self, data: dict):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temporary_path = tempfile.mkstemp(dir=str(self.path.parent), prefix=self.path.name)
+        with os.fdopen(fd, 'w') as cache_file:
+            json.dump(data, cache_file, indent=2, sort_keys=True)
+        os.replace(temporary_path, str(self.path))
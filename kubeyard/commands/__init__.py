@@ -1,29 +1,29 @@
-from kubeyard.commands.bash_completion import InstallCompletion
-from kubeyard.commands.build import BuildCommand
-from kubeyard.commands.custom_script import CustomScriptCommand
-from kubeyard.commands.debug import DebugCommand
-from kubeyard.commands.deploy import DeployCommand
-from kubeyard.commands.fix_code_style import FixCodeStyleCommand
-from kubeyard.commands.global_commands import InstallGlobalSecretsCommand
-from kubeyard.commands.global_commands import SetupCommand
-from kubeyard.commands.init import InitCommand
-from kubeyard.commands.push import PushCommand
-from kubeyard.commands.shell import ShellCommand
-from kubeyard.commands.test import TestCommand
-from kubeyard.commands.update_requirements import UpdateRequirementsCommand
+import importlib
 
-__all__ = [
-    InstallCompletion,
-    CustomScriptCommand,
-    DebugCommand,
-    BuildCommand,
-    DeployCommand,
-    PushCommand,
-    UpdateRequirementsCommand,
-    FixCodeStyleCommand,
-    InstallGlobalSecretsCommand,
-    SetupCommand,
-    InitCommand,
-    TestCommand,
-    ShellCommand,
-]
+# Command modules pull in heavy dependencies (sh, kubepy, jinja2...), so they are imported on first attribute access.
+command_modules = {
+    'InstallCompletion': 'kubeyard.commands.bash_completion',
+    'BuildCommand': 'kubeyard.commands.build',
+    'CustomScriptCommand': 'kubeyard.commands.custom_script',
+    'DebugCommand': 'kubeyard.commands.debug',
+    'DeployCommand': 'kubeyard.commands.deploy',
+    'FixCodeStyleCommand': 'kubeyard.commands.fix_code_style',
+    'InstallGlobalSecretsCommand': 'kubeyard.commands.global_commands',
+    'SetupCommand': 'kubeyard.commands.global_commands',
+    'InitCommand': 'kubeyard.commands.init',
+    'PushCommand': 'kubeyard.commands.push',
+    'ShellCommand': 'kubeyard.commands.shell',
+    'TestCommand': 'kubeyard.commands.test',
+    'TestDatabasePoolCommand': 'kubeyard.commands.test',
+    'UpdateRequirementsCommand': 'kubeyard.commands.update_requirements',
+}
+
+__all__ = list(command_modules)
+
+
+def __getattr__(name):
+    try:
+        module_name = command_modules[name]
+    except KeyError:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    return getattr(importlib.import_module(module_name), name)
@@ -1,25 +1,228 @@
 import logging
+import pathlib
+import re
 import shlex
+import shutil
+import sys
+import tarfile
 
-from kubeyard.commands.devel import BaseDevelCommand
+import sh
+
+from cached_property import cached_property
+
+from kubeyard import content_hash
+from kubeyard import profiling
+from kubeyard.commands.devel import DockerImage
+from kubeyard.commands.devel import MultiImageDevelCommand
 
 logger = logging.getLogger(__name__)
 
+CONTEXT_HASH_LABEL = 'kubeyard.context-hash'
+REBUILD_DOCKER_ARGS = {'--no-cache', '--pull'}
 
-class BuildCommand(BaseDevelCommand):
+
+class BuildCommand(MultiImageDevelCommand):
     """
     Builds docker image required to run tests and deployment. Can be overridden in <project_dir>/sripts/build.
     If kubeyard is set up in development mode it uses minikube as docker host.
+
+    Build context is hashed (respecting .dockerignore) and the hash is stored as image label. If an image with the same
+    hash already exists, build is skipped (use --force to build anyway).
+
+    Several images may be declared in kubeyard.yml, they are built concurrently. `context` (relative to project
+    directory) and `docker-args` are optional, by default --image-context or <project_dir>/docker is used
+    and --docker-args are appended to arguments of every image. Use --image-name (possibly repeated) to build
+    only some of them.
+
+    \b
+    Example:
+    docker_images:
+      - name: service-app
+        docker-args: --target app
+      - name: service-worker
+        docker-args: --target worker
+      - name: service-statics
+        context: statics
+
+    You can keep BuildKit layer cache in a local directory (and optionally in a tarball, which CI can archive and
+    restore between jobs). It requires docker buildx, kubeyard creates `docker-container` builder if needed.
+    Every image has its own subdirectory in the cache directory.
+
+    \b
+    Example:
+    build_cache:
+      path: .kubeyard/build-cache  <- Cache directory, relative to project directory.
+      archive: build-cache.tar.gz  <- Optional. Restored before build if cache directory is empty, saved after build.
+      mode: max                    <- `min` exports only layers of the final image, `max` exports all of them.
+      builder: kubeyard
     """
     custom_script_name = 'build'
     context_vars = ['image_context', 'docker_args']
 
-    def __init__(self, *, image_context, docker_args, **kwargs):
+    def __init__(self, *, image_context, docker_args, force, **kwargs):
         super().__init__(**kwargs)
         self.image_context = image_context
         self.docker_args = docker_args or ''
+        self.force = force
 
     def run_default(self):
-        image_context = self.image_context or "{0}/docker".format(self.project_dir)
-        logger.info('Building image "{}"...'.format(self.image))
-        self.docker_with_output('build', '-t', self.image, *shlex.split(self.docker_args),  image_context)
+        if self.build_cache:
+            self.build_cache.restore()
+            self.ensure_builder_exists(self.build_cache.builder)
+        self.run_for_each_image(self.build_image, 'Building')
+        if self.build_cache:
+            self.build_cache.save()
+
+    def build_image(self, docker_image: DockerImage, output=None):
+        image = self.get_image(docker_image.name)
+        image_context = str(docker_image.context or self.image_context or self.project_dir / 'docker')
+        docker_args = shlex.split(docker_image.docker_args) + shlex.split(self.docker_args)
+        context_hash = self.get_context_hash(image_context, docker_args)
+        if context_hash and self.is_up_to_date(image, context_hash):
+            logger.info('Image "{}" is up to date.'.format(image))
+            return
+        if context_hash:
+            docker_args = ['--label', '{}={}'.format(CONTEXT_HASH_LABEL, context_hash), *docker_args]
+        logger.info('Building image "{}"...'.format(image))
+        with profiling.span('image build', image=image):
+            if self.build_cache:
+                self.build_with_cache(image, docker_image.name, docker_args, image_context, output)
+            else:
+                self.docker_with_output('build', '-t', image, *docker_args, image_context, output=output)
+
+    @cached_property
+    def build_cache(self):
+        configuration = self.context.get('BUILD_CACHE')
+        return BuildCache(self.project_dir, configuration) if configuration else None
+
+    def build_with_cache(self, image, cache_name, docker_args, image_context, output=None):
+        cache = self.build_cache
+        progress = BuildKitProgress(output)
+        self.docker_runner.run(
+            'buildx', 'build',
+            '--builder', cache.builder,
+            *cache.buildx_args(cache_name),
+            '--load',
+            '--progress', 'plain',
+            '-t', image,
+            *docker_args,
+            image_context,
+            _out=output or sys.stdout.buffer,
+            _err=progress,
+        )
+        logger.info('Build cache of "{}": {} of {} steps cached ({:.0%}).'.format(
+            image, progress.cached_steps, progress.total_steps, progress.hit_ratio,
+        ))
+        cache.replace(cache_name)
+
+    def ensure_builder_exists(self, builder):
+        try:
+            self.docker_runner.run('buildx', 'inspect', builder)
+        except sh.ErrorReturnCode:
+            logger.info('Creating buildx builder "{}"...'.format(builder))
+            self.docker_runner.run('buildx', 'create', '--name', builder, '--driver', 'docker-container')
+
+    def get_context_hash(self, image_context, docker_args):
+        context_path = pathlib.Path(image_context)
+        if self.force or REBUILD_DOCKER_ARGS.intersection(docker_args) or not context_path.is_dir():
+            return None
+        with profiling.span('build context hash'):
+            hasher = content_hash.ContentHasher()
+            hasher.add_value(*docker_args)
+            hasher.add_build_context(context_path, self.get_dockerfile(docker_args))
+            return hasher.hexdigest()
+
+    @staticmethod
+    def get_dockerfile(docker_args):
+        for index, arg in enumerate(docker_args):
+            if arg in ('-f', '--file') and index + 1 < len(docker_args):
+                return pathlib.Path(docker_args[index + 1])
+            if arg.startswith('--file='):
+                return pathlib.Path(arg.split('=', 1)[1])
+        return None
+
+    def is_up_to_date(self, image, context_hash):
+        image_info = self.docker_runner.inspect_image(image)
+        if image_info and (image_info['Config'].get('Labels') or {}).get(CONTEXT_HASH_LABEL) == context_hash:
+            return True
+        images = self.docker_runner.find_images(label='{}={}'.format(CONTEXT_HASH_LABEL, context_hash))
+        if images:
+            logger.info('Found image built from the same context, tagging it as "{}"...'.format(image))
+            self.docker_runner.tag_image(images[0], image)
+            return True
+        return False
+
+
+class BuildCache:
+    def __init__(self, project_dir: pathlib.Path, configuration: dict):
+        self.path = project_dir / configuration.get('path', '.kubeyard/build-cache')
+        self.archive = project_dir / configuration['archive'] if configuration.get('archive') else None
+        self.mode = configuration.get('mode', 'max')
+        self.builder = configuration.get('builder', 'kubeyard')
+        self.updated = False
+
+    def get_path(self, name):
+        return self.path / name
+
+    def get_exported_path(self, name):
+        return self.path / (name + '-new')
+
+    def buildx_args(self, name):
+        args = ['--cache-to', 'type=local,dest={},mode={}'.format(self.get_exported_path(name), self.mode)]
+        if (self.get_path(name) / 'index.json').exists():
+            args += ['--cache-from', 'type=local,src={}'.format(self.get_path(name))]
+        else:
+            logger.info('Build cache of "{}" is empty.'.format(name))
+        return args
+
+    def restore(self):
+        if self.archive and self.archive.exists() and not any(self.path.glob('*/index.json')):
+            logger.info('Restoring build cache from {}...'.format(self.archive))
+            with profiling.span('build cache restore'):
+                with tarfile.open(str(self.archive)) as archive:
+                    archive.extractall(str(self.path))
+
+    def replace(self, name):
+        # BuildKit doesn't prune local cache directory, so the old one is replaced with freshly exported cache.
+        shutil.rmtree(str(self.get_path(name)), ignore_errors=True)
+        self.get_exported_path(name).rename(self.get_path(name))
+        self.updated = True
+
+    def save(self):
+        if self.archive and self.updated:
+            logger.info('Saving build cache to {}...'.format(self.archive))
+            with profiling.span('build cache save'):
+                with tarfile.open(str(self.archive), 'w:gz') as archive:
+                    archive.add(str(self.path), arcname='.')
+
+
+class BuildKitProgress:
+    """Passes BuildKit plain progress output through and counts build steps which were taken from cache."""
+    step_pattern = re.compile(r'^#(\d+) \[[^\]]*\d+/\d+\]')
+    cached_pattern = re.compile(r'^#(\d+) CACHED')
+
+    def __init__(self, output=None):
+        self.output = output or sys.stdout.write
+        self.steps = set()
+        self.cached = set()
+
+    def __call__(self, line):
+        self.output(line)
+        step = self.step_pattern.match(line)
+        if step:
+            self.steps.add(step.group(1))
+        cached = self.cached_pattern.match(line)
+        if cached:
+            self.cached.add(cached.group(1))
+
+    @property
+    def total_steps(self):
+        return len(self.steps)
+
+    @property
+    def cached_steps(self):
+        return len(self.cached & self.steps)
+
+    @property
+    def hit_ratio(self):
+        return self.cached_steps / self.total_steps if self.total_steps else 0.0
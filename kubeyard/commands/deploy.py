@@ -3,17 +3,19 @@ import logging
 import sys
 
 import kubepy.appliers
-import sh
 
 from cached_property import cached_property
 from kubepy import appliers_options
 
 from kubeyard import base_command
 from kubeyard import kubernetes
+from kubeyard import kubernetes_gateway
+from kubeyard import profiling
 from kubeyard import settings
+from kubeyard import subprocesses
 from kubeyard.commands.devel import MAX_JOB_RETRIES
 from kubeyard.commands.devel import BaseDevelCommand
-from kubeyard.commands.devel import DockerRunner
+from kubeyard.commands.devel import get_docker_runner
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +41,21 @@ class DeployCommand(BaseDevelCommand):
     - name: dev-volume
       host-path: docker/source
 
+    In development mode dev_requirements are started before deployment. Requirements of different kinds are started
+    concurrently (at most dev_requirements_concurrency at once, 4 by default). Satisfied requirements are remembered
+    in ~/.kubeyard/cache/dev-requirements.json and are not checked again until pod of their dependency (or any of
+    its containers) is replaced.
+
+    \b
+    Example:
+    dev_requirements:
+    - kind: postgres
+    - kind: redis
+    - kind: pubsub
+      topic: events
+      subscription: events-worker
+    dev_requirements_concurrency: 2
+
     Can be overridden in <project_dir>/sripts/deploy.
     """
     custom_script_name = 'deploy'
@@ -63,7 +80,8 @@ class DeployCommand(BaseDevelCommand):
                 self.run_dev_requirements_deploy()
             self.run_kubernetes_deploy()
         if self.is_development:
-            DomainConfigurator(self.context).configure()
+            with profiling.span('domains configuration'):
+                DomainConfigurator(self.context).configure()
 
     @property
     def should_deploy_statics(self):
@@ -83,7 +101,8 @@ class DeployCommand(BaseDevelCommand):
 
     def run_statics_deploy(self):
         logger.info('Uploading static files...')
-        self.static_files_storage.collect_and_upload()
+        with profiling.span('statics upload'):
+            self.static_files_storage.collect_and_upload()
         logger.info('Static files uploaded')
 
     def run_kubernetes_deploy(self):
@@ -96,7 +115,8 @@ class DeployCommand(BaseDevelCommand):
         )
         kubernetes.install_secrets(self.context)
         logger.info('Applying Kubernetes definitions from YAML files...')
-        kubepy.appliers.DirectoriesApplier(self.definition_directories, options).apply_all()
+        with profiling.span('kubernetes apply'):
+            kubepy.appliers.DirectoriesApplier(self.definition_directories, options).apply_all()
         logger.info('Kubernetes definitions applied')
 
     @property
@@ -125,7 +145,8 @@ class DeployCommand(BaseDevelCommand):
         logger.info('Checking development requirements...')
         from kubeyard.commands.dev_requirements import RequirementsDispatcher
         dispatcher = RequirementsDispatcher(self.context)
-        dispatcher.dispatch_all(self.dev_requirements)
+        with profiling.span('dev requirements'):
+            dispatcher.dispatch_all(self.dev_requirements)
         logger.info('Development requirements are satisfied')
 
     @property
@@ -155,7 +176,7 @@ class DomainConfigurator:
     def run_update_hosts(self):
         for domain in self.custom_domains_to_be_configured:
             hosts_entry = self.host_format.format(minikube_ip=self.minikube_ip, domain=domain)
-            sh.sudo(
+            subprocesses.sudo(
                 '-S',
                 'tee', '--append', self.hosts_filename,
                 _in=self._sudo_password + self.hosts_watermark + hosts_entry,
@@ -163,9 +184,11 @@ class DomainConfigurator:
 
     @cached_property
     def minikube_ip(self) -> str:
-        return sh.kubectl.get.nodes(
-            '-l', 'minikube.k8s.io/name=minikube',
-            '-o', 'jsonpath={.items[*].status.addresses[?(@.type=="InternalIP")].address}').strip()
+        nodes = kubernetes_gateway.get_gateway(self.context).list_nodes(selector='minikube.k8s.io/name=minikube')
+        return ' '.join(
+            address['address'] for node in nodes for address in node['status'].get('addresses', [])
+            if address['type'] == 'InternalIP'
+        )
 
     @cached_property
     def _sudo_password(self):
@@ -198,7 +221,7 @@ def static_files_storage_factory(context, image, gcs_service_key_file, aws_crede
                                  bucket_name, local_binary_path):
     statics_directory = context.get('STATICS_DIRECTORY', '')
     collect_statics_command = context.get('COLLECT_STATICS_COMMAND', 'collect_statics_tar')
-    docker_runner = DockerRunner(context)
+    docker_runner = get_docker_runner(context)
     bucket_name = bucket_name or context.get('BUCKET_NAME')
     arguments = {
         'statics_directory': statics_directory,
@@ -345,9 +368,9 @@ class AzureFilesStorage(FilesStorage):
             )
 
     def upload_tarred_files_with_local(self, statics_tar_process):
-        statics_absolute_path = '{}/upload'.format(sh.pwd().strip())
+        statics_absolute_path = '{}/upload'.format(subprocesses.pwd().strip())
         self._save_tar_to_volume(statics_tar_process, statics_absolute_path)
-        sh.bash(
+        subprocesses.bash(
             '-c',
             " ".join([
                 self.local_binary_path,
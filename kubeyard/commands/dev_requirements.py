@@ -1,41 +1,81 @@
+import collections
+import concurrent.futures
+import hashlib
+import json
 import logging
 import pathlib
+import shlex
+import threading
+import time
+import typing
 
-import sh
-
+from kubeyard import cache
 from kubeyard import dependencies
 from kubeyard import kubernetes
+from kubeyard import kubernetes_gateway
+from kubeyard import profiling
+from kubeyard import settings
 
 logger = logging.getLogger(__name__)
 definitions_directory = pathlib.Path(__file__).parent.parent / 'definitions' / 'dev_requirements'
+# Runs pubsub helper command, treating already existing topic or subscription as success.
+PUBSUB_ENSURE_FUNCTION = (
+    'ensure() {\n'
+    '    output=$("$@" 2>&1) && return 0\n'
+    '    case "$output" in *"already exists"*) return 0;; esac\n'
+    '    echo "$output" >&2\n'
+    '    return 1\n'
+    '}\n'
+)
 
 
 class Requirement:
     valid_arguments = ()
+    # Whether requirement stays satisfied as long as containers of its dependency are not replaced.
+    cacheable = True
 
-    def __init__(self, context: dict):
+    def __init__(self, context: dict, snapshot: dependencies.PodSnapshot = None):
         self.context = context
+        self.snapshot = snapshot
 
-    def __call__(self, arguments: dict):
-        if all(key in self.valid_arguments for key in arguments.keys()):
+    @property
+    def gateway(self) -> kubernetes_gateway.KubectlGateway:
+        return kubernetes_gateway.get_gateway(self.context)
+
+    def __call__(self, arguments: dict) -> bool:
+        if self.is_valid(arguments):
             self.run(arguments)
-        else:
-            logger.warning(
-                'Requirement configuration is not valid: {}\n'
-                'Available options are: {}'.format(arguments, self.valid_arguments))
+            return True
+        return False
+
+    def is_valid(self, arguments: dict) -> bool:
+        if all(key in self.valid_arguments for key in arguments.keys()):
+            return True
+        logger.warning(
+            'Requirement configuration is not valid: {}\n'
+            'Available options are: {}'.format(arguments, self.valid_arguments))
+        return False
 
     def run(self, arguments: dict):
         raise NotImplementedError
 
+    def run_all(self, arguments_list: typing.List[dict]):
+        """Satisfies several requirements of this kind. Subclasses provision them together where possible."""
+        for arguments in arguments_list:
+            self.run(arguments)
+
 
 class Postgres(Requirement):
     valid_arguments = ('name')
 
     def run(self, arguments: dict):
-        database_name = arguments.get('name') or self.context['KUBE_SERVICE_NAME']
-        dependency = PostgresDependency()
+        self.run_all([arguments])
+
+    def run_all(self, arguments_list: typing.List[dict]):
+        database_names = [arguments.get('name') or self.context['KUBE_SERVICE_NAME'] for arguments in arguments_list]
+        dependency = PostgresDependency(snapshot=self.snapshot, gateway=self.gateway)
         dependency.ensure_running()
-        dependency.ensure_database_present(database_name)
+        dependency.ensure_databases_present(database_names)
 
 
 class PostgresDependency(dependencies.KubernetesDependency):
@@ -43,27 +83,31 @@ class PostgresDependency(dependencies.KubernetesDependency):
     definition = definitions_directory / 'postgres.yaml'
     started_log = 'PostgreSQL init process complete; ready for start up.'
 
-    def ensure_database_present(self, database_name):
-        logger.debug('Ensuring that database "{}" exists...'.format(database_name))
-        try:
-            self.run_command('createdb', database_name, '-U', 'postgres')
-        except sh.ErrorReturnCode as e:
-            if b'already exists' not in e.stderr:
-                raise e
-            else:
-                logger.debug('Database "{}" exists'.format(database_name))
-        else:
-            logger.debug('Database "{}" created'.format(database_name))
+    def ensure_databases_present(self, database_names):
+        database_names = unique(database_names)
+        logger.debug('Ensuring that databases {} exist...'.format(', '.join(database_names)))
+        # CREATE DATABASE can't run in a transaction nor a function, so psql executes statements selected for
+        # missing databases.
+        query = (
+            "SELECT format('CREATE DATABASE %I', name) FROM unnest(ARRAY[{}]::text[]) AS name "
+            "WHERE name NOT IN (SELECT datname FROM pg_database)\n"
+            "\\gexec\n"
+        ).format(', '.join(quote_literal(name) for name in database_names))
+        output = self.run_command('psql', '-U', 'postgres', '-v', 'ON_ERROR_STOP=1', input=query)
+        logger.debug('Databases created: {}'.format(str(output).count('CREATE DATABASE') or 'none'))
 
 
 class CockroachDB(Requirement):
     valid_arguments = ('name',)
 
     def run(self, arguments: dict):
-        database_name = arguments.get('name') or self.context['KUBE_SERVICE_NAME']
-        dependency = CockroachDBDependency()
+        self.run_all([arguments])
+
+    def run_all(self, arguments_list: typing.List[dict]):
+        database_names = [arguments.get('name') or self.context['KUBE_SERVICE_NAME'] for arguments in arguments_list]
+        dependency = CockroachDBDependency(snapshot=self.snapshot, gateway=self.gateway)
         dependency.ensure_running()
-        dependency.ensure_database_present(database_name)
+        dependency.ensure_databases_present(database_names)
 
 
 class CockroachDBDependency(dependencies.KubernetesDependency):
@@ -71,18 +115,11 @@ class CockroachDBDependency(dependencies.KubernetesDependency):
     definition = definitions_directory / 'cockroachdb.yaml'
     started_log = 'CockroachDB node starting'
 
-    def ensure_database_present(self, database_name):
-        logger.debug('Ensuring that database "{}" exists...'.format(database_name))
-        try:
-            self.run_command('/cockroach/cockroach', 'sql', '--insecure',
-                             '-e', 'CREATE DATABASE "{}";'.format(database_name))
-        except sh.ErrorReturnCode as e:
-            if b'already exists' not in e.stderr:
-                raise e
-            else:
-                logger.debug('Database "{}" exists'.format(database_name))
-        else:
-            logger.debug('Database "{}" created'.format(database_name))
+    def ensure_databases_present(self, database_names):
+        database_names = unique(database_names)
+        logger.debug('Ensuring that databases {} exist...'.format(', '.join(database_names)))
+        query = ' '.join('CREATE DATABASE IF NOT EXISTS {};'.format(quote_identifier(name)) for name in database_names)
+        self.run_command('/cockroach/cockroach', 'sql', '--insecure', '-e', query)
 
 
 class Elasticsearch(Requirement):
@@ -92,7 +129,7 @@ class Elasticsearch(Requirement):
         self.ensure_elastic_running()
 
     def ensure_elastic_running(self):
-        ElasticsearchDependency().ensure_running()
+        ElasticsearchDependency(snapshot=self.snapshot, gateway=self.gateway).ensure_running()
 
 
 class ElasticsearchDependency(dependencies.KubernetesDependency):
@@ -105,16 +142,21 @@ class PubSubEmulator(Requirement):
     valid_arguments = ('topic', 'subscription')
 
     def run(self, arguments: dict):
-        topic_name = arguments.get('topic') or self.context['KUBE_SERVICE_NAME']
-        dependency = PubSubDependency()
+        self.run_all([arguments])
+
+    def run_all(self, arguments_list: typing.List[dict]):
+        topic_names = []
+        subscriptions = []
+        for arguments in arguments_list:
+            topic_name = arguments.get('topic') or self.context['KUBE_SERVICE_NAME']
+            topic_names.append(topic_name)
+            try:
+                subscriptions.append((topic_name, arguments['subscription']))
+            except KeyError:
+                logger.debug('Subscription for topic "{}" not specified, it won\'t be created'.format(topic_name))
+        dependency = PubSubDependency(snapshot=self.snapshot, gateway=self.gateway)
         dependency.ensure_running()
-        dependency.ensure_topic_present(topic_name)
-        try:
-            subscription_name = arguments['subscription']
-        except KeyError:
-            logger.debug("Subscription not specified, it won't be created")
-        else:
-            dependency.ensure_subscription_present(topic_name, subscription_name)
+        dependency.ensure_topics_present(topic_names, subscriptions)
 
 
 class PubSubDependency(dependencies.KubernetesDependency):
@@ -122,37 +164,28 @@ class PubSubDependency(dependencies.KubernetesDependency):
     definition = definitions_directory / 'pubsub-emulator.yaml'
     started_log = '[pubsub] INFO: Server started, listening on'
 
-    def ensure_topic_present(self, topic_name):
-        logger.debug('Ensuring that topic "{}" exists...'.format(topic_name))
-        try:
-            self.run_command('pubsub_add_topic', topic_name)
-        except sh.ErrorReturnCode as e:
-            if b'Topic already exists' not in e.stderr:
-                raise
-            else:
-                logger.debug('Topic "{}" exists'.format(topic_name))
-        else:
-            logger.debug('Topic "{}" created'.format(topic_name))
-
-    def ensure_subscription_present(self, topic_name, subscription_name):
-        logger.debug('Ensuring that subscription "{}" exists...'.format(subscription_name))
-        try:
-            self.run_command('pubsub_add_subscription', topic_name, subscription_name)
-        except sh.ErrorReturnCode as e:
-            if b'Subscription already exists' not in e.stderr:
-                raise
-            else:
-                logger.debug('Subscription "{}" exists'.format(subscription_name))
-        else:
-            logger.debug('Subscription "{}" created'.format(subscription_name))
+    def ensure_topics_present(self, topic_names, subscriptions=()):
+        """Creates topics and then subscriptions given as (topic, subscription) pairs in one shell session."""
+        topic_names = unique(topic_names)
+        subscriptions = unique(subscriptions)
+        logger.debug('Ensuring that topics {} and {} subscriptions exist...'.format(
+            ', '.join(topic_names), len(subscriptions)))
+        commands = [['pubsub_add_topic', topic_name] for topic_name in topic_names]
+        commands += [['pubsub_add_subscription', topic, subscription] for topic, subscription in subscriptions]
+        script = PUBSUB_ENSURE_FUNCTION + ''.join(
+            'ensure {} || exit 1\n'.format(' '.join(shlex.quote(arg) for arg in command)) for command in commands
+        )
+        self.run_command('sh', '-c', script)
 
 
 class Redis(Requirement):
     valid_arguments = ('name', )
     secret_name = 'redis-urls'
+    # Secrets are kept outside of the pod, so they are checked every time.
+    cacheable = False
 
     def run(self, arguments: dict):
-        dependency = RedisDependency()
+        dependency = RedisDependency(snapshot=self.snapshot, gateway=self.gateway)
         dependency.ensure_running()
         secret_key = arguments.get('name') or self.context['KUBE_SERVICE_NAME']
         secrets_manipulator = kubernetes.get_global_secrets_manipulator(self.context, self.secret_name)
@@ -189,10 +222,15 @@ class Cassandra(Requirement):
     valid_arguments = ('keyspace')
 
     def run(self, arguments: dict):
-        keyspace_name = arguments.get('keyspace') or self.context['KUBE_SERVICE_NAME']
-        dependency = CassandraDependency()
+        self.run_all([arguments])
+
+    def run_all(self, arguments_list: typing.List[dict]):
+        keyspace_names = [
+            arguments.get('keyspace') or self.context['KUBE_SERVICE_NAME'] for arguments in arguments_list
+        ]
+        dependency = CassandraDependency(snapshot=self.snapshot, gateway=self.gateway)
         dependency.ensure_running()
-        dependency.ensure_database_present(keyspace_name)
+        dependency.ensure_keyspaces_present(keyspace_names)
 
 
 class CassandraDependency(dependencies.KubernetesDependency):
@@ -200,20 +238,16 @@ class CassandraDependency(dependencies.KubernetesDependency):
     definition = definitions_directory / 'cassandra.yaml'
     started_log = "Created default superuser role 'cassandra'"
 
-    def ensure_database_present(self, keyspace_name):
-        keyspace_name = self.clean_keyspace_name(keyspace_name)
-        logger.debug('Ensuring that keyspace "{}" exists...'.format(keyspace_name))
-        query = ("create keyspace %s with replication = {'class': 'SimpleStrategy', "
-                 "'replication_factor': 1}" % keyspace_name)
-        try:
-            self.run_command('cqlsh', '-e', query)
-        except sh.ErrorReturnCode as e:
-            if b'already exists' not in e.stderr:
-                raise e
-            else:
-                logger.debug('Keyspace "{}" exists'.format(keyspace_name))
-        else:
-            logger.debug('Keyspace "{}" created'.format(keyspace_name))
+    def ensure_keyspaces_present(self, keyspace_names):
+        keyspace_names = unique(self.clean_keyspace_name(name) for name in keyspace_names)
+        logger.debug('Ensuring that keyspaces {} exist...'.format(', '.join(keyspace_names)))
+        # Starting cqlsh takes seconds, so all keyspaces are created with one call.
+        query = ' '.join(
+            "CREATE KEYSPACE IF NOT EXISTS {} WITH replication = {{'class': 'SimpleStrategy', "
+            "'replication_factor': 1}};".format(name)
+            for name in keyspace_names
+        )
+        self.run_command('cqlsh', '-e', query)
 
     def clean_keyspace_name(self, original):
         cleaned = original.replace('-', '_')
@@ -226,7 +260,7 @@ class RabbitMQ(Requirement):
     valid_arguments = ()
 
     def run(self, arguments: dict):
-        dependency = RabbitMQDependency()
+        dependency = RabbitMQDependency(snapshot=self.snapshot, gateway=self.gateway)
         dependency.ensure_running()
 
 
@@ -237,6 +271,11 @@ class RabbitMQDependency(dependencies.KubernetesDependency):
 
 
 class RequirementsDispatcher:
+    """
+    Requirements of different kinds are independent, so they are dispatched concurrently. Requirements of the same
+    kind share a dependency, so they are satisfied together once it is ready: all missing databases, topics or
+    keyspaces are created with a single command in its pod.
+    """
     commands = {
         'postgres': Postgres,
         'cockroachdb': CockroachDB,
@@ -246,25 +285,120 @@ class RequirementsDispatcher:
         'cassandra': Cassandra,
         'rabbitmq': RabbitMQ,
     }
+    dependency_classes = {
+        'postgres': PostgresDependency,
+        'cockroachdb': CockroachDBDependency,
+        'redis': RedisDependency,
+        'elastic': ElasticsearchDependency,
+        'pubsub': PubSubDependency,
+        'cassandra': CassandraDependency,
+        'rabbitmq': RabbitMQDependency,
+    }
 
     def __init__(self, context: dict):
         self.context = context
+        self.snapshot = None
+        self.satisfied = cache.JsonCache('dev-requirements')
+        self.satisfied_lock = threading.Lock()
+
+    @property
+    def concurrency(self) -> int:
+        return int(self.context.get('DEV_REQUIREMENTS_CONCURRENCY', settings.DEFAULT_DEV_REQUIREMENTS_CONCURRENCY))
 
     def dispatch_all(self, requirements: dict):
+        requirements_by_kind = collections.OrderedDict()
         for requirement in requirements:
             if 'kind' in requirement:
-                self.dispatch(requirement)
+                requirements_by_kind.setdefault(requirement['kind'], []).append(requirement)
             else:
                 logger.warning("Skipping requirement without specified kind. Requirement: {}".format(requirement))
-
-    def dispatch(self, requirement: dict):
-        arguments = requirement.copy()
-        kind = arguments.pop('kind')
-        logger.info('Checking requirement of kind "{}"...'.format(kind))
+        if not requirements_by_kind:
+            return
+        self.snapshot = self.take_snapshot(requirements_by_kind)
+        max_workers = max(1, min(len(requirements_by_kind), self.concurrency))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = collections.OrderedDict(
+                (kind, executor.submit(self.dispatch_kind, kind, kind_requirements))
+                for kind, kind_requirements in requirements_by_kind.items()
+            )
+        errors = [(kind, future.exception()) for kind, future in futures.items() if future.exception()]
+        for kind, error in errors:
+            logger.error('Requirement of kind "{}" failed: {}'.format(kind, error))
+        if errors:
+            raise errors[0][1]
+
+    def take_snapshot(self, kinds) -> dependencies.PodSnapshot:
+        names = [self.dependency_classes[kind].name for kind in kinds if kind in self.dependency_classes]
+        with profiling.span('dev requirements status'):
+            return dependencies.PodSnapshot.take(names, kubernetes_gateway.get_gateway(self.context))
+
+    def dispatch_kind(self, kind, requirements: list):
+        """Satisfies all requirements of one kind together, skipping those already satisfied in the same pod."""
+        logger.info('Checking requirements of kind "{}"...'.format(kind))
         try:
-            command = self.commands[kind](self.context)
+            command = self.commands[kind](self.context, snapshot=self.snapshot)
         except KeyError:
             logger.warning('Kind "{}" is not supported!'.format(kind))
-        else:
-            command(arguments)
-            logger.info('Requirement of kind "{}" satisfied'.format(kind))
+            return
+        dependency_instance = self.get_dependency_instance(kind)
+        pending = collections.OrderedDict()
+        for requirement in requirements:
+            arguments = requirement.copy()
+            arguments.pop('kind')
+            if not command.is_valid(arguments):
+                continue
+            key = self.get_requirement_key(kind, arguments)
+            if command.cacheable and dependency_instance and self.satisfied.get(key) == dependency_instance:
+                logger.info('Requirement {} of kind "{}" is already satisfied'.format(arguments, kind))
+            else:
+                pending[key] = arguments
+        if not pending:
+            return
+        start = time.perf_counter()
+        with profiling.span('dev requirement', kind=kind, count=len(pending)):
+            command.run_all(list(pending.values()))
+        logger.info('{} requirement(s) of kind "{}" satisfied in {:.1f}s'.format(
+            len(pending), kind, time.perf_counter() - start))
+        # Dependency could have been just started, so snapshot is read again.
+        dependency_instance = self.get_dependency_instance(kind)
+        if command.cacheable and dependency_instance:
+            with self.satisfied_lock:
+                satisfied = self.satisfied.load()
+                satisfied.update((key, dependency_instance) for key in pending)
+                self.satisfied.save(satisfied)
+
+    def get_requirement_key(self, kind, arguments: dict) -> str:
+        # Default names come from the service name, so it is a part of the key.
+        requirement = {'kind': kind, 'arguments': arguments, 'service': self.context.get('KUBE_SERVICE_NAME')}
+        return hashlib.sha256(json.dumps(requirement, sort_keys=True).encode()).hexdigest()
+
+    def get_dependency_instance(self, kind) -> typing.Optional[str]:
+        """
+        UID of the only ready pod of dependency with ids of its containers, or None if it can't be told from snapshot.
+        Container restart (e.g. OOM kill) gets new id, so in-memory state like pubsub topics is checked again.
+        """
+        if kind not in self.dependency_classes or not self.snapshot:
+            return None
+        pods = self.snapshot.get_pods(self.dependency_classes[kind].name)
+        if not pods or len(pods) != 1:
+            return None
+        status = kubernetes_gateway.PodStatus.from_pod(pods[0])
+        if not status.is_ready or status.is_deleted:
+            return None
+        uid = pods[0]['metadata'].get('uid')
+        container_ids = [status.get('containerID') for status in pods[0]['status'].get('containerStatuses') or []]
+        if not uid or not all(container_ids):
+            return None
+        return '{}/{}'.format(uid, ','.join(container_ids))
+
+
+def unique(items) -> list:
+    return list(collections.OrderedDict.fromkeys(items))
+
+
+def quote_literal(value) -> str:
+    return "'{}'".format(value.replace("'", "''"))
+
+
+def quote_identifier(name) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
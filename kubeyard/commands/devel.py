@@ -1,4 +1,7 @@
 import abc
+import collections
+import concurrent.futures
+import json
 import logging
 import os
 import re
@@ -13,14 +16,20 @@ import sh
 from cached_property import cached_property
 
 from kubeyard import base_command
+from kubeyard import docker_engine
+from kubeyard import io_utils
 from kubeyard import minikube
+from kubeyard import profiling
 from kubeyard import settings
+from kubeyard import subprocesses
 from kubeyard.commands import custom_script
 
 logger = logging.getLogger(__name__)
 
 MAX_JOB_RETRIES = 2
 
+DockerImage = collections.namedtuple('DockerImage', ['name', 'context', 'docker_args'])
+
 
 class BaseDevelCommand(base_command.InitialisedRepositoryCommand):
     context_vars = ['image_name', 'tag']
@@ -32,15 +41,17 @@ class BaseDevelCommand(base_command.InitialisedRepositoryCommand):
         self.use_default_implementation = use_default_implementation
         if self.is_development:
             self.cluster = self._prepare_cluster(self.context)
-            self.context.update(self.cluster.docker_env())
+            with profiling.span('docker-env'):
+                self.context.update(self.cluster.docker_env())
             self.context['HOST_VOLUMES'] = ' '.join(self.volumes)
-        self.docker_runner = DockerRunner(self.context)
+        self.docker_runner = get_docker_runner(self.context)
 
     @staticmethod
     def _prepare_cluster(context):
         logger.info('Checking if cluster is running and configured...')
-        cluster = minikube.ClusterFactory().get(context)
-        cluster.ensure_started()
+        with profiling.span('cluster check'):
+            cluster = minikube.ClusterFactory().get(context)
+            cluster.ensure_started()
         logger.info('Cluster is ready')
         return cluster
 
@@ -65,11 +76,17 @@ class BaseDevelCommand(base_command.InitialisedRepositoryCommand):
 
     @property
     def image(self):
-        return '{}/{}:{}'.format(self.docker_repository, self.image_name, self.tag)
+        return self.get_image(self.image_name)
 
     @property
     def latest_image(self):
-        return '{}/{}:latest'.format(self.docker_repository, self.image_name)
+        return self.get_latest_image(self.image_name)
+
+    def get_image(self, image_name):
+        return '{}/{}:{}'.format(self.docker_repository, image_name, self.tag)
+
+    def get_latest_image(self, image_name):
+        return '{}/{}:latest'.format(self.docker_repository, image_name)
 
     @property
     def docker_repository(self):
@@ -121,7 +138,7 @@ class BaseDevelCommand(base_command.InitialisedRepositoryCommand):
 
     @cached_property
     def _id(self):
-        return str(sh.id())
+        return str(subprocesses.id())
 
     @cached_property
     def uid(self) -> str:
@@ -132,20 +149,77 @@ class BaseDevelCommand(base_command.InitialisedRepositoryCommand):
         return re.findall(r"gid=(\d+)", self._id)[0]
 
 
+class MultiImageDevelCommand(BaseDevelCommand):
+    """
+    Base for commands handling several images at once: given with repeated --image-name or declared in
+    `docker_images` in kubeyard.yml. Images are processed concurrently, at most one per CPU, and output of each
+    of them is prefixed with image name.
+    """
+
+    def __init__(self, *, image_name=(), **kwargs):
+        self.image_names = tuple(image_name or ())
+        super().__init__(image_name=self.image_names[0] if self.image_names else None, **kwargs)
+
+    @property
+    def image_name(self):
+        return self._image_name or self.context.get('DOCKER_IMAGE_NAME') or self.images[0].name
+
+    @property
+    def images(self) -> typing.List[DockerImage]:
+        declared = collections.OrderedDict(
+            (image['name'], image) for image in self.context.get('DOCKER_IMAGES') or []
+        )
+        names = self.image_names or list(declared) or [self._image_name or self.context['DOCKER_IMAGE_NAME']]
+        images = []
+        for name in names:
+            configuration = declared.get(name, {})
+            image_context = self.project_dir / configuration['context'] if 'context' in configuration else None
+            images.append(DockerImage(name, image_context, configuration.get('docker-args', '')))
+        return images
+
+    def run_for_each_image(self, action: typing.Callable, description: str):
+        """
+        Calls `action(image, output)` for every image. `output` is `sh` output callback prefixing lines with image
+        name or None if there is only one image.
+        """
+        images = self.images
+        if len(images) == 1:
+            action(images[0], None)
+            return
+        workers = min(len(images), os.cpu_count() or 1)
+        logger.info('{} {} images ({} at once)...'.format(description, len(images), workers))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = collections.OrderedDict(
+                (executor.submit(action, image, io_utils.PrefixedOutput('[{}] '.format(image.name))), image)
+                for image in images
+            )
+        failed = []
+        for future, image in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                logger.error('{} image "{}" failed: {}'.format(description, image.name, e))
+                failed.append(image.name)
+        if failed:
+            raise base_command.CommandException('{} failed for images: {}'.format(description, ', '.join(failed)))
+
+
 class DockerRunner:
     def __init__(self, context):
         self.context = context
 
     def run(self, *args, **kwargs):
         if self.run_can_be_waited(*args, **kwargs):
-            process: sh.RunningCommand = sh.docker(*args, _env=self.sh_env, _bg_exc=False, **kwargs)
+            process: sh.RunningCommand = subprocesses.docker(*args, _env=self.sh_env, _bg_exc=False, **kwargs)
             try:
                 process.wait()
             except KeyboardInterrupt as e:
                 logger.info("Stopping running command...")
                 process.signal(signal.SIGTERM)
                 try:
-                    children_pids = sh.ps('-o', 'pid', '--ppid', process.pid, '--no-headers').strip().split(' ')
+                    children_pids = subprocesses.ps(
+                        '-o', 'pid', '--ppid', process.pid, '--no-headers',
+                    ).strip().split(' ')
                 except sh.ErrorReturnCode_1:
                     pass
                 else:
@@ -153,15 +227,16 @@ class DockerRunner:
                         os.kill(int(pid), signal.SIGTERM)
                 raise e
         else:
-            process: sh.RunningCommand = sh.docker(*args, _env=self.sh_env, **kwargs)
+            process: sh.RunningCommand = subprocesses.docker(*args, _env=self.sh_env, **kwargs)
         return process
 
     def run_can_be_waited(self, *args, _piped=False, _iter=False, _iter_noblock=False, **kwargs) -> bool:
         """Check special cases when sh require to not use .wait() method"""
         return not any((_piped, _iter, _iter_noblock))
 
-    def run_with_output(self, *args, **kwargs):
-        return self.run(*args, _out=sys.stdout.buffer, _err=sys.stdout.buffer, **kwargs)
+    def run_with_output(self, *args, output=None, **kwargs):
+        output = output or sys.stdout.buffer
+        return self.run(*args, _out=output, _err=output, **kwargs)
 
     @cached_property
     def sh_env(self):
@@ -171,7 +246,199 @@ class DockerRunner:
 
     @contextmanager
     def temporary_volume(self):
-        volume_name = self.run('volume', 'create').strip()
+        volume_name = self.create_volume()
         logger.debug('volume_name: {}'.format(volume_name))
         yield volume_name
-        self.run('volume', 'remove', volume_name)
+        self.remove_volume(volume_name)
+
+    def inspect_container(self, name) -> typing.Optional[dict]:
+        try:
+            output = self.run('inspect', '--type', 'container', name)
+        except sh.ErrorReturnCode_1:
+            return None
+        else:
+            return json.loads(str(output))[0]
+
+    def start_container(self, name):
+        self.run('start', name)
+
+    def remove_container(self, name, *, volumes=False) -> bool:
+        try:
+            self.run('rm', '--force', *(['--volumes'] if volumes else []), name)
+        except sh.ErrorReturnCode_1 as e:
+            logger.debug(e)
+            return False
+        else:
+            return True
+
+    def container_logs(self, name, *, follow=False, since=None) -> typing.Iterable[str]:
+        args = [*(['--follow'] if follow else []), *(['--since', str(int(since))] if since is not None else [])]
+        return self.run('logs', *args, name, _err_to_out=True, _iter='out')
+
+    def find_containers(self, *, label) -> typing.List[str]:
+        output = self.run('ps', '--all', '--filter', 'label={}'.format(label), '--format', '{{.Names}}')
+        return str(output).split()
+
+    def exec_container(self, name, *command) -> typing.Tuple[int, str]:
+        try:
+            output = self.run('exec', name, *command, _err_to_out=True)
+        except sh.ErrorReturnCode as e:
+            return e.exit_code, e.stdout.decode(errors='replace')
+        else:
+            return 0, str(output)
+
+    def inspect_image(self, name) -> typing.Optional[dict]:
+        try:
+            output = self.run('image', 'inspect', name)
+        except sh.ErrorReturnCode_1:
+            return None
+        else:
+            return json.loads(str(output))[0]
+
+    def find_images(self, *, label) -> typing.List[str]:
+        return str(self.run('image', 'ls', '--quiet', '--no-trunc', '--filter', 'label={}'.format(label))).split()
+
+    def tag_image(self, image, target):
+        self.run('tag', image, target)
+
+    def push_image(self, image, progress: typing.Callable):
+        self.run('push', image, _out=progress, _err=progress)
+
+    def create_volume(self, name=None, *, labels=None) -> str:
+        label_args = [arg for key, value in (labels or {}).items() for arg in ('--label', '{}={}'.format(key, value))]
+        return self.run('volume', 'create', *label_args, *([name] if name else [])).strip()
+
+    def inspect_volume(self, name) -> typing.Optional[dict]:
+        try:
+            output = self.run('volume', 'inspect', name)
+        except sh.ErrorReturnCode_1:
+            return None
+        else:
+            return json.loads(str(output))[0]
+
+    def find_volumes(self, *, label) -> typing.List[str]:
+        return str(self.run('volume', 'ls', '--quiet', '--filter', 'label={}'.format(label))).split()
+
+    def remove_volume(self, name):
+        self.run('volume', 'remove', name)
+
+
+class EngineApiDockerRunner(DockerRunner):
+    """
+    Uses Docker Engine API for short housekeeping calls (inspect, start, remove, exec, logs, volumes), so they share
+    keep-alive connections instead of forking docker CLI every time. Push also uses the API, so its progress
+    messages tell how many bytes were uploaded. Other commands streaming their output to the terminal (`run`,
+    `build`) still go through docker CLI. Falls back to CLI if the API endpoint does not answer.
+    """
+
+    @cached_property
+    def engine(self) -> docker_engine.DockerEngineClient:
+        return docker_engine.DockerEngineClient(self.sh_env)
+
+    @cached_property
+    def engine_available(self) -> bool:
+        return self.engine.ping()
+
+    def inspect_container(self, name) -> typing.Optional[dict]:
+        if not self.engine_available:
+            return super().inspect_container(name)
+        try:
+            return self.engine.inspect_container(name)
+        except docker_engine.NotFound:
+            return None
+
+    def start_container(self, name):
+        if not self.engine_available:
+            return super().start_container(name)
+        self.engine.start_container(name)
+
+    def remove_container(self, name, *, volumes=False) -> bool:
+        if not self.engine_available:
+            return super().remove_container(name, volumes=volumes)
+        try:
+            self.engine.remove_container(name, force=True, volumes=volumes)
+        except docker_engine.NotFound as e:
+            logger.debug(e)
+            return False
+        else:
+            return True
+
+    def container_logs(self, name, *, follow=False, since=None) -> typing.Iterable[str]:
+        if not self.engine_available:
+            return super().container_logs(name, follow=follow, since=since)
+        return self.engine.container_logs(name, follow=follow, since=since)
+
+    def find_containers(self, *, label) -> typing.List[str]:
+        if not self.engine_available:
+            return super().find_containers(label=label)
+        return self.engine.find_containers(label=label)
+
+    def exec_container(self, name, *command) -> typing.Tuple[int, str]:
+        if not self.engine_available:
+            return super().exec_container(name, *command)
+        try:
+            return self.engine.exec_container(name, command)
+        except docker_engine.DockerEngineError as e:
+            return -1, e.message
+
+    def inspect_image(self, name) -> typing.Optional[dict]:
+        if not self.engine_available:
+            return super().inspect_image(name)
+        try:
+            return self.engine.inspect_image(name)
+        except docker_engine.NotFound:
+            return None
+
+    def find_images(self, *, label) -> typing.List[str]:
+        if not self.engine_available:
+            return super().find_images(label=label)
+        return self.engine.find_images(label=label)
+
+    def tag_image(self, image, target):
+        if not self.engine_available:
+            return super().tag_image(image, target)
+        self.engine.tag_image(image, target)
+
+    def push_image(self, image, progress: typing.Callable):
+        if not self.engine_available:
+            return super().push_image(image, progress)
+        for message in self.engine.push_image(image):
+            progress.add_message(message)
+
+    def create_volume(self, name=None, *, labels=None) -> str:
+        if not self.engine_available:
+            return super().create_volume(name, labels=labels)
+        return self.engine.create_volume(name, labels=labels)
+
+    def inspect_volume(self, name) -> typing.Optional[dict]:
+        if not self.engine_available:
+            return super().inspect_volume(name)
+        try:
+            return self.engine.inspect_volume(name)
+        except docker_engine.NotFound:
+            return None
+
+    def find_volumes(self, *, label) -> typing.List[str]:
+        if not self.engine_available:
+            return super().find_volumes(label=label)
+        return self.engine.find_volumes(label=label)
+
+    def remove_volume(self, name):
+        if not self.engine_available:
+            return super().remove_volume(name)
+        self.engine.remove_volume(name)
+
+
+DOCKER_RUNNERS = {
+    'cli': DockerRunner,
+    'api': EngineApiDockerRunner,
+}
+
+
+def get_docker_runner(context) -> DockerRunner:
+    client = context.get('KUBEYARD_DOCKER_CLIENT', settings.DEFAULT_KUBEYARD_DOCKER_CLIENT)
+    if client not in DOCKER_RUNNERS:
+        raise base_command.CommandException('"kubeyard_docker_client" should be one of: {}.'.format(
+            ', '.join('"{}"'.format(name) for name in DOCKER_RUNNERS),
+        ))
+    return DOCKER_RUNNERS[client](context)
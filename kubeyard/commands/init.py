@@ -60,11 +60,11 @@ class InitType(metaclass=abc.ABCMeta):
 
 
 class PythonPackageInitType(InitType):
-    name = 'python'
+    name = settings.PYTHON_INIT_TEMPLATE_NAME
 
 
 class PythonDjangoInitType(InitType):
-    name = 'django'
+    name = settings.DJANGO_INIT_TEMPLATE_NAME
     prompted_context = InitType.prompted_context + [
         context_factories.PromptedContext(
             variable='SECRET_KEY',
@@ -75,7 +75,7 @@ class PythonDjangoInitType(InitType):
 
 
 class EmberInitType(InitType):
-    name = 'ember'
+    name = settings.EMBER_INIT_TEMPLATE_NAME
     prompted_context = InitType.prompted_context + [
         context_factories.PromptedContext(
             variable='KUBE_LIVE_RELOAD_PORT',
@@ -1,10 +1,23 @@
-from kubeyard.commands.devel import BaseDevelCommand
+import concurrent.futures
+import logging
+import re
+import sys
 
+from kubeyard import io_utils
+from kubeyard import profiling
+from kubeyard.commands.devel import DockerImage
+from kubeyard.commands.devel import MultiImageDevelCommand
 
-class PushCommand(BaseDevelCommand):
+logger = logging.getLogger(__name__)
+
+
+class PushCommand(MultiImageDevelCommand):
     """
     Runs `docker push` on docker image built by build command. It also tags image as latest adn push it as well.
-    Can be overridden in <project_dir>/sripts/push.
+    Both tags are pushed at the same time, so layers are uploaded once. Can be overridden in <project_dir>/sripts/push.
+
+    If there are several images declared in `docker_images` in kubeyard.yml (see build command), all of them are
+    pushed concurrently.
 
     If kubeyard is set up in development mode it uses minikube as docker host.
 
@@ -13,6 +26,76 @@ class PushCommand(BaseDevelCommand):
     custom_script_name = 'push'
 
     def run_default(self):
-        self.docker_with_output('push', self.image)
-        self.docker_with_output('tag', self.image, self.latest_image)
-        self.docker_with_output('push', self.latest_image)
+        self.run_for_each_image(self.push_image, 'Pushing')
+
+    def push_image(self, docker_image: DockerImage, output=None):
+        image = self.get_image(docker_image.name)
+        latest_image = self.get_latest_image(docker_image.name)
+        if image == latest_image:
+            self.push_tag(image, output)
+            return
+        self.docker_runner.tag_image(image, latest_image)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [
+                executor.submit(self.push_tag, tagged_image, io_utils.PrefixedOutput('[{}] '.format(tag), output))
+                for tagged_image, tag in ((image, self.tag), (latest_image, 'latest'))
+            ]
+        for future in futures:
+            future.result()
+
+    def push_tag(self, image, output=None):
+        progress = PushProgress(output)
+        with profiling.span('image push', image=image):
+            self.docker_runner.push_image(image, progress)
+        logger.info('Pushed "{}": {}.'.format(image, progress.summary))
+
+
+class PushProgress:
+    """
+    Passes push output through and collects which layers were uploaded and which were already in the registry.
+    Uploaded bytes are known only if push goes through Docker Engine API, docker CLI doesn't print them.
+    """
+    layer_pattern = re.compile(r'^(\w+): (Pushed|Layer already exists|Mounted from .*)$')
+
+    def __init__(self, output=None):
+        self.output = output or sys.stdout.write
+        self.pushed = set()
+        self.skipped = set()
+        self.layer_bytes = {}
+
+    def __call__(self, line):
+        self.output(line)
+        layer = self.layer_pattern.match(line.strip())
+        if layer:
+            self.record(*layer.groups())
+
+    def add_message(self, message):
+        layer = message.get('id')
+        status = message.get('status', '')
+        if status == 'Pushing':
+            progress = message.get('progressDetail') or {}
+            self.layer_bytes[layer] = max(self.layer_bytes.get(layer, 0), progress.get('current', 0))
+        elif layer and status:
+            self.output('{}: {}\n'.format(layer, status))
+            self.record(layer, status)
+        elif status:
+            self.output(status + '\n')
+
+    def record(self, layer, status):
+        if status == 'Pushed':
+            self.pushed.add(layer)
+        elif status == 'Layer already exists' or status.startswith('Mounted from'):
+            self.skipped.add(layer)
+
+    @property
+    def uploaded_bytes(self):
+        if not self.layer_bytes:
+            return None
+        return sum(self.layer_bytes.get(layer, 0) for layer in self.pushed)
+
+    @property
+    def summary(self):
+        summary = '{} layers uploaded'.format(len(self.pushed))
+        if self.uploaded_bytes is not None:
+            summary += ' ({:.1f} MB)'.format(self.uploaded_bytes / 1e6)
+        return summary + ', {} skipped (already in registry)'.format(len(self.skipped))
@@ -4,6 +4,8 @@ import sh
 
 from cached_property import cached_property
 
+from kubeyard import kubernetes_gateway
+from kubeyard import subprocesses
 from kubeyard.base_command import CommandException
 from kubeyard.commands.devel import BaseDevelCommand
 
@@ -26,7 +28,7 @@ class ShellCommand(BaseDevelCommand):
 
     def run_default(self):
         try:
-            sh.kubectl.exec(
+            subprocesses.kubectl.exec(
                 "-it",
                 self.pod_name,
                 "-c", self.container_name,
@@ -40,7 +42,7 @@ class ShellCommand(BaseDevelCommand):
             pass
         finally:
             if self.after_command:
-                sh.kubectl.exec(
+                subprocesses.kubectl.exec(
                     self.pod_name,
                     "-c", self.container_name,
                     "--",
@@ -50,8 +52,8 @@ class ShellCommand(BaseDevelCommand):
 
     @cached_property
     def pod_name(self) -> str:
+        all_pods = [pod['metadata']['name'] for pod in kubernetes_gateway.get_gateway(self.context).list_pods()]
         if self.pod:
-            all_pods = sh.kubectl.get.pods('-o', 'jsonpath={.items[*].metadata.name}').split()
             # Exact match
             if self.pod in all_pods:
                 return self.pod
@@ -64,9 +66,9 @@ class ShellCommand(BaseDevelCommand):
                 logger.warning(f"Found more than one pod. Using '{pods[0]}'")
             return pods[0]
         else:
-            for pod in sh.kubectl.get.pods(_iter='out'):
+            for pod in all_pods:
                 if self.image_name in pod:
-                    return pod.split()[0]
+                    return pod
         raise CommandException("Container not found, please specify container or fix project setup.")
 
     @cached_property
@@ -78,7 +80,7 @@ class ShellCommand(BaseDevelCommand):
 
     @cached_property
     def username(self) -> str:
-        return str(sh.whoami()).strip()
+        return str(subprocesses.whoami()).strip()
 
     @property
     def before_command(self):
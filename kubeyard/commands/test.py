@@ -1,16 +1,54 @@
 import abc
-import json
+import concurrent.futures
+import contextlib
+import enum
+import fcntl
+import hashlib
 import logging
+import pathlib
+import shutil
 import sys
+import time
 import typing
 
 import sh
 
+from cached_property import cached_property
+
+from kubeyard import cache
+from kubeyard import content_hash
+from kubeyard import docker_engine
+from kubeyard import io_utils
+from kubeyard import profiling
+from kubeyard import settings
+from kubeyard.base_command import CommandException
+from kubeyard.base_command import InitialisedRepositoryCommand
+from kubeyard.commands import test_database_pool
+from kubeyard.commands import test_results
+from kubeyard.commands import test_selection
 from kubeyard.commands.devel import BaseDevelCommand
 from kubeyard.commands.devel import DockerRunner
+from kubeyard.commands.devel import get_docker_runner
 
 logger = logging.getLogger(__name__)
 
+SNAPSHOT_LABEL = 'kubeyard.database-snapshot'
+MIGRATION_HASH_LABEL = 'kubeyard.migration-hash'
+MIGRATION_SOURCES_IGNORE = ('**/__pycache__', '**/*.pyc', '.git')
+SNAPSHOTS_TO_KEEP = 3
+# Written as the last step of saving a snapshot, so snapshots left by interrupted copies are not restored.
+SNAPSHOT_COMPLETE_MARKER = '.kubeyard-snapshot-complete'
+SNAPSHOT_INCOMPLETE_EXIT_CODE = 3
+PROBE_INITIAL_DELAY = 0.1
+PROBE_MAX_DELAY = 2.0
+# Slim images (e.g. alpine) have no bash, but usually have busybox nc.
+TCP_PROBE_SCRIPT = (
+    'if command -v bash >/dev/null 2>&1; then exec bash -c "echo > /dev/tcp/127.0.0.1/{port}"; fi; '
+    'if command -v nc >/dev/null 2>&1; then exec nc -z 127.0.0.1 {port}; fi; '
+    'exit 127'
+)
+FAST_MODE_POSTGRES_OPTIONS = ('-c', 'fsync=off', '-c', 'synchronous_commit=off', '-c', 'full_page_writes=off')
+
 
 class TestCommand(BaseDevelCommand):
     """
@@ -48,57 +86,336 @@ class TestCommand(BaseDevelCommand):
     test_database_type: postgres <- Available types: `postgres`, `cockroach`. `postgres` is default.
     test_database_image: postgres:10.3
     test_database_name: test
+    test_database_readiness_probe: sql <- Optional. Available probes: `pg_isready` (default for postgres),
+                                          `sql` (default for cockroach), `tcp` (uses bash or nc in database image,
+                                          falls back to `log` without them), `log`.
+    test_database_ready_timeout: 120   <- Optional. Seconds to wait for database.
+    test_database_fast_mode: true      <- Optional. Keeps data in memory (tmpfs or in-memory store) and turns off
+                                          durability (fsync etc.). Database snapshots are not used in this mode.
+                                          Use --force-recreate-db after changing it on dev environment.
+    test_database_data_path: /data     <- Optional. Data directory in database container, by default PGDATA of
+                                          postgres image or /cockroach/cockroach-data.
+
+    With --shards N tests run in N containers at once, each of them with its own database. It requires command
+    printing ids of tests (one per line). Tests are collected once (test options are passed to the collect command)
+    and every shard runs test command with its part of test ids, preceded by test options starting with dash
+    (pass their values as `--option=value`, e.g. `--cov=package`, other positional arguments are dropped).
+    Shard containers get KUBEYARD_SHARD_INDEX and KUBEYARD_SHARD_COUNT environment variables.
+
+    \b
+    Example:
+    test_collect_command: collect_tests
+
+    In development mode database container is labelled with hash of migration inputs: tested image, migration
+    command, database image and migration sources (test_migration_paths, none by default). Migrations run again
+    only if the hash changes, use --force-migrate-db to run them anyway.
+
+    Migrated database can be kept in a docker volume, so migrations run only once for given migration inputs.
+    Databases created from scratch (in CI or with --force-recreate-db) are restored from the snapshot.
+
+    \b
+    Example:
+    test_database_snapshots: true
+    test_migration_paths:  <- Optional. Paths (relative to project directory) which migrations depend on.
+    - docker/source/migrations
+
+    Outside of development mode database may be leased from a pool of pre-started containers shared by test runs
+    on the host (see `kubeyard test-db pool`). Missing containers are created in background.
+
+    \b
+    Example:
+    test_database_pool_size: 4
+
+    Test command may write JUnit XML reports to directory given in KUBEYARD_TEST_RESULTS_DIR environment variable
+    (e.g. `pytest --junitxml=$KUBEYARD_TEST_RESULTS_DIR/junit.xml`). Reports are kept in
+    <project_dir>/.kubeyard/test-results and durations of tests are recorded in
+    <project_dir>/.kubeyard/test-timings.json.
+    Collected tests are split between shards by their recorded durations, so shards finish at about the same time.
+
+    \b
+    Example:
+    test_junit_xml: true
+
+    With --changed [REF] (HEAD by default) only test modules affected by files changed since REF are run. Python
+    modules in paths from dev_mounted_paths mounted in tests are scanned for imports, test modules importing changed
+    modules (directly or not) are passed to test command as paths in the container. Whole suite runs if changed
+    files can't be mapped to modules (e.g. conftest.py or non-python files).
 
     """
     custom_script_name = 'test'
     context_vars = ["force_recreate_database", "force_migrate_database"]
 
-    def __init__(self, *, force_recreate_database, force_migrate_database, test_options, **kwargs):
+    def __init__(
+            self, *, force_recreate_database, force_migrate_database, shards, changed_ref, test_options, **kwargs,
+    ):
         super().__init__(**kwargs)
         self.test_options = test_options
         self.force_recreate_database = force_recreate_database
         self.force_migrate_database = force_migrate_database
+        self.shards = shards
+        self.changed_ref = changed_ref
 
     @property
     def args(self) -> list:
         return list(self.test_options)
 
     def run_default(self):
-        if self.context.get('TESTS_WITH_DATABASE'):
-            database_class = DATABASE_MAP[self.context.get("TEST_DATABASE_TYPE", "postgres")]
-            with database_class(
-                    is_development=self.is_development,
-                    volumes=self.volumes,
-                    context=self.context,
-                    tag=self.tag,
-                    docker_runner=self.docker_runner,
-                    tested_image_name=self.image,
-                    force_recreate=self.force_recreate_database,
-                    force_migrate=self.force_migrate_database,
-            ) as database:
-                self.run_tests(database)
+        if self.changed_ref:
+            changed_tests = self.select_changed_tests()
+            if changed_tests is not None and not changed_tests:
+                logger.info('No tests are affected by changes since {}.'.format(self.changed_ref))
+                return
+            self.test_options = list(self.test_options) + (changed_tests or [])
+        if self.shards > 1:
+            self.run_sharded_tests()
         else:
-            self.run_tests()
+            with self.database() as database:
+                self.run_tests(database)
+
+    def database(self, name_suffix='') -> typing.ContextManager[typing.Optional['Database']]:
+        if not self.context.get('TESTS_WITH_DATABASE'):
+            return contextlib.nullcontext()
+        database_class = DATABASE_MAP[self.context.get("TEST_DATABASE_TYPE", "postgres")]
+        if self.context.get('TEST_DATABASE_POOL_SIZE') and not self.is_development:
+            pooled_database = self.lease_pooled_database(database_class)
+            if pooled_database:
+                return pooled_database
+        return database_class(
+            is_development=self.is_development,
+            volumes=self.volumes,
+            context=self.context,
+            tag=self.tag,
+            docker_runner=self.docker_runner,
+            tested_image_name=self.image,
+            force_recreate=self.force_recreate_database,
+            force_migrate=self.force_migrate_database,
+            name_suffix=name_suffix,
+            migration_sources=self.migration_sources,
+        )
+
+    def lease_pooled_database(self, database_class) -> typing.Optional['PooledDatabase']:
+        pool = get_test_database_pool(self.context, self.docker_runner)
+        lease = pool.lease()
+        if not pool.is_full:
+            pool.spawn_refill(self.project_dir)
+        if lease is None:
+            logger.info('There is no free database in the pool.')
+            return None
+        database = database_class(
+            is_development=self.is_development,
+            volumes=self.volumes,
+            context=self.context,
+            tag=self.tag,
+            docker_runner=self.docker_runner,
+            tested_image_name=self.image,
+            container_name=lease.container_name,
+        )
+        return PooledDatabase(database, lease)
+
+    @property
+    def migration_sources(self) -> typing.List[pathlib.Path]:
+        return [self.project_dir / path for path in self.context.get('TEST_MIGRATION_PATHS') or []]
+
+    def select_changed_tests(self) -> typing.Optional[typing.List[str]]:
+        """Paths of affected test modules in the container, None if the whole suite has to run."""
+        source_roots = [
+            test_selection.SourceRoot(
+                host_path=(self.project_dir / volume['host-path']).resolve(),
+                container_path=volume['mount-in-tests']['path'],
+            )
+            for volume in self.context.get('DEV_MOUNTED_PATHS', [])
+            if volume.get('mount-in-tests', {}).get('image-name') == self.image_name
+        ]
+        if not source_roots:
+            raise CommandException('--changed requires dev_mounted_paths mounted in tests of image {}.'.format(
+                self.image_name,
+            ))
+        graph = test_selection.ImportGraph(self.project_dir, source_roots)
+        changed_files = [
+            path for path in test_selection.get_changed_files(self.project_dir, self.changed_ref)
+            if graph.find_source_root(path)
+        ]
+        unmapped = [
+            path for path in changed_files
+            if path.name in test_selection.GLOBAL_FILES or not graph.get_path_module_name(path)
+        ]
+        if unmapped:
+            logger.info('Running all tests, changes of {} may affect any of them.'.format(
+                ', '.join(str(path.relative_to(self.project_dir.resolve())) for path in unmapped[:3]),
+            ))
+            return None
+        affected = graph.get_dependants(changed_files)
+        test_modules = sorted(
+            graph.get_container_path(path) for path in affected if test_selection.is_test_module(path)
+        )
+        logger.info('{} changed files affect {} test modules.'.format(len(changed_files), len(test_modules)))
+        return test_modules
 
     def run_tests(self, database: 'Database' = None):
         logger.info('Running tests...')
+        results_directory = self.prepare_results_directory('run')
         try:
-            self.docker_runner.run_with_output(
+            with profiling.span('test run'):
+                self.run_test_container(database, self.test_options, results_directory=results_directory)
+        except sh.ErrorReturnCode_1 as e:
+            logger.debug(e)
+            sys.exit(1)
+        finally:
+            self.record_timings([results_directory])
+
+    def run_test_container(
+            self,
+            database: typing.Optional['Database'],
+            test_args,
+            *,
+            environment=(),
+            results_directory: pathlib.Path = None,
+            output=None,
+    ):
+        environment = list(environment)
+        results_args = []
+        if results_directory:
+            environment.append(('KUBEYARD_TEST_RESULTS_DIR', test_results.CONTAINER_RESULTS_DIR))
+            host_path = self.get_host_path(results_directory)
+            results_args = ['-v', '{}:{}'.format(host_path, test_results.CONTAINER_RESULTS_DIR)]
+        environment_args = [arg for name, value in environment for arg in ('-e', '{}={}'.format(name, value))]
+        self.docker_runner.run_with_output(
+            'run',
+            '--rm',
+            '--init',
+            '--net={}'.format(database.network if database else 'none'),
+            *self.volumes,
+            *results_args,
+            *environment_args,
+            self.image,
+            self.context['TEST_COMMAND'],
+            *test_args,
+            output=output,
+        )
+
+    def run_sharded_tests(self):
+        shard_args = self.split_tests()
+        if not shard_args:
+            logger.warning('No tests collected.')
+            return
+        logger.info('Running tests in {} shards...'.format(len(shard_args)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(shard_args)) as executor:
+            futures = [
+                executor.submit(self.run_shard, index, len(shard_args), args)
+                for index, args in enumerate(shard_args)
+            ]
+        exit_codes = [future.result() for future in futures]
+        self.record_timings([self.get_results_directory('shard-{}'.format(index + 1)) for index in range(len(futures))])
+        failed = [str(index + 1) for index, exit_code in enumerate(exit_codes) if exit_code != 0]
+        if failed:
+            logger.error('Tests failed in shards: {}.'.format(', '.join(failed)))
+            sys.exit(next(exit_code for exit_code in exit_codes if exit_code != 0))
+
+    def split_tests(self) -> typing.List[typing.List[str]]:
+        if not self.context.get('TEST_COLLECT_COMMAND'):
+            # Otherwise every shard would run the whole suite.
+            raise CommandException('--shards requires test_collect_command in config/kubeyard.yml.')
+        test_ids = self.collect_tests()
+        shard_count = min(self.shards, len(test_ids))
+        if not shard_count:
+            return []
+        durations = test_results.TestTimings(self.project_dir).estimate(test_ids)
+        options = get_option_args(self.test_options)
+        return [options + shard_ids for shard_ids in test_results.split_by_duration(durations, shard_count)]
+
+    def collect_tests(self) -> typing.List[str]:
+        logger.info('Collecting tests...')
+        with profiling.span('test collect'):
+            output = self.docker_runner.run(
                 'run',
                 '--rm',
-                '--init',
-                '--net={}'.format(database.network if database else 'none'),
+                '--net=none',
                 *self.volumes,
                 self.image,
-                self.context['TEST_COMMAND'],
+                self.context['TEST_COLLECT_COMMAND'],
                 *self.test_options,
             )
-        except sh.ErrorReturnCode_1 as e:
-            logger.debug(e)
-            sys.exit(1)
+        test_ids = [line.strip() for line in str(output).splitlines() if line.strip()]
+        logger.info('Collected {} tests.'.format(len(test_ids)))
+        return test_ids
+
+    def run_shard(self, index, shard_count, test_args) -> int:
+        output = io_utils.PrefixedOutput('[shard {}] '.format(index + 1))
+        environment = (('KUBEYARD_SHARD_INDEX', index), ('KUBEYARD_SHARD_COUNT', shard_count))
+        results_directory = self.prepare_results_directory('shard-{}'.format(index + 1))
+        start = time.perf_counter()
+        exit_code = 0
+        with profiling.span('test shard', shard=index + 1):
+            with self.database(name_suffix='-shard{}'.format(index + 1)) as database:
+                try:
+                    self.run_test_container(
+                        database,
+                        test_args,
+                        environment=environment,
+                        results_directory=results_directory,
+                        output=output,
+                    )
+                except sh.ErrorReturnCode as e:
+                    exit_code = e.exit_code
+        logger.info('Shard {} finished in {:.1f}s with exit code {}.'.format(
+            index + 1, time.perf_counter() - start, exit_code,
+        ))
+        return exit_code
+
+    def get_results_directory(self, name) -> pathlib.Path:
+        return self.project_dir / test_results.RESULTS_DIR / name
+
+    def prepare_results_directory(self, name) -> typing.Optional[pathlib.Path]:
+        if not self.context.get('TEST_JUNIT_XML'):
+            return None
+        results_directory = self.get_results_directory(name)
+        shutil.rmtree(str(results_directory), ignore_errors=True)
+        results_directory.mkdir(parents=True)
+        # Test container may run as any user.
+        results_directory.chmod(0o777)
+        return results_directory
+
+    def get_host_path(self, path: pathlib.Path) -> pathlib.Path:
+        if self.is_development:
+            return self.cluster.get_mounted_project_dir(self.project_dir) / path.relative_to(self.project_dir)
+        return path
+
+    def record_timings(self, results_directories: typing.Iterable[typing.Optional[pathlib.Path]]):
+        if not self.context.get('TEST_JUNIT_XML'):
+            return
+        durations = {}
+        for results_directory in results_directories:
+            if results_directory and results_directory.is_dir():
+                durations.update(test_results.parse_junit_results(results_directory))
+        if not durations:
+            logger.warning('Test command did not write JUnit XML to KUBEYARD_TEST_RESULTS_DIR.')
+        test_results.TestTimings(self.project_dir).update(durations)
+
+
+class ContainerState(enum.Enum):
+    MISSING = 'missing'
+    STOPPED = 'stopped'
+    RUNNING = 'running'
+    HEALTHY = 'healthy'  # Running and passed readiness probe (or docker healthcheck).
+
+    @classmethod
+    def from_container_info(cls, container_info: typing.Optional[dict]) -> 'ContainerState':
+        if container_info is None:
+            return cls.MISSING
+        if not container_info['State']['Running']:
+            return cls.STOPPED
+        if (container_info['State'].get('Health') or {}).get('Status') == 'healthy':
+            return cls.HEALTHY
+        return cls.RUNNING
 
 
 class Database(metaclass=abc.ABCMeta):
+    """
+    Container state is inspected once and then tracked by transitions made by this class, so the whole lifecycle
+    costs at most one `inspect` call.
+    """
+    migration_state = cache.JsonCache('test-database-migrations')
+
     def __init__(
             self,
             is_development: bool,
@@ -109,6 +426,10 @@ class Database(metaclass=abc.ABCMeta):
             tested_image_name: str,
             force_recreate: bool = False,
             force_migrate: bool = False,
+            name_suffix: str = '',
+            migration_sources: typing.Iterable[pathlib.Path] = (),
+            container_name: str = None,
+            labels: dict = None,
     ):
         self.is_development = is_development
         self.volumes = volumes
@@ -118,20 +439,37 @@ class Database(metaclass=abc.ABCMeta):
         self.tested_image_name = tested_image_name
         self.force_migrate = force_migrate
         self.force_recreate = force_recreate
+        self.name_suffix = name_suffix
+        self.migration_sources = list(migration_sources)
+        self._container_name = container_name
+        self._labels = labels
         self._migrated = False
+        self._state = None
+        self._container_info = None
+        self._container_id = None
+        self.started_at = None
+        self.restarted = False
 
     def __enter__(self):
         if not self.is_development or self.force_recreate:
             self.remove_database()
-        if self.container_stopped:
-            logger.info("Found stopped DB, restarting it!")
-            self.docker_runner.run('start', self.container_name)
-        if not self.already_up:
-            self.create()
-            self.wait_until_ready()
-            self.migrate()
+        if self.state == ContainerState.STOPPED:
+            if self.fast_mode:
+                logger.info("Found stopped in-memory DB, its data is lost, recreating it!")
+                self.remove_database()
+            else:
+                logger.info("Found stopped DB, restarting it!")
+                self.restart()
+        if self.state == ContainerState.MISSING:
+            if self.context.get('TEST_DATABASE_SNAPSHOTS') and not self.fast_mode:
+                self.create_from_snapshot()
+            else:
+                self.create_and_migrate()
         if self.force_migrate:
             self.migrate()
+        elif self.is_development and not self._migrated and self.migrations_outdated:
+            logger.info('Migration sources changed.')
+            self.migrate()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -139,103 +477,427 @@ class Database(metaclass=abc.ABCMeta):
             self.remove_database()
 
     @property
-    def container_stopped(self) -> bool:
-        try:
-            container_info = json.loads(str(self.docker_runner.run('inspect', self.container_name)))
-        except sh.ErrorReturnCode_1:
-            return False
-        else:
-            return container_info[0]['State']['Running'] is False
+    def state(self) -> ContainerState:
+        if self._state is None:
+            self.inspect()
+        return self._state
+
+    def inspect(self):
+        self._container_info = self.docker_runner.inspect_container(self.container_name)
+        self._container_id = self._container_info['Id'] if self._container_info else None
+        self._state = ContainerState.from_container_info(self._container_info)
+        logger.debug('Database {} is {}.'.format(self.container_name, self._state.value))
+
+    def transition(self, state: ContainerState, container_id=None):
+        logger.debug('Database {}: {} -> {}'.format(
+            self.container_name, self._state.value if self._state else 'unknown', state.value,
+        ))
+        self._state = state
+        if container_id or state == ContainerState.MISSING:
+            self._container_id = container_id
+            self._container_info = None
 
     @property
-    def already_up(self) -> bool:
-        try:
-            self.docker_runner.run('inspect', self.container_name)
-            return True
-        except sh.ErrorReturnCode_1:
-            return False
+    def container_id(self) -> str:
+        if self._container_id is None:
+            self.inspect()
+        return self._container_id
+
+    @property
+    def container_labels(self) -> dict:
+        if self._container_info is None:
+            # The container was created by this instance.
+            return self.labels
+        return self._container_info['Config'].get('Labels') or {}
 
     @property
     def container_name(self) -> str:
+        if self._container_name:
+            return self._container_name
         image_name = self.context['DOCKER_IMAGE_NAME']
-        return f'db-test-{image_name}-{self.tag}'
+        return f'db-test-{image_name}-{self.tag}{self.name_suffix}'
+
+    @property
+    def labels(self) -> dict:
+        if self._labels is not None:
+            return self._labels
+        # The hash is needed only to tell if migrations are outdated, which is checked in development mode.
+        return {MIGRATION_HASH_LABEL: self.migration_hash} if self.is_development else {}
 
     def remove_database(self):
         logger.info('Removing database...')
-        try:
-            self.docker_runner.run('rm', '--force', '--volumes', self.container_name)
-        except sh.ErrorReturnCode_1 as e:
+        if not self.docker_runner.remove_container(self.container_name, volumes=True):
             logger.info('Database does not exist yet.')
-            logger.debug(e)
+        self.transition(ContainerState.MISSING)
+
+    def create_and_migrate(self):
+        with profiling.span('database create'):
+            self.create()
+        self.wait_until_ready()
+        self.migrate()
 
-    @abc.abstractmethod
     def create(self):
+        self.started_at = time.time()
+        self.restarted = False
+        container_id = str(self.docker_runner.run('run', '--detach', *self.container_args)).strip()
+        self.transition(ContainerState.RUNNING, container_id)
+
+    @property
+    def container_args(self) -> list:
+        return [
+            # In fast mode data is lost when the container stops, so it must stay stopped (and get recreated)
+            # instead of being restarted with empty database.
+            *([] if self.fast_mode else ['--restart', 'always']),
+            '--net', 'none',
+            '--name', self.container_name,
+            *[arg for label in self.labels.items() for arg in ('--label', '{}={}'.format(*label))],
+            *(['--tmpfs', self.data_path] if self.fast_mode else ['-v', self.data_path]),
+            *self.database_args,
+        ]
+
+    @property
+    def fast_mode(self) -> bool:
+        return bool(self.context.get('TEST_DATABASE_FAST_MODE'))
+
+    @property
+    @abc.abstractmethod
+    def database_args(self) -> list:
+        """Arguments of `docker run` after common options: environment, image and command."""
+        raise NotImplementedError
+
+    @cached_property
+    def data_path(self) -> str:
+        return self.context.get('TEST_DATABASE_DATA_PATH') or self.image_data_path
+
+    @property
+    @abc.abstractmethod
+    def image_data_path(self) -> str:
+        """Directory where database image keeps its data."""
         raise NotImplementedError
 
+    def get_image_environment(self, name) -> typing.Optional[str]:
+        image = self.context['TEST_DATABASE_IMAGE']
+        image_info = self.docker_runner.inspect_image(image)
+        if image_info is None:
+            # `docker run` would pull it anyway.
+            self.docker_runner.run('pull', image)
+            image_info = self.docker_runner.inspect_image(image)
+        for variable in (image_info or {}).get('Config', {}).get('Env') or []:
+            key, _, value = variable.partition('=')
+            if key == name:
+                return value
+        return None
+
     def wait_until_ready(self):
+        probe_name = self.context.get('TEST_DATABASE_READINESS_PROBE', self.default_readiness_probe)
+        probe = READINESS_PROBES[probe_name]
+        timeout = float(self.context.get('TEST_DATABASE_READY_TIMEOUT', settings.DEFAULT_TEST_DATABASE_READY_TIMEOUT))
         logger.info('Waiting for database...')
-        for log in self.docker_runner.run('logs', '--follow', self.container_name, _err_to_out=True, _iter='out'):
-            if self.started_log in log:
-                logger.info('Database ready!')
-                break
+        with profiling.span('database wait', probe=probe_name):
+            start = time.monotonic()
+            delay = PROBE_INITIAL_DELAY
+            attempts = 0
+            while True:
+                attempts += 1
+                ready, details = probe(self)
+                elapsed = time.monotonic() - start
+                if ready:
+                    logger.info('Database ready after {:.1f}s ({} probes)!'.format(elapsed, attempts))
+                    self.transition(ContainerState.HEALTHY)
+                    return
+                if elapsed >= timeout:
+                    raise CommandException('Database is not ready after {:.0f}s, last {} probe result: {}'.format(
+                        elapsed, probe_name, details.strip() or 'no output',
+                    ))
+                logger.debug('Database not ready yet ({:.1f}s): {}'.format(elapsed, details.strip()))
+                time.sleep(min(delay, timeout - elapsed))
+                delay = min(delay * 2, PROBE_MAX_DELAY)
+
+    def run_probe_command(self, *command) -> typing.Tuple[bool, str]:
+        exit_code, output = self.docker_runner.exec_container(self.container_name, *command)
+        return exit_code == 0, output
+
+    @property
+    @abc.abstractmethod
+    def default_readiness_probe(self) -> str:
+        raise NotImplementedError
+
+    @property
+    @abc.abstractmethod
+    def port(self) -> int:
+        raise NotImplementedError
+
+    @property
+    @abc.abstractmethod
+    def sql_probe_command(self) -> list:
+        raise NotImplementedError
 
     @property
     @abc.abstractmethod
     def started_log(self):
+        """Logged when newly created database is ready, used by `log` readiness probe."""
+        raise NotImplementedError
+
+    @property
+    @abc.abstractmethod
+    def restarted_log(self):
+        """Logged when database is ready after start with already initialized data directory."""
         raise NotImplementedError
 
     def migrate(self):
         if not self._migrated:
             logger.info('Running migrations...')
-            self.docker_runner.run(
-                'run',
-                '--net', self.network,
-                '--rm',
-                *self.volumes,
-                self.tested_image_name,
-                self.context['TEST_MIGRATION_COMMAND'],
-                _err_to_out=True,
-            )
+            with profiling.span('migrations'):
+                try:
+                    self.docker_runner.run(
+                        'run',
+                        '--net', self.network,
+                        '--rm',
+                        *self.volumes,
+                        self.tested_image_name,
+                        self.context['TEST_MIGRATION_COMMAND'],
+                        _err_to_out=True,
+                    )
+                except sh.ErrorReturnCode:
+                    self.save_migration_hash(failed=True)
+                    raise
+            self.save_migration_hash()
             logger.info('Migrations done!')
         self._migrated = True
 
+    @property
+    def migrations_outdated(self) -> bool:
+        state = self.migration_state.load()
+        if self.container_id in state:
+            migrated_hash = state[self.container_id]
+        else:
+            migrated_hash = self.container_labels.get(MIGRATION_HASH_LABEL)
+        return migrated_hash != self.migration_hash
+
+    def save_migration_hash(self, failed=False):
+        # Container labels can't be changed, so hash of later migrations (or failure of the first one) is stored
+        # locally, by container id.
+        if self.is_development:
+            self.migration_state.set(self.container_id, '' if failed else self.migration_hash)
+
     @property
     def network(self) -> str:
         return f'container:{self.container_name}'
 
+    def create_from_snapshot(self):
+        snapshot = self.snapshot_name
+        with self.snapshot_lock(snapshot):
+            if self.docker_runner.inspect_volume(snapshot) is None:
+                logger.info('There is no snapshot of migrated database yet.')
+                self.create_and_migrate()
+                self.save_snapshot(snapshot)
+                return
+        if self.restore_snapshot(snapshot):
+            return
+        logger.warning('Snapshot {} is incomplete, creating it again.'.format(snapshot))
+        self.remove_database()
+        with self.snapshot_lock(snapshot):
+            self.remove_snapshot(snapshot)
+            self.create_and_migrate()
+            self.save_snapshot(snapshot)
+
+    def restore_snapshot(self, snapshot) -> bool:
+        """Returns False if the snapshot is incomplete."""
+        logger.info('Restoring migrated database from snapshot {}...'.format(snapshot))
+        with profiling.span('database restore'):
+            container_id = str(self.docker_runner.run('create', *self.container_args)).strip()
+            self.transition(ContainerState.STOPPED, container_id)
+            try:
+                self.copy_data(
+                    '-v', '{}:/snapshot:ro'.format(snapshot),
+                    command='test -f /snapshot/{marker} || exit {exit_code}; '
+                            'cp -a /snapshot/. {data}/ && rm -f {data}/{marker}'.format(
+                                marker=SNAPSHOT_COMPLETE_MARKER,
+                                exit_code=SNAPSHOT_INCOMPLETE_EXIT_CODE,
+                                data=self.data_path,
+                            ),
+                )
+            except sh.ErrorReturnCode as e:
+                if e.exit_code != SNAPSHOT_INCOMPLETE_EXIT_CODE:
+                    raise
+                return False
+            self.restart()
+        self._migrated = True
+        return True
+
+    def save_snapshot(self, snapshot):
+        logger.info('Saving snapshot {} of migrated database...'.format(snapshot))
+        with profiling.span('database snapshot'):
+            self.docker_runner.run('stop', self.container_name)
+            self.transition(ContainerState.STOPPED)
+            self.docker_runner.create_volume(snapshot, labels={SNAPSHOT_LABEL: self.context['DOCKER_IMAGE_NAME']})
+            try:
+                self.copy_data(
+                    '-v', '{}:/snapshot'.format(snapshot),
+                    command='cp -a {}/. /snapshot/ && touch /snapshot/{}'.format(
+                        self.data_path, SNAPSHOT_COMPLETE_MARKER,
+                    ),
+                )
+            except BaseException:
+                self.remove_snapshot(snapshot)
+                raise
+            self.restart()
+        self.remove_old_snapshots()
+
+    @contextlib.contextmanager
+    def snapshot_lock(self, snapshot):
+        # File lock, so the snapshot is created once also when several kubeyard processes run on the host.
+        directory = cache.get_cache_directory()
+        directory.mkdir(parents=True, exist_ok=True)
+        with (directory / '{}.lock'.format(snapshot)).open('a+') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def copy_data(self, *volume_args, command):
+        self.docker_runner.run(
+            'run',
+            '--rm',
+            '--net', 'none',
+            '--volumes-from', self.container_name,
+            *volume_args,
+            '--entrypoint', 'sh',
+            self.context['TEST_DATABASE_IMAGE'],
+            '-c', command,
+        )
+
+    def ensure_running(self) -> bool:
+        """Returns True if stopped container was started (in fast mode it means that its data is lost)."""
+        if self.state == ContainerState.STOPPED:
+            self.restart()
+            return True
+        return False
+
+    def reset(self):
+        """Recreates empty database."""
+        logger.info('Recreating database {}...'.format(self.context['TEST_DATABASE_NAME']))
+        with profiling.span('database reset'):
+            exit_code, output = self.docker_runner.exec_container(self.container_name, *self.reset_command)
+        if exit_code != 0:
+            raise CommandException('Recreating database failed: {}'.format(output.strip()))
+
+    @property
+    @abc.abstractmethod
+    def reset_command(self) -> list:
+        raise NotImplementedError
+
+    def restart(self):
+        self.started_at = time.time()
+        self.restarted = True
+        self.docker_runner.start_container(self.container_name)
+        self.transition(ContainerState.RUNNING)
+        self.wait_until_ready()
+
+    def remove_old_snapshots(self):
+        label = '{}={}'.format(SNAPSHOT_LABEL, self.context['DOCKER_IMAGE_NAME'])
+        snapshots = [self.docker_runner.inspect_volume(name) for name in self.docker_runner.find_volumes(label=label)]
+        snapshots = sorted(filter(None, snapshots), key=lambda volume: volume['CreatedAt'], reverse=True)
+        for volume in snapshots[SNAPSHOTS_TO_KEEP:]:
+            logger.info('Removing old database snapshot {}...'.format(volume['Name']))
+            self.remove_snapshot(volume['Name'])
+
+    def remove_snapshot(self, snapshot):
+        try:
+            self.docker_runner.remove_volume(snapshot)
+        except (sh.ErrorReturnCode, docker_engine.DockerEngineError) as e:
+            logger.debug(e)
+
+    @property
+    def snapshot_name(self) -> str:
+        return 'kubeyard-db-snapshot-{}'.format(self.migration_hash[:16])
+
+    @cached_property
+    def migration_hash(self) -> str:
+        tested_image = self.docker_runner.inspect_image(self.tested_image_name)
+        if tested_image is None:
+            raise CommandException('Image {} is not present, build it first.'.format(self.tested_image_name))
+        hasher = content_hash.ContentHasher()
+        hasher.add_value(
+            type(self).__name__,
+            tested_image['Id'],
+            self.context['TEST_MIGRATION_COMMAND'],
+            self.context['TEST_DATABASE_IMAGE'],
+            self.context['TEST_DATABASE_NAME'],
+        )
+        for path in self.migration_sources:
+            if path.is_dir():
+                hasher.add_directory(path, content_hash.DockerIgnore(MIGRATION_SOURCES_IGNORE))
+            elif path.is_file():
+                hasher.add_file(path)
+        return hasher.hexdigest()
+
 
 class PostgresDatabase(Database):
     started_log = 'PostgreSQL init process complete; ready for start up.'
+    restarted_log = 'database system is ready to accept connections'
+    port = 5432
+    default_readiness_probe = 'pg_isready'
+
+    @property
+    def image_data_path(self) -> str:
+        # Since postgres 18 images keep data in a versioned directory, e.g. /var/lib/postgresql/18/docker.
+        return self.get_image_environment('PGDATA') or '/var/lib/postgresql/data'
+
+    @property
+    def sql_probe_command(self) -> list:
+        # During initialisation the image runs temporary server listening only on unix socket, so connecting
+        # through TCP succeeds only when the final server is up.
+        return ['psql', '-h', '127.0.0.1', '-U', 'postgres', '-d', self.context['TEST_DATABASE_NAME'], '-c', 'SELECT 1']
+
+    @property
+    def reset_command(self) -> list:
+        return [
+            'psql', '-U', 'postgres', '-d', 'postgres', '-v', 'ON_ERROR_STOP=1',
+            '-c', 'DROP DATABASE IF EXISTS "{}"'.format(self.context['TEST_DATABASE_NAME']),
+            '-c', 'CREATE DATABASE "{}" TEMPLATE template0'.format(self.context['TEST_DATABASE_NAME']),
+        ]
 
     def create(self):
         logger.info('Setting up database...')
-        self.docker_runner.run(
-            'run',
-            '--restart', 'always',
-            '--net', 'none',
-            '--name', self.container_name,
-            '--detach',
+        super().create()
+
+    @property
+    def database_args(self) -> list:
+        return [
             '-e', 'POSTGRES_DB={}'.format(self.context['TEST_DATABASE_NAME']),
             self.context['TEST_DATABASE_IMAGE'],
-        )
+            *(['postgres', *FAST_MODE_POSTGRES_OPTIONS] if self.fast_mode else []),
+        ]
 
 
 class CockroachDatabase(Database):
     started_log = 'initialized new cluster'
+    restarted_log = 'CockroachDB node starting'
+    image_data_path = '/cockroach/cockroach-data'
+    port = 26257
+    default_readiness_probe = 'sql'
+    sql_probe_command = ['cockroach', 'sql', '--insecure', '-e', 'SELECT 1']
+
+    @property
+    def reset_command(self) -> list:
+        return [
+            'cockroach', 'sql', '--insecure',
+            '-e', 'DROP DATABASE IF EXISTS {} CASCADE'.format(self.context['TEST_DATABASE_NAME']),
+            '-e', 'CREATE DATABASE {}'.format(self.context['TEST_DATABASE_NAME']),
+        ]
 
     def create(self):
         logger.info('Releasing cockroaches...')
-        self.docker_runner.run(
-            'run',
-            '--restart', 'always',
-            '--net', 'none',
-            '--name', self.container_name,
-            '--detach',
+        super().create()
+        self._create_database()
+
+    @property
+    def database_args(self) -> list:
+        return [
             self.context['TEST_DATABASE_IMAGE'],
             'start-single-node',
             '--insecure',
-        )
-        self._create_database()
+            *(['--store=type=mem,size=0.25'] if self.fast_mode else []),
+        ]
 
     def _create_database(self):
         self.wait_until_ready()
@@ -251,6 +913,123 @@ class CockroachDatabase(Database):
         )
 
 
+class PooledDatabase:
+    """Database in container leased from the pool. On return the database is recreated, so it's empty again."""
+
+    def __init__(self, database: Database, lease: test_database_pool.PoolLease):
+        self.database = database
+        self.lease = lease
+
+    def __enter__(self):
+        try:
+            restarted = self.database.ensure_running()
+            if self.lease.is_dirty or (restarted and self.database.fast_mode):
+                self.database.reset()
+            self.lease.mark(test_database_pool.DIRTY)
+            self.database.migrate()
+        except BaseException:
+            self.lease.release()
+            raise
+        return self.database
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self.database.reset()
+        except (sh.ErrorReturnCode, CommandException) as e:
+            logger.warning('{} Database will be recreated on next lease.'.format(e))
+        else:
+            self.lease.mark(test_database_pool.CLEAN)
+        finally:
+            self.lease.release()
+
+
+class TestDatabasePoolCommand(InitialisedRepositoryCommand):
+    """
+    Creates missing containers of test databases pool and resets dirty ones (left by killed test runs). Containers
+    are pre-started and shared by all projects on the host using the same database type, image and name.
+    Test runs outside of development mode lease databases from the pool if `test_database_pool_size` is set
+    in config/kubeyard.yml.
+    """
+
+    def __init__(self, *, size, clear, **kwargs):
+        super().__init__(**kwargs)
+        self.size = size
+        self.clear = clear
+
+    def run(self):
+        super().run()
+        pool = get_test_database_pool(self.context, get_docker_runner(self.context), self.size)
+        if self.clear:
+            pool.clear()
+        else:
+            pool.fill()
+
+
+def get_test_database_pool(context, docker_runner: DockerRunner, size=None) -> test_database_pool.TestDatabasePool:
+    database_type = context.get("TEST_DATABASE_TYPE", "postgres")
+    key = '{}-{}'.format(database_type, hashlib.sha256('{}\0{}\0{}'.format(
+        context['TEST_DATABASE_IMAGE'], context['TEST_DATABASE_NAME'], bool(context.get('TEST_DATABASE_FAST_MODE')),
+    ).encode()).hexdigest()[:8])
+
+    def database_factory(container_name):
+        return DATABASE_MAP[database_type](
+            is_development=False,
+            volumes=(),
+            context=context,
+            tag='',
+            docker_runner=docker_runner,
+            tested_image_name=None,
+            container_name=container_name,
+            labels={test_database_pool.POOL_LABEL: key},
+        )
+
+    return test_database_pool.TestDatabasePool(
+        key=key,
+        size=size or int(context.get('TEST_DATABASE_POOL_SIZE') or 1),
+        docker_runner=docker_runner,
+        database_factory=database_factory,
+    )
+
+
+def get_option_args(test_options) -> typing.List[str]:
+    """
+    Test options passed to shards, which get collected test ids instead of positional arguments. Values of options
+    can't be told from test paths, so they are kept only in `--option=value` (or `-ovalue`) form.
+    """
+    return [arg for arg in test_options if arg.startswith('-')]
+
+
+def pg_isready_probe(database: Database) -> typing.Tuple[bool, str]:
+    return database.run_probe_command('pg_isready', '-h', '127.0.0.1', '-p', str(database.port), '-U', 'postgres')
+
+
+def sql_probe(database: Database) -> typing.Tuple[bool, str]:
+    return database.run_probe_command(*database.sql_probe_command)
+
+
+def tcp_probe(database: Database) -> typing.Tuple[bool, str]:
+    exit_code, output = database.docker_runner.exec_container(
+        database.container_name, 'sh', '-c', TCP_PROBE_SCRIPT.format(port=database.port),
+    )
+    if exit_code == 127:
+        # Neither bash nor nc (nor sh) is available in the database image.
+        return log_probe(database)
+    return exit_code == 0, output
+
+
+def log_probe(database: Database) -> typing.Tuple[bool, str]:
+    ready_log = database.restarted_log if database.restarted else database.started_log
+    logs = ''.join(database.docker_runner.container_logs(database.container_name, since=database.started_at))
+    return ready_log in logs, 'waiting for "{}" in logs'.format(ready_log)
+
+
+READINESS_PROBES = {
+    'pg_isready': pg_isready_probe,
+    'sql': sql_probe,
+    'tcp': tcp_probe,
+    'log': log_probe,
+}
+
 DATABASE_MAP = {
     'postgres': PostgresDatabase,
     'cockroach': CockroachDatabase,
@@ -0,0 +1,154 @@
+import fcntl
+import logging
+import pathlib
+import subprocess
+import sys
+import typing
+
+import sh
+
+from kubeyard import base_command
+from kubeyard import settings
+
+logger = logging.getLogger(__name__)
+
+POOL_LABEL = 'kubeyard.test-database-pool'
+CLEAN = 'clean'
+DIRTY = 'dirty'
+
+
+def get_pool_directory() -> pathlib.Path:
+    return pathlib.Path.home() / settings.DEFAULT_KUBEYARD_TEST_DATABASE_POOL_DIR
+
+
+class TestDatabasePool:
+    """
+    Pre-started test database containers shared by test runs on the host. Container is leased by taking exclusive lock
+    of its lock file, so the lease is released even if kubeyard gets killed. Container left dirty by such run is reset
+    on next lease.
+    """
+
+    def __init__(self, *, key: str, size: int, docker_runner, database_factory: typing.Callable, directory=None):
+        self.key = key
+        self.size = size
+        self.docker_runner = docker_runner
+        self.database_factory = database_factory
+        self.directory = pathlib.Path(directory or get_pool_directory())
+
+    @property
+    def label(self) -> str:
+        return '{}={}'.format(POOL_LABEL, self.key)
+
+    @property
+    def container_names(self) -> typing.List[str]:
+        return ['kubeyard-test-db-{}-{}'.format(self.key, index) for index in range(self.size)]
+
+    @property
+    def existing_containers(self) -> typing.List[str]:
+        return sorted(self.docker_runner.find_containers(label=self.label))
+
+    @property
+    def is_full(self) -> bool:
+        return len(self.existing_containers) >= self.size
+
+    def lease(self) -> typing.Optional['PoolLease']:
+        for container_name in self.existing_containers:
+            lock_file = self._try_lock(container_name)
+            if lock_file:
+                logger.info('Leased database {} from the pool.'.format(container_name))
+                return PoolLease(self.directory, container_name, lock_file)
+        return None
+
+    def fill(self):
+        fill_lock = self._try_lock('fill')
+        if not fill_lock:
+            logger.info('Pool is being filled by another process.')
+            return
+        with fill_lock:
+            existing_containers = self.existing_containers
+            for container_name in self.container_names:
+                try:
+                    if container_name not in existing_containers:
+                        self._create(container_name)
+                    else:
+                        self._reset_if_dirty(container_name)
+                except (sh.ErrorReturnCode, base_command.CommandException) as e:
+                    logger.warning('Preparing pooled database {} failed: {}'.format(container_name, e))
+        logger.info('Pool has {} of {} databases.'.format(len(self.existing_containers), self.size))
+
+    def clear(self):
+        for container_name in self.existing_containers:
+            logger.info('Removing pooled database {}...'.format(container_name))
+            self.docker_runner.remove_container(container_name, volumes=True)
+
+    def spawn_refill(self, project_dir: pathlib.Path):
+        """Fills the pool in detached process, so the current test run doesn't wait for it."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        log_path = self.directory / 'refill.log'
+        logger.info('Filling the pool in background, see {}'.format(log_path))
+        with log_path.open('a') as log_file:
+            subprocess.Popen(
+                [
+                    sys.executable, '-m', 'kubeyard.entrypoints.kubeyard', 'test-db', 'pool',
+                    '--directory', str(project_dir),
+                    '--size', str(self.size),
+                ],
+                stdin=subprocess.DEVNULL,
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+                start_new_session=True,
+            )
+
+    def _create(self, container_name):
+        lock_file = self._try_lock(container_name)
+        if not lock_file:
+            return
+        logger.info('Creating pooled database {}...'.format(container_name))
+        with lock_file:
+            database = self.database_factory(container_name)
+            database.create()
+            database.wait_until_ready()
+            PoolLease(self.directory, container_name, lock_file).mark(CLEAN)
+
+    def _reset_if_dirty(self, container_name):
+        lock_file = self._try_lock(container_name)
+        if not lock_file:
+            return
+        with lock_file:
+            lease = PoolLease(self.directory, container_name, lock_file)
+            if lease.is_dirty:
+                logger.info('Resetting pooled database {}...'.format(container_name))
+                database = self.database_factory(container_name)
+                database.ensure_running()
+                database.reset()
+                lease.mark(CLEAN)
+
+    def _try_lock(self, name) -> typing.Optional[typing.IO]:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        lock_file = (self.directory / '{}.lock'.format(name)).open('a+')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        return lock_file
+
+
+class PoolLease:
+    def __init__(self, directory: pathlib.Path, container_name: str, lock_file: typing.IO):
+        self.container_name = container_name
+        self.state_path = directory / '{}.state'.format(container_name)
+        self.lock_file = lock_file
+
+    @property
+    def is_dirty(self) -> bool:
+        try:
+            return self.state_path.read_text().strip() != CLEAN
+        except FileNotFoundError:
+            return True
+
+    def mark(self, state):
+        self.state_path.write_text(state)
+
+    def release(self):
+        self.lock_file.close()
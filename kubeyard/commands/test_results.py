@@ -0,0 +1,79 @@
+import heapq
+import logging
+import pathlib
+import re
+import typing
+import xml.etree.ElementTree
+
+from kubeyard import cache
+
+logger = logging.getLogger(__name__)
+
+CONTAINER_RESULTS_DIR = '/kubeyard-test-results'
+RESULTS_DIR = '.kubeyard/test-results'
+DEFAULT_TEST_DURATION = 1.0
+
+
+def normalize_test_id(test_id: str) -> str:
+    """
+    Turns both collected test ids (`tests/test_a.py::TestA::test_b[1]`) and JUnit `classname.name`
+    (`tests.test_a.TestA.test_b[1]`) into the same key.
+    """
+    name, bracket, parameters = test_id.partition('[')
+    name = re.sub(r'\.py(?=::|$)', '', name)
+    name = name.replace('::', '.').replace('/', '.').strip('.')
+    return name + bracket + parameters
+
+
+def parse_junit_results(directory: pathlib.Path) -> typing.Dict[str, float]:
+    durations = {}
+    for path in sorted(directory.glob('**/*.xml')):
+        try:
+            tree = xml.etree.ElementTree.parse(str(path))
+        except xml.etree.ElementTree.ParseError as e:
+            logger.warning('Skipping invalid JUnit XML {}: {}'.format(path, e))
+            continue
+        for test_case in tree.iter('testcase'):
+            test_id = '.'.join(filter(None, [test_case.get('classname'), test_case.get('name')]))
+            try:
+                durations[normalize_test_id(test_id)] = float(test_case.get('time') or 0)
+            except ValueError:
+                continue
+    return durations
+
+
+class TestTimings:
+    """Durations of tests from previous runs, kept in <project_dir>/.kubeyard/test-timings.json."""
+
+    def __init__(self, project_dir: pathlib.Path):
+        self.store = cache.JsonCache('test-timings', directory=project_dir / '.kubeyard')
+
+    def update(self, durations: typing.Dict[str, float]):
+        if durations:
+            timings = self.store.load()
+            timings.update(durations)
+            self.store.save(timings)
+            logger.info('Recorded durations of {} tests.'.format(len(durations)))
+
+    def estimate(self, test_ids: typing.List[str]) -> typing.Dict[str, float]:
+        timings = self.store.load()
+        known = [timings[normalize_test_id(test_id)] for test_id in test_ids if normalize_test_id(test_id) in timings]
+        default = sum(known) / len(known) if known else DEFAULT_TEST_DURATION
+        return {test_id: timings.get(normalize_test_id(test_id), default) for test_id in test_ids}
+
+
+def split_by_duration(durations: typing.Dict[str, float], shard_count: int) -> typing.List[typing.List[str]]:
+    """
+    Longest processing time first: the longest test goes to the least loaded shard. Tests keep collection order
+    within a shard.
+    """
+    order = {test_id: index for index, test_id in enumerate(durations)}
+    shards = [(0.0, index, []) for index in range(shard_count)]
+    for test_id in sorted(durations, key=lambda test_id: (-durations[test_id], order[test_id])):
+        total, index, test_ids = heapq.heappop(shards)
+        test_ids.append(test_id)
+        heapq.heappush(shards, (total + durations[test_id], index, test_ids))
+    shards.sort(key=lambda shard: shard[1])
+    for total, index, test_ids in shards:
+        logger.debug('Shard {}: {} tests, estimated {:.1f}s.'.format(index + 1, len(test_ids), total))
+    return [sorted(test_ids, key=order.get) for _, _, test_ids in shards]
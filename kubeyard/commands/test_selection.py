@@ -0,0 +1,146 @@
+import ast
+import collections
+import functools
+import hashlib
+import logging
+import os
+import pathlib
+import re
+import typing
+
+from kubeyard import cache
+from kubeyard import profiling
+from kubeyard import subprocesses
+
+logger = logging.getLogger(__name__)
+
+SKIPPED_DIRECTORIES = {'__pycache__', '.git', 'node_modules'}
+TEST_MODULE_PATTERN = re.compile(r'^(test_.*|.*_test)\.py$')
+# Changes of these files may affect any test, so the whole suite has to run.
+GLOBAL_FILES = {'conftest.py', 'setup.py', 'setup.cfg', 'pytest.ini', 'tox.ini'}
+
+SourceRoot = collections.namedtuple('SourceRoot', ['host_path', 'container_path'])
+
+
+def get_changed_files(project_dir: pathlib.Path, ref: str) -> typing.List[pathlib.Path]:
+    """Files changed since `ref`, including uncommitted, untracked and deleted ones (renamed files as both)."""
+    git = functools.partial(subprocesses.git, _cwd=str(project_dir), _tty_out=False)
+    changed = str(git('diff', '--name-only', '--no-renames', '--relative', ref)).splitlines()
+    untracked = str(git('ls-files', '--others', '--exclude-standard')).splitlines()
+    return sorted({(project_dir / path).resolve() for path in changed + untracked if path})
+
+
+class ImportGraph:
+    """
+    Imports of python modules in source roots, parsed on the host. Imports of every file are cached by its content
+    hash in <project_dir>/.kubeyard/test-imports.json, so only changed files are parsed again.
+    """
+
+    def __init__(self, project_dir: pathlib.Path, source_roots: typing.Iterable[SourceRoot]):
+        self.project_dir = project_dir.resolve()
+        self.source_roots = list(source_roots)
+        self.store = cache.JsonCache('test-imports', directory=project_dir / '.kubeyard')
+
+    def find_source_root(self, path: pathlib.Path) -> typing.Optional[SourceRoot]:
+        for source_root in self.source_roots:
+            if source_root.host_path in path.parents:
+                return source_root
+        return None
+
+    def get_container_path(self, path: pathlib.Path) -> str:
+        source_root = self.find_source_root(path)
+        return str(pathlib.PurePosixPath(source_root.container_path) / path.relative_to(source_root.host_path))
+
+    def get_dependants(self, changed_paths: typing.Iterable[pathlib.Path]) -> typing.Set[pathlib.Path]:
+        """
+        Changed modules and all existing modules importing them, directly or not. Deleted modules are matched
+        by name with imports of remaining ones.
+        """
+        changed_names = {self.get_path_module_name(path) for path in changed_paths} - {None}
+        with profiling.span('test import graph'):
+            modules = self.find_modules()
+            known_names = set(modules) | changed_names
+            imported_by = collections.defaultdict(set)
+            stored = self.store.load()
+            cached = {}
+            for name, path in modules.items():
+                for imported in self.get_imports(name, path, stored, cached):
+                    target = self.resolve(imported, known_names)
+                    if target:
+                        imported_by[target].add(name)
+            self.store.save(cached)
+        pending = list(changed_names)
+        affected = set(pending)
+        while pending:
+            for name in imported_by[pending.pop()] - affected:
+                affected.add(name)
+                pending.append(name)
+        return {modules[name] for name in affected if name in modules}
+
+    def get_path_module_name(self, path: pathlib.Path) -> typing.Optional[str]:
+        """Name of module at `path`, which doesn't have to exist anymore."""
+        source_root = self.find_source_root(path)
+        if not source_root or path.suffix != '.py':
+            return None
+        return self.get_module_name(path.relative_to(source_root.host_path)) or None
+
+    def find_modules(self) -> typing.Dict[str, pathlib.Path]:
+        modules = {}
+        for source_root in self.source_roots:
+            for root, dirnames, filenames in os.walk(str(source_root.host_path)):
+                dirnames[:] = sorted(name for name in dirnames if name not in SKIPPED_DIRECTORIES)
+                for filename in filenames:
+                    if filename.endswith('.py'):
+                        path = pathlib.Path(root) / filename
+                        name = self.get_module_name(path.relative_to(source_root.host_path))
+                        if name:
+                            modules[name] = path.resolve()
+        return modules
+
+    @staticmethod
+    def get_module_name(relative_path: pathlib.Path) -> str:
+        parts = list(relative_path.with_suffix('').parts)
+        if parts[-1] == '__init__':
+            parts.pop()
+        return '.'.join(parts)
+
+    def get_imports(self, name, path: pathlib.Path, stored: dict, cached: dict) -> typing.List[str]:
+        content = path.read_bytes()
+        content_hash = hashlib.sha256(content).hexdigest()
+        key = str(path.relative_to(self.project_dir))
+        entry = stored.get(key)
+        if not entry or entry['hash'] != content_hash:
+            entry = {'hash': content_hash, 'imports': self.parse_imports(name, path.name == '__init__.py', content)}
+        cached[key] = entry
+        return entry['imports']
+
+    @staticmethod
+    def parse_imports(name, is_package, content: bytes) -> typing.List[str]:
+        try:
+            tree = ast.parse(content)
+        except (SyntaxError, ValueError):
+            logger.debug('Could not parse module {}.'.format(name))
+            return []
+        package = name.split('.') if is_package else name.split('.')[:-1]
+        imports = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                imports.update(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom):
+                base = package[:len(package) - node.level + 1] if node.level else []
+                module = '.'.join(base + ([node.module] if node.module else []))
+                if module:
+                    imports.add(module)
+                imports.update('.'.join(filter(None, [module, alias.name])) for alias in node.names)
+        return sorted(imports)
+
+    @staticmethod
+    def resolve(imported, modules) -> typing.Optional[str]:
+        # `from package import name` may import either a module or a name defined in the package.
+        while imported and imported not in modules:
+            imported = imported.rpartition('.')[0]
+        return imported or None
+
+
+def is_test_module(path: pathlib.Path) -> bool:
+    return bool(TEST_MODULE_PATTERN.match(path.name))
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import pathlib
+import re
+import typing
+
+
+class DockerIgnore:
+    """
+    Matches paths against .dockerignore patterns with the same rules docker uses: `*` and `?` don't cross directory
+    boundaries, `**` matches any number of directories, `!` re-includes a path and the last matching pattern wins.
+    A pattern matching a directory matches everything inside it.
+    """
+
+    def __init__(self, patterns: typing.Iterable[str]):
+        self.rules = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            excluded = not pattern.startswith('!')
+            pattern = os.path.normpath(pattern.lstrip('!').strip()).lstrip('/')
+            self.rules.append((re.compile(self._translate(pattern)), excluded))
+
+    @classmethod
+    def from_directory(cls, directory: pathlib.Path) -> 'DockerIgnore':
+        path = directory / '.dockerignore'
+        if path.exists():
+            return cls(path.read_text().splitlines())
+        else:
+            return cls([])
+
+    @property
+    def has_exceptions(self) -> bool:
+        return any(not excluded for _, excluded in self.rules)
+
+    def is_ignored(self, relative_path: str) -> bool:
+        candidates = [relative_path]
+        parent = os.path.dirname(relative_path)
+        while parent:
+            candidates.append(parent)
+            parent = os.path.dirname(parent)
+        ignored = False
+        for regex, excluded in self.rules:
+            if any(regex.match(candidate) for candidate in candidates):
+                ignored = excluded
+        return ignored
+
+    @staticmethod
+    def _translate(pattern: str) -> str:
+        regex = ''
+        index = 0
+        while index < len(pattern):
+            char = pattern[index]
+            if pattern.startswith('**', index):
+                index += 2
+                if pattern.startswith('/', index):
+                    index += 1
+                    regex += '(.*/)?'
+                else:
+                    regex += '.*'
+                continue
+            if char == '*':
+                regex += '[^/]*'
+            elif char == '?':
+                regex += '[^/]'
+            elif char == '[':
+                end = pattern.find(']', index)
+                if end == -1:
+                    regex += re.escape(char)
+                else:
+                    regex += '[' + pattern[index + 1:end].replace('\\', '\\\\') + ']'
+                    index = end
+            elif char == '\\' and index + 1 < len(pattern):
+                index += 1
+                regex += re.escape(pattern[index])
+            else:
+                regex += re.escape(char)
+            index += 1
+        return '^' + regex + '$'
+
+
+class ContentHasher:
+    def __init__(self):
+        self._hash = hashlib.sha256()
+
+    def add_value(self, *values):
+        for value in values:
+            self._hash.update(str(value).encode() + b'\0')
+
+    def add_file(self, path: pathlib.Path, name: str = None):
+        self.add_value('file', name or str(path), os.access(str(path), os.X_OK))
+        with path.open('rb') as content:
+            for chunk in iter(lambda: content.read(1 << 20), b''):
+                self._hash.update(chunk)
+
+    def add_directory(self, directory: pathlib.Path, ignore: DockerIgnore = None):
+        ignore = ignore or DockerIgnore([])
+        prune_ignored = not ignore.has_exceptions
+        for root, dirnames, filenames in os.walk(str(directory)):
+            relative_root = os.path.relpath(root, str(directory))
+            relative_root = '' if relative_root == '.' else relative_root
+            dirnames.sort()
+            if prune_ignored:
+                dirnames[:] = [name for name in dirnames if not ignore.is_ignored(os.path.join(relative_root, name))]
+            for filename in sorted(filenames):
+                relative_path = os.path.join(relative_root, filename)
+                if ignore.is_ignored(relative_path):
+                    continue
+                path = pathlib.Path(root) / filename
+                if path.is_symlink():
+                    self.add_value('symlink', relative_path, os.readlink(str(path)))
+                else:
+                    self.add_file(path, relative_path)
+
+    def add_build_context(self, context: pathlib.Path, dockerfile: pathlib.Path = None):
+        """
+        Files docker sends to build: the Dockerfile and .dockerignore are always sent, even if .dockerignore lists
+        them, and the rest of the context respecting .dockerignore.
+        """
+        dockerfile = dockerfile or context / 'Dockerfile'
+        if dockerfile.is_file():
+            self.add_file(dockerfile, 'dockerfile')
+        dockerignore = context / '.dockerignore'
+        if dockerignore.is_file():
+            self.add_file(dockerignore, 'dockerignore')
+        self.add_directory(context, DockerIgnore.from_directory(context))
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
@@ -4,14 +4,25 @@ import time
 
 import sh
 
+from kubeyard import base_command
+from kubeyard import kubernetes_gateway
+from kubeyard import settings
+
 logger = logging.getLogger(__name__)
 
+WATCH_RETRY_DELAY = 1
+FAILED_WAITING_REASONS = {'ErrImagePull', 'ImagePullBackOff', 'InvalidImageName', 'CrashLoopBackOff'}
+
 
 def is_command_available(name):
     return shutil.which(name) is not None
 
 
 class KubernetesDependency:
+    def __init__(self, snapshot: 'PodSnapshot' = None, gateway: kubernetes_gateway.KubectlGateway = None):
+        self.snapshot = snapshot
+        self.gateway = gateway or kubernetes_gateway.KubectlGateway()
+
     def ensure_running(self):
         logger.debug('Checking if container "{}" is running...'.format(self.name))
         if self.is_container_running():
@@ -24,12 +35,14 @@ class KubernetesDependency:
     def run_container(self):
         self._apply_definition()
         self._wait_until_ready()
+        if self.snapshot:
+            self.snapshot.refresh([self.name])
         self._wait_for_started_log()
 
     def _apply_definition(self):
-        sh.kubectl('apply', '--record', '-f', self.definition)
+        self.gateway.apply(self.definition)
         try:
-            sh.kubectl('expose', '-f', self.definition)
+            self.gateway.expose(self.definition)
         except sh.ErrorReturnCode_1 as e:
             if b'already exists' not in e.stderr:
                 raise e
@@ -37,45 +50,90 @@ class KubernetesDependency:
                 logger.debug('Service for "{}" exists'.format(self.name))
 
     def _wait_until_ready(self):
+        """
+        Follows watch of pods instead of polling, readiness is noticed as soon as it's reported. Interrupted watch
+        (e.g. with expired resource version) starts again with current pods until the timeout.
+        """
         logger.debug('Waiting for "{}" to start (possibly downloading image)...'.format(self.name))
-        ready = False
-        while not ready:
-            ready = self.is_container_running()
-            if not ready:
-                time.sleep(1)
+        timeout = settings.DEFAULT_DEPENDENCY_READY_TIMEOUT
+        deadline = time.monotonic() + timeout
+        pods = {}
+        while True:
+            try:
+                if self._watch_until_ready(pods, timeout=deadline - time.monotonic()):
+                    break
+                logger.debug('Watch of "{}" pods ended, watching again...'.format(self.name))
+            except kubernetes_gateway.WATCH_INTERRUPTIONS as e:
+                logger.debug('Watch of "{}" pods interrupted ({}), watching again...'.format(self.name, e))
+            except TimeoutError:
+                statuses = ['{}: {}'.format(pod.name, pod.description) for pod in pods.values()]
+                raise base_command.CommandException('"{}" is not ready after {}s. Last status: {}'.format(
+                    self.name, timeout, ', '.join(statuses) or 'no pods',
+                ))
+            time.sleep(WATCH_RETRY_DELAY)
         logger.debug('"{}" started'.format(self.name))
 
+    def _watch_until_ready(self, pods: dict, *, timeout) -> bool:
+        """Returns False if the watch ended before pods were ready."""
+        if timeout <= 0:
+            raise TimeoutError()
+        # Pods deleted while the watch was interrupted won't be reported, so only current ones are kept.
+        pods.clear()
+        watch = self.gateway.watch_pods(selector=self.selector, timeout=timeout)
+        try:
+            for pod in watch:
+                self._report_status_change(pods.get(pod.name), pod)
+                pods[pod.name] = pod
+                active_pods = [pod for pod in pods.values() if not pod.is_deleted]
+                if active_pods and all(pod.is_ready for pod in active_pods):
+                    return True
+        finally:
+            watch.close()
+        return False
+
+    def _report_status_change(
+            self, previous: kubernetes_gateway.PodStatus, current: kubernetes_gateway.PodStatus,
+    ):
+        if previous and previous.description == current.description:
+            return
+        if current.waiting_reasons & FAILED_WAITING_REASONS:
+            logger.warning('"{}" pod {}: {}'.format(self.name, current.name, current.description))
+        elif current.waiting_reasons:
+            logger.info('"{}" pod {}: {}'.format(self.name, current.name, current.description))
+        else:
+            logger.debug('"{}" pod {}: {}'.format(self.name, current.name, current.description))
+
     def _wait_for_started_log(self):
         logger.debug('Waiting for started log for "{}"...'.format(self.name))
-        for log in sh.kubectl('logs', '-f', self.pod_name, _iter='out'):
-            if self.started_log in log:
-                break
+        logs = self.gateway.pod_logs(self.pod_name, follow=True)
+        try:
+            for log in logs:
+                if self.started_log in log:
+                    break
+        finally:
+            logs.close()
         logger.debug('Started log for "{}" found'.format(self.name))
 
     def is_container_running(self):
         try:
-            container_ready = str(sh.kubectl(
-                'get', 'pods',
-                '--selector', self.selector,
-                '--output', 'jsonpath="{.items[*].status.containerStatuses[*].ready}"',
-            )).strip()
-        except sh.ErrorReturnCode as e:
+            pods = self.get_pods()
+        except kubernetes_gateway.GATEWAY_ERRORS as e:
             logger.debug(e)
             return False
-        else:
-            return container_ready == '"true"'
+        return [status['ready'] for pod in pods for status in pod['status'].get('containerStatuses') or []] == [True]
 
-    def run_command(self, *args):
-        return sh.kubectl('exec', self.pod_name, '--', *args)
+    def run_command(self, *args, input=None):
+        return self.gateway.exec(self.pod_name, *args, input=input)
 
     @property
     def pod_name(self):
-        return str(sh.kubectl(
-            'get', 'pods',
-            '--output', 'custom-columns=NAME:.metadata.name',
-            '--no-headers',
-            '--selector', self.selector,
-        )).strip()
+        return '\n'.join(pod['metadata']['name'] for pod in self.get_pods())
+
+    def get_pods(self):
+        pods = self.snapshot.get_pods(self.name) if self.snapshot else None
+        if pods is None:
+            pods = self.gateway.list_pods(selector=self.selector)
+        return pods
 
     @property
     def selector(self):
@@ -92,3 +150,39 @@ class KubernetesDependency:
     @property
     def definition(self):
         raise NotImplementedError
+
+
+class PodSnapshot:
+    """
+    Pods of several dependencies listed with single call. Dependencies not covered by the snapshot (or all of them,
+    if listing failed) list their pods themselves.
+    """
+
+    def __init__(self, gateway: kubernetes_gateway.KubectlGateway):
+        self.gateway = gateway
+        self.pods = {}
+
+    @classmethod
+    def take(cls, names, gateway: kubernetes_gateway.KubectlGateway) -> 'PodSnapshot':
+        snapshot = cls(gateway)
+        snapshot.refresh(names)
+        return snapshot
+
+    def refresh(self, names):
+        names = list(names)
+        if not names:
+            return
+        try:
+            items = self.gateway.list_pods(selector='app in ({})'.format(','.join(names)))
+        except kubernetes_gateway.GATEWAY_ERRORS as e:
+            logger.debug(e)
+            for name in names:
+                self.pods.pop(name, None)
+            return
+        pods = {name: [] for name in names}
+        for pod in items:
+            pods[pod['metadata']['labels']['app']].append(pod)
+        self.pods.update(pods)
+
+    def get_pods(self, name):
+        return self.pods.get(name)
@@ -0,0 +1,256 @@
+import base64
+import http.client
+import json
+import logging
+import pathlib
+import socket
+import ssl
+import struct
+import typing
+import urllib.parse
+
+import sh
+
+from cached_property import cached_property
+
+from kubeyard import http_client
+from kubeyard import subprocesses
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DOCKER_HOST = 'unix:///var/run/docker.sock'
+DEFAULT_TIMEOUT = http_client.DEFAULT_TIMEOUT
+DOCKER_HUB_REGISTRY = 'docker.io'
+DOCKER_HUB_AUTH_KEY = 'https://index.docker.io/v1/'
+
+
+class DockerEngineError(Exception):
+    def __init__(self, status, message):
+        super().__init__('{} {}'.format(status, message))
+        self.status = status
+        self.message = message
+
+
+class NotFound(DockerEngineError):
+    pass
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class DockerEngineClient(http_client.PooledHttpClient):
+    """
+    Minimal Docker Engine API client. It understands the same DOCKER_HOST, DOCKER_TLS_VERIFY and DOCKER_CERT_PATH
+    variables as docker CLI (so it works with `minikube docker-env`) and keeps idle connections open between calls.
+    """
+
+    def __init__(self, env):
+        super().__init__(timeout=DEFAULT_TIMEOUT)
+        self.docker_host = env.get('DOCKER_HOST') or DEFAULT_DOCKER_HOST
+        self.tls_verify = bool(env.get('DOCKER_TLS_VERIFY'))
+        self.cert_path = pathlib.Path(env.get('DOCKER_CERT_PATH') or pathlib.Path.home() / '.docker')
+        self.config_path = pathlib.Path(env.get('DOCKER_CONFIG') or pathlib.Path.home() / '.docker') / 'config.json'
+
+    def ping(self) -> bool:
+        try:
+            return self.request('GET', '/_ping') == b'OK'
+        except (OSError, http.client.HTTPException, DockerEngineError) as e:
+            logger.debug('Docker Engine API is not available at {}: {}'.format(self.docker_host, e))
+            return False
+
+    def inspect_container(self, name) -> dict:
+        return self.request('GET', '/containers/{}/json'.format(_quote(name)))
+
+    def start_container(self, name):
+        self.request('POST', '/containers/{}/start'.format(_quote(name)))
+
+    def remove_container(self, name, *, force=False, volumes=False):
+        params = {'force': _bool(force), 'v': _bool(volumes)}
+        self.request('DELETE', '/containers/{}'.format(_quote(name)), params=params)
+
+    def container_logs(self, name, *, follow=False, since=None):
+        params = {'stdout': '1', 'stderr': '1', 'follow': _bool(follow)}
+        if since is not None:
+            params['since'] = str(int(since))
+        timeout = None if follow else self.timeout
+        with self.stream('GET', '/containers/{}/logs'.format(_quote(name)), params=params, timeout=timeout) as response:
+            yield from http_client.iter_lines(_demultiplex(response))
+
+    def find_containers(self, *, label) -> typing.List[str]:
+        params = {'all': '1', 'filters': json.dumps({'label': [label]})}
+        containers = self.request('GET', '/containers/json', params=params)
+        return [container['Names'][0].lstrip('/') for container in containers]
+
+    def exec_container(self, name, command) -> typing.Tuple[int, str]:
+        body = {'Cmd': list(command), 'AttachStdout': True, 'AttachStderr': True}
+        exec_id = self.request('POST', '/containers/{}/exec'.format(_quote(name)), body=body)['Id']
+        with self.stream('POST', '/exec/{}/start'.format(exec_id), body={'Detach': False, 'Tty': False}) as response:
+            output = b''.join(_demultiplex(response))
+        exit_code = self.request('GET', '/exec/{}/json'.format(exec_id))['ExitCode']
+        return exit_code, output.decode(errors='replace')
+
+    def inspect_image(self, name) -> dict:
+        return self.request('GET', '/images/{}/json'.format(_quote(name)))
+
+    def find_images(self, *, label) -> typing.List[str]:
+        images = self.request('GET', '/images/json', params={'filters': json.dumps({'label': [label]})})
+        return [image['Id'] for image in images]
+
+    def tag_image(self, image, target):
+        repository, tag = split_image_tag(target)
+        self.request('POST', '/images/{}/tag'.format(_quote(image)), params={'repo': repository, 'tag': tag})
+
+    def push_image(self, image) -> typing.Iterator[dict]:
+        """Pushes single tag of the image, yields progress messages."""
+        repository, tag = split_image_tag(image)
+        headers = {'X-Registry-Auth': self.get_registry_auth(get_registry(repository))}
+        path = '/images/{}/push'.format(_quote(repository))
+        with self.stream('POST', path, params={'tag': tag}, headers=headers, timeout=None) as response:
+            for line in http_client.iter_lines(http_client.iter_chunks(response)):
+                if not line.strip():
+                    continue
+                message = json.loads(line)
+                if 'error' in message:
+                    raise DockerEngineError(None, message['error'])
+                yield message
+
+    def get_registry_auth(self, registry) -> str:
+        """Reads credentials stored by `docker login`, including credential helpers."""
+        try:
+            with self.config_path.open() as config_file:
+                config = json.load(config_file)
+        except (FileNotFoundError, ValueError):
+            config = {}
+        auth_key = DOCKER_HUB_AUTH_KEY if registry == DOCKER_HUB_REGISTRY else registry
+        credentials = {'serveraddress': auth_key}
+        helper = (config.get('credHelpers') or {}).get(registry) or config.get('credsStore')
+        if helper:
+            credentials.update(self._get_helper_credentials(helper, auth_key))
+        else:
+            for key, entry in (config.get('auths') or {}).items():
+                if _normalize_registry(key) == _normalize_registry(auth_key):
+                    credentials.update(_decode_auth_entry(entry))
+                    break
+        return base64.urlsafe_b64encode(json.dumps(credentials).encode()).decode()
+
+    @staticmethod
+    def _get_helper_credentials(helper, server) -> dict:
+        try:
+            output = subprocesses.AccountedCommand('docker-credential-{}'.format(helper))('get', _in=server)
+        except (sh.ErrorReturnCode, sh.CommandNotFound) as e:
+            logger.debug('No credentials for {} in docker-credential-{}: {}'.format(server, helper, e))
+            return {}
+        stored = json.loads(str(output))
+        if stored.get('Username') == '<token>':
+            return {'identitytoken': stored['Secret']}
+        return {'username': stored['Username'], 'password': stored['Secret']}
+
+    def create_volume(self, name=None, *, labels=None) -> str:
+        body = {'Labels': labels or {}}
+        if name:
+            body['Name'] = name
+        return self.request('POST', '/volumes/create', body=body)['Name']
+
+    def inspect_volume(self, name) -> dict:
+        return self.request('GET', '/volumes/{}'.format(_quote(name)))
+
+    def find_volumes(self, *, label) -> typing.List[str]:
+        volumes = self.request('GET', '/volumes', params={'filters': json.dumps({'label': [label]})})
+        return [volume['Name'] for volume in volumes['Volumes'] or []]
+
+    def remove_volume(self, name):
+        self.request('DELETE', '/volumes/{}'.format(_quote(name)))
+
+    def _new_connection(self, timeout):
+        url = urllib.parse.urlsplit(self.docker_host)
+        if url.scheme == 'unix':
+            return UnixHTTPConnection(url.path, timeout)
+        elif url.scheme in ('tcp', 'http', 'https'):
+            if self.tls_verify or url.scheme == 'https':
+                return http.client.HTTPSConnection(url.hostname, url.port or 2376, timeout=timeout,
+                                                   context=self._ssl_context)
+            else:
+                return http.client.HTTPConnection(url.hostname, url.port or 2375, timeout=timeout)
+        else:
+            raise DockerEngineError(None, 'Unsupported DOCKER_HOST: {}'.format(self.docker_host))
+
+    @cached_property
+    def _ssl_context(self):
+        context = ssl.create_default_context(cafile=str(self.cert_path / 'ca.pem'))
+        context.load_cert_chain(str(self.cert_path / 'cert.pem'), str(self.cert_path / 'key.pem'))
+        return context
+
+    def _error(self, response):
+        data = response.read()
+        try:
+            message = json.loads(data)['message']
+        except (ValueError, KeyError, TypeError):
+            message = data.decode(errors='replace')
+        error_class = NotFound if response.status == 404 else DockerEngineError
+        return error_class(response.status, message)
+
+
+def split_image_tag(image) -> typing.Tuple[str, str]:
+    repository, _, tag = image.rpartition(':')
+    if not repository or '/' in tag:
+        return image, 'latest'
+    return repository, tag
+
+
+def get_registry(repository) -> str:
+    first, _, rest = repository.partition('/')
+    if rest and ('.' in first or ':' in first or first == 'localhost'):
+        return first
+    return DOCKER_HUB_REGISTRY
+
+
+def is_endpoint_reachable(docker_host, timeout=0.5) -> bool:
+    url = urllib.parse.urlsplit(docker_host or DEFAULT_DOCKER_HOST)
+    if url.scheme == 'unix':
+        return pathlib.Path(url.path).is_socket()
+    try:
+        with socket.create_connection((url.hostname, url.port or 2376), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def _demultiplex(response):
+    """Strips stream headers from non-TTY attach/logs output."""
+    while True:
+        header = response.read(8)
+        if len(header) < 8:
+            return
+        _stream, size = struct.unpack('>BxxxL', header)
+        yield response.read(size)
+
+
+def _normalize_registry(address):
+    address = urllib.parse.urlsplit(address).netloc or address
+    return DOCKER_HUB_REGISTRY if address in ('index.docker.io', 'registry-1.docker.io') else address.rstrip('/')
+
+
+def _decode_auth_entry(entry) -> dict:
+    if entry.get('identitytoken'):
+        return {'identitytoken': entry['identitytoken']}
+    if entry.get('auth'):
+        username, _, password = base64.b64decode(entry['auth']).decode().partition(':')
+        return {'username': username, 'password': password}
+    return {}
+
+
+def _quote(name):
+    return urllib.parse.quote(name, safe='')
+
+
+def _bool(value):
+    return '1' if value else '0'
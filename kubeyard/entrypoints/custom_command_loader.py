@@ -1,12 +1,14 @@
+import functools
 import os
 import pathlib
 
 import click
 
-from cached_property import cached_property
-
 from kubeyard import settings
-from kubeyard.commands import CustomScriptCommand
+from kubeyard.entrypoints.lazy import KubeyardCommand
+from kubeyard.entrypoints.lazy import LazyCommandClass
+
+CustomScriptCommand = LazyCommandClass('CustomScriptCommand')
 
 
 class CustomCommandsLoader(click.MultiCommand):
@@ -19,7 +21,7 @@ class CustomCommandsLoader(click.MultiCommand):
         super().__init__(**attrs)
         self.main_cli = main_cli
 
-    @cached_property
+    @functools.cached_property
     def custom_scripts(self):
         cmds = {}
         if self.scripts_dir.exists():
@@ -43,7 +45,8 @@ class CustomCommandsLoader(click.MultiCommand):
 
         @click.command(
             name=cmd_name,
-            help=CustomScriptCommand.__doc__,
+            cls=KubeyardCommand,
+            command_class=CustomScriptCommand,
             context_settings=dict(
                 ignore_unknown_options=True,
             ),
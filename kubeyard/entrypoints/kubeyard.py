@@ -3,29 +3,29 @@ import logging
 
 import click
 
-from kubeyard import logging as kubeyard_logging
 from kubeyard import settings
-from kubeyard.commands import BuildCommand
-from kubeyard.commands import DebugCommand
-from kubeyard.commands import DeployCommand
-from kubeyard.commands import FixCodeStyleCommand
-from kubeyard.commands import InitCommand
-from kubeyard.commands import InstallCompletion
-from kubeyard.commands import InstallGlobalSecretsCommand
-from kubeyard.commands import PushCommand
-from kubeyard.commands import SetupCommand
-from kubeyard.commands import ShellCommand
-from kubeyard.commands import TestCommand
-from kubeyard.commands import UpdateRequirementsCommand
-from kubeyard.commands.init import PythonPackageInitType
-from kubeyard.commands.init import all_templates
 from kubeyard.entrypoints.custom_command_loader import CustomCommandsLoader
+from kubeyard.entrypoints.lazy import KubeyardGroup
+from kubeyard.entrypoints.lazy import LazyCommandClass
 
-kubeyard_logging.init_logging()
 logger = logging.getLogger(__name__)
 
-
-@click.group()
+BuildCommand = LazyCommandClass('BuildCommand')
+DebugCommand = LazyCommandClass('DebugCommand')
+DeployCommand = LazyCommandClass('DeployCommand')
+FixCodeStyleCommand = LazyCommandClass('FixCodeStyleCommand')
+InitCommand = LazyCommandClass('InitCommand')
+InstallCompletion = LazyCommandClass('InstallCompletion')
+InstallGlobalSecretsCommand = LazyCommandClass('InstallGlobalSecretsCommand')
+PushCommand = LazyCommandClass('PushCommand')
+SetupCommand = LazyCommandClass('SetupCommand')
+ShellCommand = LazyCommandClass('ShellCommand')
+TestCommand = LazyCommandClass('TestCommand')
+TestDatabasePoolCommand = LazyCommandClass('TestDatabasePoolCommand')
+UpdateRequirementsCommand = LazyCommandClass('UpdateRequirementsCommand')
+
+
+@click.group(cls=KubeyardGroup)
 @click.version_option()
 def cli():
     """
@@ -66,9 +66,14 @@ initialized_repository_options = (
         flag_value="DEBUG",
         help="Outputs debug logs.",
     ),
+    click.option(
+        "--profile",
+        is_flag=True,
+        help="Measures command phases, prints a summary and saves Chrome trace to <project_dir>/.kubeyard/profiles/.",
+    ),
 )
 
-devel_options = (
+tag_and_default_options = (
     click.option(
         "--tag",
         help="Used image tag.",
@@ -79,15 +84,26 @@ devel_options = (
         is_flag=True,
         help="Don't try to execute custom script. Useful when you need original behaviour in overridden method.",
     ),
+)
+
+devel_options = tag_and_default_options + (
     click.option(
         "--image-name",
         help="Image name (without repository). Default is set in kubeyard.yml.",
     ),
 )
 
+multi_image_devel_options = tag_and_default_options + (
+    click.option(
+        "--image-name",
+        multiple=True,
+        help="Image name (without repository). May be repeated. Defaults to all images declared in kubeyard.yml.",
+    ),
+)
+
 
 @cli.command(
-    help=TestCommand.__doc__,
+    command_class=TestCommand,
     context_settings=dict(
         ignore_unknown_options=True,
     ),
@@ -99,7 +115,8 @@ devel_options = (
     "-f-m-db",
     "force_migrate_database",
     is_flag=True,
-    help="On dev environment DB is cached, so if you have some new migrations, you should use this flag.",
+    help="On dev environment DB is cached and migrated again only if migration sources changed. "
+         "Use this flag to run migrations anyway.",
 )
 @click.option(
     "--force-recreate-db",
@@ -109,21 +126,60 @@ devel_options = (
     help="On dev environment DB is cached, "
          "so you can use this flag to remove existing DB before tests and create new one.",
 )
+@click.option(
+    "--shards",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Run tests in given number of containers at once, each of them with its own database.",
+)
+@click.option(
+    "--changed",
+    "changed_ref",
+    is_flag=False,
+    flag_value="HEAD",
+    default=None,
+    metavar="[REF]",
+    help="Run only test modules affected by files changed since given git reference (HEAD by default).",
+)
 @click.argument("test_options", nargs=-1, type=click.UNPROCESSED)
 def test(**kwargs):
     TestCommand(**kwargs).run()
 
 
-@cli.command(help=FixCodeStyleCommand.__doc__)
+@cli.group(cls=KubeyardGroup)
+def test_db():
+    """
+    Manages test databases shared between test runs.
+    """
+    pass
+
+
+@test_db.command(command_class=TestDatabasePoolCommand)
+@apply_common_options(initialized_repository_options)
+@click.option(
+    "--size",
+    type=click.IntRange(min=1),
+    help="Number of databases in the pool. Default is set in kubeyard.yml (test_database_pool_size).",
+)
+@click.option(
+    "--clear",
+    is_flag=True,
+    help="Remove all databases of the pool.",
+)
+def pool(**kwargs):
+    TestDatabasePoolCommand(**kwargs).run()
+
+
+@cli.command(command_class=FixCodeStyleCommand)
 @apply_common_options(initialized_repository_options)
 @apply_common_options(devel_options)
 def fix_code_style(**kwargs):
     FixCodeStyleCommand(**kwargs).run()
 
 
-@cli.command(help=BuildCommand.__doc__)
+@cli.command(command_class=BuildCommand)
 @apply_common_options(initialized_repository_options)
-@apply_common_options(devel_options)
+@apply_common_options(multi_image_devel_options)
 @click.option(
     "--image-context",
     help="Image context containing Dockerfile. Defaults to <project_dir>/docker",
@@ -132,25 +188,30 @@ def fix_code_style(**kwargs):
     "--docker-args",
     help='Additional arguments passed to docker command. Use like that: --docker-args="-a x --arg2=y --arg3=z"',
 )
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Build even if an image built from the same context already exists.",
+)
 def build(**kwargs):
     BuildCommand(**kwargs).run()
 
 
-@cli.command(help=UpdateRequirementsCommand.__doc__)
+@cli.command(command_class=UpdateRequirementsCommand)
 @apply_common_options(initialized_repository_options)
 @apply_common_options(devel_options)
 def update_requirements(**kwargs):
     UpdateRequirementsCommand(**kwargs).run()
 
 
-@cli.command(help=PushCommand.__doc__)
+@cli.command(command_class=PushCommand)
 @apply_common_options(initialized_repository_options)
-@apply_common_options(devel_options)
+@apply_common_options(multi_image_devel_options)
 def push(**kwargs):
     PushCommand(**kwargs).run()
 
 
-@cli.command(help=DeployCommand.__doc__)
+@cli.command(command_class=DeployCommand)
 @apply_common_options(initialized_repository_options)
 @apply_common_options(devel_options)
 @click.option(
@@ -189,7 +250,7 @@ def deploy(**kwargs):
     DeployCommand(**kwargs).run()
 
 
-@cli.command(help=DebugCommand.__doc__)
+@cli.command(command_class=DebugCommand)
 @apply_common_options(initialized_repository_options)
 @click.argument(
     'name',
@@ -199,7 +260,7 @@ def variables(**kwargs):
     DebugCommand(**kwargs).run()
 
 
-@cli.command(help=InstallCompletion.__doc__)
+@cli.command(command_class=InstallCompletion)
 @click.option(
     "--force",
     "-f",
@@ -210,12 +271,12 @@ def install_bash_completion(**kwargs):
     InstallCompletion(**kwargs).run()
 
 
-@cli.command(help=InstallGlobalSecretsCommand.__doc__)
+@cli.command(command_class=InstallGlobalSecretsCommand)
 def install_global_secrets():
     InstallGlobalSecretsCommand().run()
 
 
-@cli.command(help=SetupCommand.__doc__)
+@cli.command(command_class=SetupCommand)
 @click.option(
     "--development",
     "mode",
@@ -231,7 +292,7 @@ def setup(**kwargs):
     SetupCommand(**kwargs).run()
 
 
-@cli.command(help=InitCommand.__doc__)
+@cli.command(command_class=InitCommand)
 @click.option(
     "--directory",
     default=".",
@@ -241,17 +302,18 @@ def setup(**kwargs):
 @click.option(
     "--template",
     "template_name",
-    type=click.Choice([template.name for template in all_templates]),
-    default=PythonPackageInitType.name,
+    type=click.Choice(settings.INIT_TEMPLATE_NAMES),
+    default=settings.DEFAULT_INIT_TEMPLATE_NAME,
     help="Select ember template.",
 )
 def init(*, template_name, **kwargs):
+    from kubeyard.commands.init import all_templates
     for template in all_templates:
         if template.name == template_name:
             return InitCommand(init_type=template, **kwargs).run()
 
 
-@cli.command(help=ShellCommand.__doc__)
+@cli.command(command_class=ShellCommand)
 @apply_common_options(initialized_repository_options)
 @apply_common_options(devel_options)
 @click.option(
@@ -284,3 +346,7 @@ cli_with_custom_commands = click.CommandCollection(sources=[
     cli,
     custom_commands,
 ])
+
+
+if __name__ == '__main__':
+    cli_with_custom_commands()
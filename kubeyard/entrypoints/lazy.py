@@ -0,0 +1,69 @@
+import ast
+import importlib.util
+import pathlib
+
+import click
+
+from kubeyard import commands
+from kubeyard import logging as kubeyard_logging
+from kubeyard import profiling
+
+
+class LazyCommandClass:
+    """
+    Stands in for a class from `kubeyard.commands`. The class is imported when it is instantiated, and its docstring
+    is read from the module source, so listing commands and displaying help doesn't import any command module.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        return getattr(commands, self.name)(*args, **kwargs)
+
+    @property
+    def docstring(self):
+        module_spec = importlib.util.find_spec(commands.command_modules[self.name])
+        with open(module_spec.origin) as module_file:
+            module = ast.parse(module_file.read())
+        for node in module.body:
+            if isinstance(node, ast.ClassDef) and node.name == self.name:
+                return ast.get_docstring(node, clean=False)
+        return None
+
+
+class KubeyardCommand(click.Command):
+    def __init__(self, *args, command_class: LazyCommandClass = None, **kwargs):
+        self.command_class = command_class
+        super().__init__(*args, **kwargs)
+
+    @property
+    def help(self):
+        if self._help is None and self.command_class is not None:
+            self._help = self.command_class.docstring
+        return self._help
+
+    @help.setter
+    def help(self, value):
+        self._help = value
+
+    def invoke(self, ctx):
+        kubeyard_logging.init_logging()
+        profile = ctx.params.pop('profile', False)
+        if profile:
+            profiling.profiler.enable()
+        try:
+            with profiling.span(self.name, category='command'):
+                return super().invoke(ctx)
+        finally:
+            self.report(ctx, profile)
+
+    def report(self, ctx, profile):
+        from kubeyard import subprocesses
+        subprocesses.accountant.log_summary()
+        if profile:
+            profiling.report(pathlib.Path(ctx.params.get('directory', '.')), self.name)
+
+
+class KubeyardGroup(click.Group):
+    command_class = KubeyardCommand
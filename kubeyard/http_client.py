@@ -0,0 +1,103 @@
+import contextlib
+import http.client
+import json
+import queue
+import urllib.parse
+
+DEFAULT_TIMEOUT = 60
+
+
+class PooledHttpClient:
+    """
+    JSON over HTTP client keeping idle keep-alive connections open between calls. Subclasses create connections
+    and turn error responses into exceptions.
+    """
+    pool_size = 4
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self._idle_connections = queue.LifoQueue(maxsize=self.pool_size)
+
+    def request(self, method, path, *, params=None, body=None, headers=None):
+        with self.stream(method, path, params=params, body=body, headers=headers) as response:
+            data = response.read()
+        if response.getheader('Content-Type', '').startswith('application/json') and data:
+            return json.loads(data)
+        return data
+
+    @contextlib.contextmanager
+    def stream(self, method, path, *, params=None, body=None, headers=None, timeout=DEFAULT_TIMEOUT):
+        url = path + ('?' + urllib.parse.urlencode(params) if params else '')
+        headers = {**self.default_headers, **(headers or {})}
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        connection, response = self._send(method, url, body, headers, timeout)
+        try:
+            if response.status >= 400:
+                raise self._error(response)
+            yield response
+        except BaseException:
+            connection.close()
+            raise
+        else:
+            if response.isclosed() and not response.will_close:
+                self._release(connection)
+            else:
+                connection.close()
+
+    @property
+    def default_headers(self) -> dict:
+        return {}
+
+    def _send(self, method, url, body, headers, timeout):
+        connection, reused = self._acquire(timeout)
+        try:
+            connection.request(method, url, body=body, headers=headers)
+            return connection, connection.getresponse()
+        except (ConnectionError, http.client.RemoteDisconnected, http.client.CannotSendRequest):
+            connection.close()
+            if not reused:
+                raise
+        # The server closed an idle keep-alive connection, retry once on a fresh one.
+        connection = self._new_connection(timeout)
+        connection.request(method, url, body=body, headers=headers)
+        return connection, connection.getresponse()
+
+    def _acquire(self, timeout):
+        if timeout == self.timeout:
+            try:
+                return self._idle_connections.get_nowait(), True
+            except queue.Empty:
+                pass
+        return self._new_connection(timeout), False
+
+    def _release(self, connection):
+        if connection.timeout != self.timeout:
+            connection.close()
+            return
+        try:
+            self._idle_connections.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def _new_connection(self, timeout) -> http.client.HTTPConnection:
+        raise NotImplementedError
+
+    def _error(self, response) -> Exception:
+        raise NotImplementedError
+
+
+def iter_lines(chunks):
+    buffer = b''
+    for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield line.decode(errors='replace') + '\n'
+    if buffer:
+        yield buffer.decode(errors='replace')
+
+
+def iter_chunks(response, size=65536):
+    return iter(lambda: response.read1(size), b'')
@@ -1,3 +1,31 @@
+import sys
+import threading
+
+
 def default_input(prompt, default):
     value = input('{} [{}]: '.format(prompt, default))
     return value or default
+
+
+class PrefixedOutput:
+    """
+    `sh` output callback for commands running concurrently. Every line is written to stdout at once, prefixed with
+    a label, so lines of different commands don't interleave. Prefixed lines may be passed to another callback
+    instead, so prefixes can be nested.
+    """
+    _lock = threading.Lock()
+
+    def __init__(self, prefix, output=None):
+        self.prefix = prefix
+        self.output = output
+
+    def __call__(self, line):
+        if isinstance(line, bytes):
+            line = line.decode(errors='replace')
+        line = '{}{}\n'.format(self.prefix, line.rstrip('\n'))
+        if self.output:
+            self.output(line)
+            return
+        with self._lock:
+            sys.stdout.write(line)
+            sys.stdout.flush()
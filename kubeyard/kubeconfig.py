@@ -0,0 +1,51 @@
+import os
+import pathlib
+import typing
+
+import yaml
+
+
+def get_kubeconfig_paths() -> typing.List[pathlib.Path]:
+    if os.environ.get('KUBECONFIG'):
+        return [pathlib.Path(path) for path in os.environ['KUBECONFIG'].split(os.pathsep) if path]
+    else:
+        return [pathlib.Path.home() / '.kube' / 'config']
+
+
+def load_kubeconfig() -> dict:
+    """
+    Loads kubeconfig the same way kubectl does: files from KUBECONFIG are merged, the first occurrence of a value wins.
+    """
+    merged = {'clusters': [], 'contexts': [], 'users': []}
+    for path in get_kubeconfig_paths():
+        try:
+            with path.open() as config_file:
+                config = yaml.safe_load(config_file) or {}
+        except FileNotFoundError:
+            continue
+        merged.setdefault('current-context', config.get('current-context'))
+        for section in ('clusters', 'contexts', 'users'):
+            known_names = {entry['name'] for entry in merged[section]}
+            merged[section] += [entry for entry in config.get(section) or [] if entry['name'] not in known_names]
+    return merged
+
+
+def get_current(config: dict, section: str) -> typing.Optional[dict]:
+    context = _find(config['contexts'], config.get('current-context'))
+    if context is None:
+        return None
+    if section == 'contexts':
+        return context
+    return _find(config[section], context['context'].get(section[:-1]))
+
+
+def get_current_server(config: dict) -> typing.Optional[str]:
+    cluster = get_current(config, 'clusters')
+    return cluster['cluster'].get('server') if cluster else None
+
+
+def _find(entries, name):
+    for entry in entries:
+        if entry['name'] == name:
+            return entry
+    return None
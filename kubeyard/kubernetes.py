@@ -4,10 +4,11 @@ import logging
 import pathlib
 import socket
 
-import sh
 import yaml
 
+from kubeyard import kubernetes_gateway
 from kubeyard import minikube
+from kubeyard import profiling
 from kubeyard import settings
 
 logger = logging.getLogger(__name__)
@@ -19,7 +20,8 @@ def setup_cluster_context(context):
 
 def install_secrets(context):
     logger.info('Installing secrets...')
-    _get_kubernetes_commands(context).install_secrets()
+    with profiling.span('secrets install'):
+        _get_kubernetes_commands(context).install_secrets()
     logger.info('Secrets installed')
 
 
@@ -35,18 +37,20 @@ def get_global_secrets_manipulator(context, secret_name):
     return KubernetesSecretsManipulator(
         secret_name,
         pathlib.Path(context['KUBEYARD_GLOBAL_SECRETS']) / secret_name,
+        gateway=kubernetes_gateway.get_gateway(context),
     )
 
 
 def _get_kubernetes_commands(context):
+    gateway = kubernetes_gateway.get_gateway(context)
     if context['KUBEYARD_MODE'] == 'development':
         return KubernetesCommands(
-            context_setup=DevelopmentKubernetesContext(context).setup,
+            context_setup=DevelopmentKubernetesContext(context, gateway).setup,
             install_secrets=DevelopmentKubernetesSecretsInstaller(context).install,
         )
     else:
         return KubernetesCommands(
-            context_setup=ProductionKubernetesContext().setup,
+            context_setup=ProductionKubernetesContext(gateway).setup,
             install_secrets=ProductionKubernetesSecretsInstaller(context).install,
         )
 
@@ -55,15 +59,16 @@ KubernetesCommands = collections.namedtuple('KubernetesCommand', ['context_setup
 
 
 class BaseKubernetesContext:
+    def __init__(self, gateway: kubernetes_gateway.KubectlGateway):
+        self.gateway = gateway
+
     def setup(self):
-        with contextlib.suppress(sh.ErrorReturnCode):
-            sh.kubectl('delete', 'configmap', 'global')
-        sh.kubectl('create', 'configmap', 'global',
-                   '--from-literal', 'monolith-host={}'.format(self.monolith_host),
-                   '--from-literal', 'base-domain={}'.format(self.base_domain),
-                   '--from-literal', 'alternative-domain={}'.format(self.alternative_domain),
-                   '--from-literal', 'debug={}'.format(self.debug),
-                   )
+        self.gateway.replace_config_map('global', {
+            'monolith-host': self.monolith_host,
+            'base-domain': self.base_domain,
+            'alternative-domain': self.alternative_domain,
+            'debug': self.debug,
+        })
 
     @property
     def monolith_host(self):
@@ -87,7 +92,8 @@ class DevelopmentKubernetesContext(BaseKubernetesContext):
     alternative_domain = 'pl-testing'
     debug = 'True'
 
-    def __init__(self, context):
+    def __init__(self, context, gateway: kubernetes_gateway.KubectlGateway):
+        super().__init__(gateway)
         self.cluster = minikube.ClusterFactory().get(context)
 
     def setup(self):
@@ -109,9 +115,10 @@ class ProductionKubernetesContext(BaseKubernetesContext):
 
 
 class KubernetesSecretsManipulator:
-    def __init__(self, secret_name, secrets_path):
+    def __init__(self, secret_name, secrets_path, gateway: kubernetes_gateway.KubectlGateway = None):
         self.secret_name = secret_name
         self.secrets_path = secrets_path
+        self.gateway = gateway or kubernetes_gateway.KubectlGateway()
 
     @property
     def yml_source_path(self):
@@ -147,15 +154,10 @@ class KubernetesSecretsManipulator:
 
     def is_key_present(self, key):
         try:
-            yml_output = str(sh.kubectl(
-                'get', 'secrets', self.secret_name,
-                '--output', 'yaml',
-            ))
-        except sh.ErrorReturnCode:
+            secret = self.gateway.get_secret(self.secret_name)
+        except kubernetes_gateway.GATEWAY_ERRORS:
             return False
-        else:
-            secret = yaml.safe_load(yml_output)
-            return key in secret['data']
+        return secret is not None and key in (secret.get('data') or {})
 
 
 class BaseKubernetesSecretsInstaller:
@@ -163,19 +165,18 @@ class BaseKubernetesSecretsInstaller:
         self.context = context
 
     def install(self):
-        command = ['create', 'secret', 'generic', self.secret_name, '--dry-run', '-o', 'yaml']
         literal_secrets = list(self.manipulator.get_literal_secrets())
         file_secrets = list(self.manipulator.get_file_secrets())
         if literal_secrets or file_secrets:
-            for key, value in literal_secrets:
-                command.append('--from-literal={}={}'.format(key, value))
-            for subpath in file_secrets:
-                command.append('--from-file={}'.format(subpath))
-            sh.kubectl(sh.kubectl(*command), 'apply', '--record', '-f', '-')
+            self.gateway.apply_secret(self.secret_name, literals=literal_secrets, files=file_secrets)
+
+    @property
+    def gateway(self) -> kubernetes_gateway.KubectlGateway:
+        return kubernetes_gateway.get_gateway(self.context)
 
     @property
     def manipulator(self):
-        return KubernetesSecretsManipulator(self.secret_name, self.secrets_path)
+        return KubernetesSecretsManipulator(self.secret_name, self.secrets_path, gateway=self.gateway)
 
     @property
     def secret_name(self):
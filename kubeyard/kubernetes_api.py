@@ -0,0 +1,188 @@
+import base64
+import http.client
+import json
+import logging
+import pathlib
+import ssl
+import tempfile
+import time
+import typing
+import urllib.parse
+
+from cached_property import cached_property
+
+from kubeyard import http_client
+from kubeyard import kubeconfig
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NAMESPACE = 'default'
+
+
+class KubernetesApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__('{} {}'.format(status, message))
+        self.status = status
+        self.message = message
+
+
+class NotFound(KubernetesApiError):
+    pass
+
+
+class Gone(KubernetesApiError):
+    """Requested resource version is too old, e.g. watch has to start again with a fresh list."""
+
+
+class KubernetesApiClient(http_client.PooledHttpClient):
+    """
+    Minimal Kubernetes API client. It uses cluster, credentials and namespace of the current kubeconfig context
+    (bearer token, client certificate or basic auth; credential plugins are not supported), reads the kubeconfig
+    once and keeps idle connections open between calls.
+    """
+
+    def __init__(self, config: dict):
+        super().__init__()
+        cluster = kubeconfig.get_current(config, 'clusters')
+        if cluster is None:
+            raise KubernetesApiError(None, 'Current kubeconfig context has no cluster.')
+        self.cluster = cluster['cluster']
+        self.user = (kubeconfig.get_current(config, 'users') or {}).get('user') or {}
+        if 'exec' in self.user or 'auth-provider' in self.user:
+            raise KubernetesApiError(None, 'Kubeconfig credential plugins are not supported.')
+        self.server = urllib.parse.urlsplit(self.cluster['server'])
+        self.namespace = kubeconfig.get_current(config, 'contexts')['context'].get('namespace') or DEFAULT_NAMESPACE
+
+    @classmethod
+    def from_kubeconfig(cls) -> 'KubernetesApiClient':
+        return cls(kubeconfig.load_kubeconfig())
+
+    def ping(self) -> bool:
+        try:
+            self.request('GET', '/version')
+        except (OSError, http.client.HTTPException, KubernetesApiError) as e:
+            logger.debug('Kubernetes API is not available at {}: {}'.format(self.server.geturl(), e))
+            return False
+        return True
+
+    def list_pods(self, *, selector=None) -> typing.List[dict]:
+        return self.list(self.namespaced('pods'), selector=selector)['items']
+
+    def watch_pods(self, *, selector, timeout) -> typing.Iterator[dict]:
+        """
+        Yields current pods and then every change of them (deleted pods are yielded with deletionTimestamp set).
+        Raises TimeoutError after `timeout` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        pods = self.list(self.namespaced('pods'), selector=selector)
+        yield from pods['items']
+        resource_version = pods['metadata']['resourceVersion']
+        while time.monotonic() < deadline:
+            params = {
+                'watch': '1',
+                'resourceVersion': resource_version,
+                'timeoutSeconds': str(max(1, int(deadline - time.monotonic()))),
+            }
+            if selector:
+                params['labelSelector'] = selector
+            with self.stream('GET', self.namespaced('pods'), params=params, timeout=timeout) as response:
+                for line in http_client.iter_lines(http_client.iter_chunks(response)):
+                    if not line.strip():
+                        continue
+                    event = json.loads(line)
+                    if event['type'] == 'ERROR':
+                        code = event['object'].get('code')
+                        error_class = Gone if code == 410 else KubernetesApiError
+                        raise error_class(code, event['object'].get('message'))
+                    pod = event['object']
+                    resource_version = pod['metadata']['resourceVersion']
+                    if event['type'] == 'DELETED':
+                        pod['metadata'].setdefault('deletionTimestamp', 'deleted')
+                    yield pod
+        raise TimeoutError()
+
+    def pod_logs(self, name, *, follow=False) -> typing.Iterator[str]:
+        path = self.namespaced('pods/{}/log'.format(_quote(name)))
+        timeout = None if follow else self.timeout
+        with self.stream('GET', path, params={'follow': str(follow).lower()}, timeout=timeout) as response:
+            yield from http_client.iter_lines(http_client.iter_chunks(response))
+
+    def get_secret(self, name) -> dict:
+        return self.request('GET', self.namespaced('secrets/{}'.format(_quote(name))))
+
+    def create_config_map(self, name, data: dict):
+        body = {'apiVersion': 'v1', 'kind': 'ConfigMap', 'metadata': {'name': name}, 'data': data}
+        self.request('POST', self.namespaced('configmaps'), body=body)
+
+    def delete_config_map(self, name):
+        self.request('DELETE', self.namespaced('configmaps/{}'.format(_quote(name))))
+
+    def list_nodes(self, *, selector=None) -> typing.List[dict]:
+        return self.list('/api/v1/nodes', selector=selector)['items']
+
+    def list(self, path, *, selector=None) -> dict:
+        return self.request('GET', path, params={'labelSelector': selector} if selector else None)
+
+    def namespaced(self, resource) -> str:
+        return '/api/v1/namespaces/{}/{}'.format(_quote(self.namespace), resource)
+
+    @property
+    def default_headers(self) -> dict:
+        headers = {'Accept': 'application/json'}
+        token = self.user.get('token')
+        if not token and self.user.get('tokenFile'):
+            token = pathlib.Path(self.user['tokenFile']).read_text().strip()
+        if token:
+            headers['Authorization'] = 'Bearer {}'.format(token)
+        elif self.user.get('username'):
+            credentials = '{}:{}'.format(self.user['username'], self.user.get('password', ''))
+            headers['Authorization'] = 'Basic {}'.format(base64.b64encode(credentials.encode()).decode())
+        return headers
+
+    def _new_connection(self, timeout):
+        if self.server.scheme == 'https':
+            return http.client.HTTPSConnection(
+                self.server.hostname, self.server.port or 443, timeout=timeout, context=self._ssl_context,
+            )
+        elif self.server.scheme == 'http':
+            return http.client.HTTPConnection(self.server.hostname, self.server.port or 80, timeout=timeout)
+        else:
+            raise KubernetesApiError(None, 'Unsupported server: {}'.format(self.server.geturl()))
+
+    @cached_property
+    def _ssl_context(self):
+        context = ssl.create_default_context()
+        if self.cluster.get('insecure-skip-tls-verify'):
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        elif self.cluster.get('certificate-authority-data'):
+            context.load_verify_locations(cadata=base64.b64decode(self.cluster['certificate-authority-data']).decode())
+        elif self.cluster.get('certificate-authority'):
+            context.load_verify_locations(cafile=self.cluster['certificate-authority'])
+        if self.user.get('client-certificate-data') or self.user.get('client-certificate'):
+            # ssl accepts client certificate only as a file, so inline data is written to a temporary directory.
+            with tempfile.TemporaryDirectory() as directory:
+                certificate = self._credential_file('client-certificate', pathlib.Path(directory) / 'cert.pem')
+                key = self._credential_file('client-key', pathlib.Path(directory) / 'key.pem')
+                context.load_cert_chain(certificate, key)
+        return context
+
+    def _credential_file(self, name, temporary_path: pathlib.Path) -> str:
+        data = self.user.get('{}-data'.format(name))
+        if data:
+            temporary_path.write_bytes(base64.b64decode(data))
+            return str(temporary_path)
+        return self.user[name]
+
+    def _error(self, response):
+        data = response.read()
+        try:
+            message = json.loads(data)['message']
+        except (ValueError, KeyError, TypeError):
+            message = data.decode(errors='replace')
+        error_class = {404: NotFound, 410: Gone}.get(response.status, KubernetesApiError)
+        return error_class(response.status, message)
+
+
+def _quote(name):
+    return urllib.parse.quote(name, safe='')
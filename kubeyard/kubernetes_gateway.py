@@ -0,0 +1,218 @@
+import contextlib
+import functools
+import http.client
+import json
+import logging
+import typing
+
+import sh
+
+from cached_property import cached_property
+
+from kubeyard import kubernetes_api
+from kubeyard import settings
+from kubeyard import subprocesses
+
+logger = logging.getLogger(__name__)
+
+POD_STATUS_TEMPLATE = (
+    '{.metadata.name}{"\\t"}'
+    '{.status.phase}{"\\t"}'
+    '{.status.containerStatuses[*].ready}{"\\t"}'
+    '{.status.containerStatuses[*].state.waiting.reason}{"\\t"}'
+    '{.metadata.deletionTimestamp}{"\\n"}'
+)
+# Errors of both gateways, so callers don't have to know which one they use.
+GATEWAY_ERRORS = (sh.ErrorReturnCode, kubernetes_api.KubernetesApiError)
+# Watch can be started again after these: expired resource version or dropped connection.
+WATCH_INTERRUPTIONS = (kubernetes_api.Gone, ConnectionError, http.client.HTTPException)
+
+
+class PodStatus:
+    def __init__(self, name, phase, ready, waiting_reasons, is_deleted):
+        self.name = name
+        self.phase = phase
+        self.ready = ready
+        self.waiting_reasons = waiting_reasons
+        self.is_deleted = is_deleted
+
+    @classmethod
+    def from_line(cls, line):
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) != 5 or not fields[0]:
+            return None
+        name, phase, ready, waiting_reasons, deletion_timestamp = fields
+        return cls(name, phase, ready.split(), set(waiting_reasons.split()), bool(deletion_timestamp))
+
+    @classmethod
+    def from_pod(cls, pod: dict):
+        container_statuses = pod['status'].get('containerStatuses') or []
+        return cls(
+            pod['metadata']['name'],
+            pod['status'].get('phase', ''),
+            [str(status['ready']).lower() for status in container_statuses],
+            {
+                status['state']['waiting']['reason'] for status in container_statuses
+                if (status.get('state') or {}).get('waiting', {}).get('reason')
+            },
+            bool(pod['metadata'].get('deletionTimestamp')),
+        )
+
+    @property
+    def is_ready(self):
+        return bool(self.ready) and all(ready == 'true' for ready in self.ready)
+
+    @property
+    def description(self):
+        if self.is_deleted:
+            return 'Terminating'
+        if self.waiting_reasons:
+            return '{} ({})'.format(self.phase, ', '.join(sorted(self.waiting_reasons)))
+        return '{}{}'.format(self.phase, ', ready' if self.is_ready else '')
+
+
+class KubectlGateway:
+    """Talks to the cluster by running kubectl."""
+
+    def list_pods(self, *, selector=None) -> typing.List[dict]:
+        selector_args = ['--selector', selector] if selector else []
+        return json.loads(str(subprocesses.kubectl('get', 'pods', *selector_args, '--output', 'json')))['items']
+
+    def watch_pods(self, *, selector, timeout) -> typing.Iterator[PodStatus]:
+        """Yields statuses of current pods and then every change of them. Raises TimeoutError after `timeout`."""
+        watch = subprocesses.kubectl(
+            'get', 'pods',
+            '--selector', selector,
+            '--watch',
+            '--output', 'jsonpath={}'.format(POD_STATUS_TEMPLATE),
+            _iter='out',
+            _timeout=timeout,
+            _bg_exc=False,
+        )
+        try:
+            for line in watch:
+                pod = PodStatus.from_line(line)
+                if pod:
+                    yield pod
+        except sh.TimeoutException:
+            raise TimeoutError()
+        finally:
+            with contextlib.suppress(ProcessLookupError):
+                watch.terminate()
+
+    def pod_logs(self, name, *, follow=False) -> typing.Iterator[str]:
+        if not follow:
+            yield from str(subprocesses.kubectl('logs', name)).splitlines(keepends=True)
+            return
+        logs = subprocesses.kubectl('logs', '-f', name, _iter='out', _bg_exc=False)
+        try:
+            yield from logs
+        finally:
+            with contextlib.suppress(ProcessLookupError):
+                logs.terminate()
+
+    def exec(self, pod_name, *command, input=None):
+        if input is None:
+            return subprocesses.kubectl('exec', pod_name, '--', *command)
+        return subprocesses.kubectl('exec', '-i', pod_name, '--', *command, _in=input)
+
+    def apply(self, definition):
+        subprocesses.kubectl('apply', '--record', '-f', definition)
+
+    def expose(self, definition):
+        subprocesses.kubectl('expose', '-f', definition)
+
+    def get_secret(self, name) -> typing.Optional[dict]:
+        try:
+            return json.loads(str(subprocesses.kubectl('get', 'secrets', name, '--output', 'json')))
+        except sh.ErrorReturnCode as e:
+            logger.debug(e)
+            return None
+
+    def apply_secret(self, name, *, literals, files):
+        command = ['create', 'secret', 'generic', name, '--dry-run', '-o', 'yaml']
+        command += ['--from-literal={}={}'.format(key, value) for key, value in literals]
+        command += ['--from-file={}'.format(path) for path in files]
+        subprocesses.kubectl(subprocesses.kubectl(*command), 'apply', '--record', '-f', '-')
+
+    def replace_config_map(self, name, data: dict):
+        with contextlib.suppress(sh.ErrorReturnCode):
+            subprocesses.kubectl('delete', 'configmap', name)
+        literal_args = ['--from-literal={}={}'.format(key, value) for key, value in data.items()]
+        subprocesses.kubectl('create', 'configmap', name, *literal_args)
+
+    def list_nodes(self, *, selector=None) -> typing.List[dict]:
+        selector_args = ['--selector', selector] if selector else []
+        return json.loads(str(subprocesses.kubectl('get', 'nodes', *selector_args, '--output', 'json')))['items']
+
+
+class ApiGateway(KubectlGateway):
+    """
+    Uses Kubernetes API for reads, watches and config maps, so they share kubeconfig loaded once and keep-alive TLS
+    connections instead of forking kubectl every time. Exec and apply still go through kubectl. Falls back to
+    kubectl if the API can't be used with current kubeconfig.
+    """
+
+    @cached_property
+    def api(self) -> typing.Optional[kubernetes_api.KubernetesApiClient]:
+        try:
+            api = kubernetes_api.KubernetesApiClient.from_kubeconfig()
+        except (KeyError, kubernetes_api.KubernetesApiError) as e:
+            logger.debug('Kubernetes API client can not be used: {}'.format(e))
+            return None
+        return api if api.ping() else None
+
+    def list_pods(self, *, selector=None) -> typing.List[dict]:
+        if not self.api:
+            return super().list_pods(selector=selector)
+        return self.api.list_pods(selector=selector)
+
+    def watch_pods(self, *, selector, timeout) -> typing.Iterator[PodStatus]:
+        if not self.api:
+            yield from super().watch_pods(selector=selector, timeout=timeout)
+            return
+        for pod in self.api.watch_pods(selector=selector, timeout=timeout):
+            yield PodStatus.from_pod(pod)
+
+    def pod_logs(self, name, *, follow=False) -> typing.Iterator[str]:
+        if not self.api:
+            yield from super().pod_logs(name, follow=follow)
+            return
+        yield from self.api.pod_logs(name, follow=follow)
+
+    def get_secret(self, name) -> typing.Optional[dict]:
+        if not self.api:
+            return super().get_secret(name)
+        try:
+            return self.api.get_secret(name)
+        except kubernetes_api.NotFound as e:
+            logger.debug(e)
+            return None
+
+    def replace_config_map(self, name, data: dict):
+        if not self.api:
+            return super().replace_config_map(name, data)
+        with contextlib.suppress(kubernetes_api.NotFound):
+            self.api.delete_config_map(name)
+        self.api.create_config_map(name, data)
+
+    def list_nodes(self, *, selector=None) -> typing.List[dict]:
+        if not self.api:
+            return super().list_nodes(selector=selector)
+        return self.api.list_nodes(selector=selector)
+
+
+KUBERNETES_GATEWAYS = {
+    'kubectl': KubectlGateway,
+    'api': ApiGateway,
+}
+
+
+def get_gateway(context) -> KubectlGateway:
+    return _get_gateway(context.get('KUBEYARD_KUBERNETES_CLIENT', settings.DEFAULT_KUBEYARD_KUBERNETES_CLIENT))
+
+
+@functools.lru_cache(maxsize=None)
+def _get_gateway(client) -> KubectlGateway:
+    # One gateway per process, so all callers share its connections.
+    return KUBERNETES_GATEWAYS[client]()
@@ -1,17 +1,24 @@
 import datetime
 import getpass
+import json
 import logging
 import os
 import pathlib
 import re
+import socket
 import sys
 import time
+import urllib.parse
 
 import sh
 
 from cached_property import cached_property
 
+from kubeyard import cache
+from kubeyard import docker_engine
+from kubeyard import kubeconfig
 from kubeyard import settings
+from kubeyard import subprocesses
 
 logger = logging.getLogger(__name__)
 
@@ -19,10 +26,35 @@ logger = logging.getLogger(__name__)
 class Cluster:
     docker_env_keys = ['DOCKER_TLS_VERIFY', 'DOCKER_HOST', 'DOCKER_CERT_PATH', 'MINIKUBE_ACTIVE_DOCKERD']
     minimum_minikube_version = (1, 37, 0)
+    status_cache = cache.JsonCache('cluster-status')
+
+    def __init__(self, check_ttl=settings.DEFAULT_KUBEYARD_CLUSTER_CHECK_TTL):
+        self.check_ttl = check_ttl
 
     def ensure_started(self):
+        if self.recently_verified():
+            logger.debug('Cluster was verified less than {}s ago and API server responds.'.format(self.check_ttl))
+            return
         if not self.is_running():
             self.start()
+        self._mark_verified()
+
+    def recently_verified(self) -> bool:
+        status = self.status_cache.get(self.status_cache_key)
+        if not status or time.time() - status['verified_at'] > self.check_ttl:
+            return False
+        return is_api_server_reachable(status['api_server'])
+
+    def _mark_verified(self):
+        if self.check_ttl > 0:
+            self.status_cache.set(self.status_cache_key, {
+                'verified_at': time.time(),
+                'api_server': kubeconfig.get_current_server(kubeconfig.load_kubeconfig()),
+            })
+
+    @property
+    def status_cache_key(self):
+        return '{}:{}'.format(type(self).__name__, self.profile)
 
     def is_running(self):
         raise NotImplementedError
@@ -31,6 +63,7 @@ class Cluster:
         self._before_start()
         self._start()
         self._after_start()
+        self._invalidate_caches()
 
     def _before_start(self):
         self._check_version()
@@ -41,14 +74,21 @@ class Cluster:
     def _after_start(self):
         pass
 
+    def _invalidate_caches(self):
+        self.status_cache.delete(self.status_cache_key)
+
     def docker_env(self):
         return {}
 
+    @cached_property
+    def profile(self) -> str:
+        return os.environ.get('MINIKUBE_PROFILE') or minikube_config().get('profile') or 'minikube'
+
     def get_mounted_project_dir(self, project_dir):
         raise NotImplementedError
 
     def _check_version(self):
-        version = str(sh.minikube('version'))
+        version = str(subprocesses.minikube('version'))
         version_pattern = r'v(\d+)\.(\d+)\.(\d+)'
         match = re.search(version_pattern, version)
         if not match:
@@ -60,7 +100,40 @@ class Cluster:
                                'Minimum supported version: {}'.format(version, self.minimum_minikube_version))
 
 
-class DockerCluster(Cluster):
+class MinikubeDockerEnvMixin:
+    """
+    `minikube docker-env` is slow, so its result is cached per minikube profile. Cached values are used only if they
+    were read after the cluster was last started and the docker endpoint still accepts connections.
+    """
+    docker_env_cache = cache.JsonCache('docker-env')
+
+    def docker_env(self):
+        started_at = self.started_at()
+        cached = self.docker_env_cache.get(self.profile)
+        if (started_at and cached and cached['started_at'] == started_at and
+                docker_engine.is_endpoint_reachable(cached['env'].get('DOCKER_HOST'))):
+            logger.debug('Using cached docker-env for minikube profile "{}"'.format(self.profile))
+            return cached['env']
+        env = self._read_docker_env()
+        if started_at:
+            self.docker_env_cache.set(self.profile, {'started_at': started_at, 'env': env})
+        return env
+
+    def _read_docker_env(self):
+        variables = map(lambda x: '$' + x, self.docker_env_keys)
+        result = subprocesses.bash('-c', 'eval $(minikube docker-env); echo "%s"' % '|'.join(variables))
+        values = result.strip("\n").split('|')
+        return dict(zip(self.docker_env_keys, values))
+
+    def _invalidate_caches(self):
+        super()._invalidate_caches()
+        self.docker_env_cache.delete(self.profile)
+
+    def started_at(self):
+        raise NotImplementedError
+
+
+class DockerCluster(MinikubeDockerEnvMixin, Cluster):
     kubernetes_version = 'v1.33.1'
     static_ip = '192.168.200.200'
     cpu_limit = 'no-limit'
@@ -68,7 +141,7 @@ class DockerCluster(Cluster):
 
     def is_running(self):
         try:
-            output = sh.minikube('status')
+            output = subprocesses.minikube('status')
         except sh.ErrorReturnCode:
             return False
         else:
@@ -76,7 +149,7 @@ class DockerCluster(Cluster):
 
     def _start(self):
         logger.info('Starting minikube in Docker...')
-        sh.minikube(
+        subprocesses.minikube(
             'start',
             '--driver', 'docker',
             '--kubernetes-version', self.kubernetes_version,
@@ -88,11 +161,16 @@ class DockerCluster(Cluster):
             '--static-ip', self.static_ip,
             _out=sys.stdout.buffer, _err=sys.stdout.buffer)
 
-    def docker_env(self):
-        variables = map(lambda x: '$' + x, self.docker_env_keys)
-        result = sh.bash('-c', 'eval $(minikube docker-env); echo "%s"' % '|'.join(variables))
-        values = result.strip("\n").split('|')
-        return dict(zip(self.docker_env_keys, values))
+    def started_at(self):
+        try:
+            # The profile container runs on host docker, even if the shell is set up for minikube docker.
+            host_env = {key: value for key, value in os.environ.items() if key not in self.docker_env_keys}
+            container_info = docker_engine.DockerEngineClient(host_env).inspect_container(self.profile)
+        except (OSError, docker_engine.DockerEngineError) as e:
+            logger.debug('Could not check when minikube container was started: {}'.format(e))
+            return None
+        else:
+            return container_info['State']['StartedAt']
 
     def get_mounted_project_dir(self, project_dir):
         return project_dir
@@ -101,12 +179,13 @@ class DockerCluster(Cluster):
 class NativeLocalkubeCluster(Cluster):
     _docker_config_path = '/etc/docker/daemon.json'
 
-    def __init__(self):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
         self._docker_config_backup_path = f'{self._docker_config_path}_backup_{datetime.datetime.now().isoformat()}'
 
     def is_running(self):
         try:
-            status = sh.systemctl('is-active', 'kubelet')
+            status = subprocesses.systemctl('is-active', 'kubelet')
         except sh.ErrorReturnCode_3:
             return False
         else:
@@ -121,19 +200,19 @@ class NativeLocalkubeCluster(Cluster):
     def _backup_docker_config(self):
         logger.info('Creating docker config file backup...')
         with sh.contrib.sudo(password=self._sudo_password, _with=True):
-            sh.cp('-a', self._docker_config_path, self._docker_config_backup_path)
+            subprocesses.cp('-a', self._docker_config_path, self._docker_config_backup_path)
         logger.info('Docker config file backup created.')
 
     def _start(self):
         logger.info('Starting minikube without a VM...')
-        sh.sudo('-E', '-S',
-                *self._start_env_as_arguments,
-                'minikube', 'start',
-                '--driver', 'none',
-                '--container-runtime', 'docker',
-                '--kubernetes-version', 'v1.21.14',
-                '--extra-config', 'apiserver.service-node-port-range=1-32767',
-                _in=self._sudo_password, _out=sys.stdout.buffer, _err=sys.stdout.buffer)
+        subprocesses.sudo('-E', '-S',
+                          *self._start_env_as_arguments,
+                          'minikube', 'start',
+                          '--driver', 'none',
+                          '--container-runtime', 'docker',
+                          '--kubernetes-version', 'v1.21.14',
+                          '--extra-config', 'apiserver.service-node-port-range=1-32767',
+                          _in=self._sudo_password, _out=sys.stdout.buffer, _err=sys.stdout.buffer)
 
     def _after_start(self):
         super()._after_start()
@@ -142,8 +221,8 @@ class NativeLocalkubeCluster(Cluster):
     def _restore_docker_config(self):
         logger.info('Restoring docker config file...')
         with sh.contrib.sudo(password=self._sudo_password, _with=True):
-            sh.mv(self._docker_config_backup_path, self._docker_config_path)
-            sh.systemctl('restart', 'docker.service')
+            subprocesses.mv(self._docker_config_backup_path, self._docker_config_path)
+            subprocesses.systemctl('restart', 'docker.service')
         logger.info('(sleep 20s.) Docker config file restored, waiting for minikube to reconcile '
                     'after Docker restart...')
         time.sleep(20)
@@ -165,20 +244,20 @@ class NativeLocalkubeCluster(Cluster):
         return getpass.getpass(prompt=prompt) + "\n"
 
 
-class VirtualboxCluster(Cluster):
+class VirtualboxCluster(MinikubeDockerEnvMixin, Cluster):
     def is_running(self):
-        running_machines = sh.VBoxManage('list', 'runningvms')
+        running_machines = subprocesses.VBoxManage('list', 'runningvms')
         return 'minikube' in running_machines
 
     def _start(self):
         logger.info('Starting minikube with VirtualBox...')
         minikube_iso = 'https://storage.googleapis.com/minikube/iso/minikube-v0.23.4.iso'
-        sh.minikube('start',
-                    '--memory', '4096',
-                    '--disk-size', '30g',
-                    '--iso-url', minikube_iso,
-                    '--docker-opt', 'storage-driver=overlay2',
-                    _out=sys.stdout.buffer, _err=sys.stdout.buffer)
+        subprocesses.minikube('start',
+                              '--memory', '4096',
+                              '--disk-size', '30g',
+                              '--iso-url', minikube_iso,
+                              '--docker-opt', 'storage-driver=overlay2',
+                              _out=sys.stdout.buffer, _err=sys.stdout.buffer)
 
     def _after_start(self):
         super()._after_start()
@@ -186,27 +265,52 @@ class VirtualboxCluster(Cluster):
         self._ensure_hosthome_mounted()
 
     def _increase_inotify_limit(self):
-        sh.minikube('ssh', 'sudo sysctl fs.inotify.max_user_watches=16382')
+        subprocesses.minikube('ssh', 'sudo sysctl fs.inotify.max_user_watches=16382')
 
     def _ensure_hosthome_mounted(self):
-        if '/hosthome' not in sh.minikube('ssh', 'mount'):
+        if '/hosthome' not in subprocesses.minikube('ssh', 'mount'):
             logger.info("Preparing hosthome directory...")
             try:
-                sh.minikube('ssh', 'sudo mkdir /hosthome')
+                subprocesses.minikube('ssh', 'sudo mkdir /hosthome')
             except sh.ErrorReturnCode_1 as e:
                 if b'can\'t create directory \'/hosthome\': File exists' not in e.stderr:
                     raise
-            sh.minikube('ssh', 'sudo chmod 777 /hosthome')
-            sh.minikube('ssh', 'sudo mount -t vboxsf -o uid=$(id -u),gid=$(id -g) hosthome /hosthome')
+            subprocesses.minikube('ssh', 'sudo chmod 777 /hosthome')
+            subprocesses.minikube('ssh', 'sudo mount -t vboxsf -o uid=$(id -u),gid=$(id -g) hosthome /hosthome')
 
     def get_mounted_project_dir(self, project_dir):
         return pathlib.Path('/hosthome') / project_dir.relative_to('/home')
 
-    def docker_env(self):
-        variables = map(lambda x: '$' + x, self.docker_env_keys)
-        result = sh.bash('-c', 'eval $(minikube docker-env); echo "%s"' % '|'.join(variables))
-        values = result.strip("\n").split('|')
-        return dict(zip(self.docker_env_keys, values))
+    def started_at(self):
+        try:
+            vm_info = str(subprocesses.VBoxManage('showvminfo', self.profile, '--machinereadable'))
+        except sh.ErrorReturnCode as e:
+            logger.debug(e)
+            return None
+        match = re.search(r'^VMStateChangeTime="(.*)"$', vm_info, re.MULTILINE)
+        return match.group(1) if match else None
+
+
+def is_api_server_reachable(server, timeout=0.5) -> bool:
+    if not server:
+        return False
+    url = urllib.parse.urlsplit(server)
+    try:
+        with socket.create_connection((url.hostname, url.port or 443), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def minikube_config() -> dict:
+    minikube_home = pathlib.Path(os.environ.get('MINIKUBE_HOME') or pathlib.Path.home())
+    if minikube_home.name != '.minikube':
+        minikube_home = minikube_home / '.minikube'
+    try:
+        with (minikube_home / 'config' / 'config.json').open() as config_file:
+            return json.load(config_file)
+    except (FileNotFoundError, ValueError):
+        return {}
 
 
 class ClusterFactory:
@@ -218,4 +322,5 @@ class ClusterFactory:
 
     def get(self, context):
         vm_driver = context.get('KUBEYARD_VM_DRIVER', settings.DEFAULT_KUBEYARD_VM_DRIVER)
-        return self.VM_DRIVERS[vm_driver]()
+        check_ttl = int(context.get('KUBEYARD_CLUSTER_CHECK_TTL', settings.DEFAULT_KUBEYARD_CLUSTER_CHECK_TTL))
+        return self.VM_DRIVERS[vm_driver](check_ttl=check_ttl)
@@ -0,0 +1,91 @@
+import collections
+import contextlib
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+Span = collections.namedtuple('Span', ['name', 'category', 'start', 'end', 'thread_id', 'args'])
+
+
+class Profiler:
+    """
+    Collects timing spans of command phases. Spans are recorded only when profiling is enabled (`--profile`),
+    otherwise `span` costs nothing.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+
+    @contextlib.contextmanager
+    def span(self, name, category='phase', **args):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, category, start, time.perf_counter(), **args)
+
+    def record(self, name, category, start, end, **args):
+        if self.enabled:
+            with self._lock:
+                self.spans.append(Span(name, category, start, end, threading.get_ident(), args))
+
+    def as_chrome_trace(self) -> dict:
+        events = [
+            {
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': round((span.start - self._origin) * 1e6),
+                'dur': round((span.end - span.start) * 1e6),
+                'pid': os.getpid(),
+                'tid': span.thread_id,
+                'args': span.args,
+            }
+            for span in self.spans
+        ]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def summary(self) -> str:
+        totals = collections.defaultdict(list)
+        for span in self.spans:
+            totals[(span.category, span.name)].append(span.end - span.start)
+        rows = sorted(totals.items(), key=lambda item: sum(item[1]), reverse=True)
+        name_width = max([len(name) for (_, name), _ in rows] + [len('phase')])
+        lines = ['{:<{width}}  {:<10}  {:>5}  {:>9}  {:>9}'.format(
+            'phase', 'category', 'count', 'total [s]', 'max [s]', width=name_width,
+        )]
+        for (category, name), durations in rows:
+            lines.append('{:<{width}}  {:<10}  {:>5}  {:>9.3f}  {:>9.3f}'.format(
+                name, category, len(durations), sum(durations), max(durations), width=name_width,
+            ))
+        return '\n'.join(lines)
+
+    def write(self, path: pathlib.Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open('w') as trace_file:
+            json.dump(self.as_chrome_trace(), trace_file)
+
+
+profiler = Profiler()
+span = profiler.span
+
+
+def report(project_dir: pathlib.Path, command_name: str):
+    path = project_dir / '.kubeyard' / 'profiles' / '{}-{}.json'.format(command_name, time.strftime('%Y%m%d-%H%M%S'))
+    profiler.write(path)
+    logger.info('Profile summary:\n{}'.format(profiler.summary()))
+    logger.info('Chrome trace written to {} (open it in chrome://tracing or https://ui.perfetto.dev)'.format(path))
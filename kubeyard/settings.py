@@ -6,8 +6,15 @@ DEFAULT_SWCLI_CONTEXT_FILEPATH = 'config/sw_cli.yml'  # TODO: remove legacy
 DEFAULT_KUBEYARD_CONTEXT_FILEPATH = 'config/kubeyard.yml'
 DEFAULT_SWCLI_USER_CONTEXT_FILEPATH = '.sw_cli/context.yml'  # TODO: remove legacy
 DEFAULT_KUBEYARD_USER_CONTEXT_FILEPATH = '.kubeyard/context.yml'
+DEFAULT_KUBEYARD_CACHE_DIR = '.kubeyard/cache'
+DEFAULT_KUBEYARD_TEST_DATABASE_POOL_DIR = '.kubeyard/test-database-pool'
 DEFAULT_KUBEYARD_LOG_LEVEL = 'INFO'
 DEFAULT_KUBEYARD_VM_DRIVER = 'docker'
+DEFAULT_KUBEYARD_DOCKER_CLIENT = 'api'
+DEFAULT_KUBEYARD_KUBERNETES_CLIENT = 'kubectl'
+DEFAULT_KUBEYARD_CLUSTER_CHECK_TTL = 600
+DEFAULT_DEPENDENCY_READY_TIMEOUT = 600
+DEFAULT_DEV_REQUIREMENTS_CONCURRENCY = 4
 DEFAULT_KUBERNETES_DEPLOY_DIR = 'config/kubernetes/deploy'
 DEFAULT_KUBERNETES_DEV_DEPLOY_OVERRIDES_DIR = 'config/kubernetes/development_overrides'
 DEFAULT_KUBERNETES_DEV_SECRETS_DIR = 'config/kubernetes/dev_secrets'
@@ -17,6 +24,12 @@ KUBERNETES_PROD_SECRETS_DIR = (
         'kubernetes_secrets'
 )
 DEFAULT_DOCKER_REGISTRY_NAME = 'registry.hub.docker.com'
+PYTHON_INIT_TEMPLATE_NAME = 'python'
+DJANGO_INIT_TEMPLATE_NAME = 'django'
+EMBER_INIT_TEMPLATE_NAME = 'ember'
+# Known here, so `kubeyard init --help` doesn't import init command module.
+INIT_TEMPLATE_NAMES = (PYTHON_INIT_TEMPLATE_NAME, DJANGO_INIT_TEMPLATE_NAME, EMBER_INIT_TEMPLATE_NAME)
+DEFAULT_INIT_TEMPLATE_NAME = PYTHON_INIT_TEMPLATE_NAME
 DEFAULT_PROJECT_NAME_PATTERN = '{project_name}'
 DEFAULT_KUBE_SERVICE_NAME_PATTERN = '{dashed_project_name}'
 DEFAULT_KUBE_SERVICE_PORT = '80'
@@ -30,5 +43,6 @@ DEFAULT_DEV_TLD = 'testing'
 DEFAULT_DEV_DOMAINS = ()
 DEFAULT_TEST_DATABASE_IMAGE = 'postgres:10.3'
 DEFAULT_TEST_DATABASE_NAME = 'test'
+DEFAULT_TEST_DATABASE_READY_TIMEOUT = 120
 DEFAULT_TEST_MIGRATION_COMMAND = 'migrate_for_tests'
 DEFAULT_TEST_COMMAND = 'run_tests'
@@ -0,0 +1,103 @@
+import collections
+import logging
+import threading
+import time
+
+import sh
+
+from kubeyard import profiling
+
+logger = logging.getLogger(__name__)
+
+Invocation = collections.namedtuple('Invocation', ['binary', 'subcommand', 'start', 'end', 'exit_code'])
+
+ASYNC_CALL_ARGUMENTS = ('_bg', '_iter', '_iter_noblock', '_piped')
+RESOURCE_VERBS = {'kubectl': {'get', 'create', 'delete', 'describe', 'wait'}}
+
+
+class Accountant:
+    def __init__(self):
+        self.invocations = []
+        self._lock = threading.Lock()
+
+    def record(self, binary, subcommand, start, end, exit_code):
+        with self._lock:
+            self.invocations.append(Invocation(binary, subcommand, start, end, exit_code))
+        name = '{} {}'.format(binary, subcommand).strip()
+        profiling.profiler.record(name, 'subprocess', start, end, exit_code=exit_code)
+
+    def summary(self) -> str:
+        grouped = collections.defaultdict(list)
+        for invocation in self.invocations:
+            grouped[(invocation.binary, invocation.subcommand)].append(invocation)
+        rows = sorted(grouped.items(), key=lambda item: sum(i.end - i.start for i in item[1]), reverse=True)
+        name_width = max([len('{} {}'.format(*key)) for key, _ in rows] + [len('command')])
+        lines = ['{:<{width}}  {:>5}  {:>6}  {:>9}'.format('command', 'calls', 'failed', 'total [s]', width=name_width)]
+        for (binary, subcommand), invocations in rows:
+            lines.append('{:<{width}}  {:>5}  {:>6}  {:>9.3f}'.format(
+                '{} {}'.format(binary, subcommand),
+                len(invocations),
+                sum(1 for i in invocations if i.exit_code != 0),
+                sum(i.end - i.start for i in invocations),
+                width=name_width,
+            ))
+        return '\n'.join(lines)
+
+    def log_summary(self):
+        if self.invocations:
+            logger.debug('{} external commands were run:\n{}'.format(len(self.invocations), self.summary()))
+
+
+accountant = Accountant()
+
+
+class AccountedCommand:
+    """
+    Wraps `sh` command, so every invocation is counted and timed by binary and subcommand. Module level attributes
+    work like in `sh`, e.g. `subprocesses.kubectl('get', 'pods')` or `subprocesses.kubectl.get.pods()`.
+    """
+
+    def __init__(self, binary, baked_args=()):
+        self.binary = binary
+        self.baked_args = baked_args
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return AccountedCommand(self.binary, self.baked_args + (name,))
+
+    def __call__(self, *args, **kwargs):
+        command = getattr(sh, self.binary).bake(*self.baked_args)
+        subcommand = self.subcommand(self.baked_args + args)
+        start = time.perf_counter()
+        if any(kwargs.get(argument) for argument in ASYNC_CALL_ARGUMENTS):
+            def done(_process, _success, exit_code):
+                accountant.record(self.binary, subcommand, start, time.perf_counter(), exit_code)
+            return command(*args, _done=done, **kwargs)
+        exit_code = -1
+        try:
+            result = command(*args, **kwargs)
+            exit_code = getattr(result, 'exit_code', 0)
+            return result
+        except sh.ErrorReturnCode as e:
+            exit_code = e.exit_code
+            raise
+        finally:
+            accountant.record(self.binary, subcommand, start, time.perf_counter(), exit_code)
+
+    def subcommand(self, args):
+        words = []
+        for arg in args:
+            if not isinstance(arg, str):
+                continue
+            if arg.startswith('-'):
+                break
+            words.append(arg)
+        depth = 2 if words and words[0] in RESOURCE_VERBS.get(self.binary, ()) else 1
+        return ' '.join(words[:depth])
+
+
+def __getattr__(name):
+    if name.startswith('_'):
+        raise AttributeError(name)
+    return AccountedCommand(name)
@@ -0,0 +1,9 @@
+import pytest
+
+from kubeyard.base_command import CommandException
+from kubeyard.commands import devel
+
+
+def test_unknown_docker_client_is_reported():
+    with pytest.raises(CommandException, match='"cli", "api"'):
+        devel.get_docker_runner({'KUBEYARD_DOCKER_CLIENT': 'engine'})
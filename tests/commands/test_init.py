@@ -0,0 +1,6 @@
+from kubeyard import settings
+from kubeyard.commands import init
+
+
+def test_every_init_template_name_has_init_type():
+    assert sorted(template.name for template in init.all_templates) == sorted(settings.INIT_TEMPLATE_NAMES)
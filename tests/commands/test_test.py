@@ -0,0 +1,95 @@
+import pytest
+
+from kubeyard import cache
+from kubeyard.commands import test
+from tests.fakes import FakeDockerRunner
+
+CONTEXT = {
+    'DOCKER_IMAGE_NAME': 'project',
+    'TEST_DATABASE_IMAGE': 'postgres:10.3',
+    'TEST_DATABASE_NAME': 'test',
+    'TEST_MIGRATION_COMMAND': 'migrate',
+}
+
+
+@pytest.fixture(autouse=True)
+def migration_state(tmp_path, monkeypatch):
+    monkeypatch.setattr(test.Database, 'migration_state', cache.JsonCache('migrations', directory=tmp_path))
+
+
+def make_database(docker_runner, **context):
+    return test.PostgresDatabase(
+        is_development=True,
+        volumes=(),
+        context={**CONTEXT, **context},
+        tag='latest',
+        docker_runner=docker_runner,
+        tested_image_name='project:latest',
+    )
+
+
+def migrations_run(docker_runner):
+    return [command for command in docker_runner.commands if 'migrate' in command]
+
+
+def test_fast_mode_database_is_not_restarted_by_docker():
+    docker_runner = FakeDockerRunner()
+    with make_database(docker_runner, TEST_DATABASE_FAST_MODE=True):
+        pass
+
+    assert not docker_runner.containers['db-test-project-latest']['restart_always']
+
+
+def test_fast_mode_database_is_migrated_again_after_docker_restart():
+    docker_runner = FakeDockerRunner()
+    with make_database(docker_runner, TEST_DATABASE_FAST_MODE=True):
+        pass
+    docker_runner.restart_daemon()
+
+    with make_database(docker_runner, TEST_DATABASE_FAST_MODE=True):
+        pass
+
+    assert len(migrations_run(docker_runner)) == 2
+
+
+def test_database_with_volume_is_not_migrated_again_after_docker_restart():
+    docker_runner = FakeDockerRunner()
+    with make_database(docker_runner):
+        pass
+    docker_runner.restart_daemon()
+
+    with make_database(docker_runner):
+        pass
+
+    assert len(migrations_run(docker_runner)) == 1
+
+
+@pytest.mark.parametrize('test_options, expected', [
+    (['-x', 'tests'], ['-x']),
+    (['-x', '--cov=package', '-kslow', 'tests/unit', 'tests/test_a.py::test_b'], ['-x', '--cov=package', '-kslow']),
+    ([], []),
+])
+def test_shards_get_only_options_from_test_options(test_options, expected):
+    assert test.get_option_args(test_options) == expected
+
+
+def test_postgres_data_path_is_read_from_image():
+    docker_runner = FakeDockerRunner(image_env=['PATH=/usr/bin', 'PGDATA=/var/lib/postgresql/18/docker'])
+    with make_database(docker_runner, TEST_DATABASE_SNAPSHOTS=True):
+        pass
+
+    run = next(command for command in docker_runner.commands if '--detach' in command)
+    copy = next(command for command in docker_runner.commands if '--entrypoint' in command)
+    assert '/var/lib/postgresql/18/docker' in run
+    assert copy[-1].startswith('cp -a /var/lib/postgresql/18/docker/. /snapshot/')
+
+
+def test_postgres_data_path_defaults_without_pgdata_in_image():
+    assert make_database(FakeDockerRunner()).data_path == '/var/lib/postgresql/data'
+
+
+def test_database_data_path_can_be_configured():
+    docker_runner = FakeDockerRunner(image_env=['PGDATA=/var/lib/postgresql/18/docker'])
+    database = make_database(docker_runner, TEST_DATABASE_DATA_PATH='/data')
+
+    assert database.data_path == '/data'
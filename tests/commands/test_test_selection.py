@@ -0,0 +1,49 @@
+import subprocess
+
+from kubeyard.commands import test_selection
+
+
+def write_modules(source, modules: dict):
+    for name, content in modules.items():
+        path = source / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+
+def make_graph(project_dir):
+    source = (project_dir / 'source').resolve()
+    return test_selection.ImportGraph(project_dir, [test_selection.SourceRoot(source, '/package')])
+
+
+def test_tests_importing_deleted_module_are_affected(tmp_path):
+    source = tmp_path / 'source'
+    write_modules(source, {
+        'app/__init__.py': '',
+        'app/models.py': '',
+        'app/views.py': 'from app import models\n',
+        'tests/test_views.py': 'import app.views\n',
+        'tests/test_other.py': 'import app\n',
+    })
+    (source / 'app/models.py').unlink()
+
+    affected = make_graph(tmp_path).get_dependants([(source / 'app/models.py').resolve()])
+
+    assert affected == {(source / 'app/views.py').resolve(), (source / 'tests/test_views.py').resolve()}
+
+
+def test_renamed_module_is_changed_under_both_names(tmp_path):
+    def git(*args):
+        subprocess.run(['git', *args], cwd=str(tmp_path), check=True, stdout=subprocess.DEVNULL)
+
+    write_modules(tmp_path / 'source', {'app/models.py': 'MODELS = []\n'})
+    git('init', '-q')
+    git('add', '.')
+    git('-c', 'user.name=test', '-c', 'user.email=test@example.com', 'commit', '-q', '-m', 'init')
+    git('mv', 'source/app/models.py', 'source/app/entities.py')
+
+    changed = test_selection.get_changed_files(tmp_path, 'HEAD')
+
+    assert changed == sorted([
+        (tmp_path / 'source/app/entities.py').resolve(),
+        (tmp_path / 'source/app/models.py').resolve(),
+    ])
@@ -0,0 +1,62 @@
+import itertools
+
+
+class FakeDockerRunner:
+    """In-memory docker host recording commands run by kubeyard."""
+
+    def __init__(self, image_env=()):
+        self.containers = {}
+        self.volumes = {}
+        self.commands = []
+        self.image_env = list(image_env)
+        self._ids = itertools.count(1)
+
+    def run(self, *args, **kwargs):
+        self.commands.append(args)
+        if args[0] in ('run', 'create') and '--name' in args:
+            name = args[args.index('--name') + 1]
+            container_id = 'container-{}'.format(next(self._ids))
+            labels = dict(args[index + 1].split('=', 1) for index, arg in enumerate(args) if arg == '--label')
+            self.containers[name] = {
+                'Id': container_id,
+                'State': {'Running': '--detach' in args},
+                'Config': {'Labels': labels},
+                'restart_always': '--restart' in args,
+            }
+            return container_id
+        return ''
+
+    def restart_daemon(self):
+        for container in self.containers.values():
+            container['State']['Running'] = container['restart_always']
+
+    def inspect_container(self, name):
+        return self.containers.get(name)
+
+    def start_container(self, name):
+        self.containers[name]['State']['Running'] = True
+
+    def remove_container(self, name, *, volumes=False):
+        return self.containers.pop(name, None) is not None
+
+    def exec_container(self, name, *command):
+        return 0, ''
+
+    def container_logs(self, name, *, follow=False, since=None):
+        return []
+
+    def inspect_image(self, name):
+        return {'Id': 'sha256:{}'.format(name), 'Config': {'Env': self.image_env}}
+
+    def inspect_volume(self, name):
+        return self.volumes.get(name)
+
+    def create_volume(self, name=None, *, labels=None):
+        self.volumes[name] = {'Name': name, 'Labels': labels or {}, 'CreatedAt': ''}
+        return name
+
+    def find_volumes(self, *, label):
+        return list(self.volumes)
+
+    def remove_volume(self, name):
+        del self.volumes[name]
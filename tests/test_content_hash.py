@@ -0,0 +1,41 @@
+import pytest
+
+from kubeyard import content_hash
+
+
+def hash_build_context(context, dockerfile=None):
+    hasher = content_hash.ContentHasher()
+    hasher.add_build_context(context, dockerfile)
+    return hasher.hexdigest()
+
+
+@pytest.mark.parametrize('dockerfile_name', ['Dockerfile', 'Dockerfile.dev'])
+def test_build_context_hash_includes_ignored_dockerfile(tmp_path, dockerfile_name):
+    (tmp_path / '.dockerignore').write_text('Dockerfile*\n.dockerignore\n')
+    dockerfile = tmp_path / dockerfile_name
+    dockerfile.write_text('FROM python:3.12\n')
+    explicit_dockerfile = dockerfile if dockerfile_name != 'Dockerfile' else None
+    before = hash_build_context(tmp_path, explicit_dockerfile)
+
+    dockerfile.write_text('FROM python:3.13\n')
+
+    assert hash_build_context(tmp_path, explicit_dockerfile) != before
+
+
+def test_build_context_hash_includes_ignored_dockerignore(tmp_path):
+    (tmp_path / '.dockerignore').write_text('.dockerignore\n*.log\n')
+    before = hash_build_context(tmp_path)
+
+    (tmp_path / '.dockerignore').write_text('.dockerignore\n*.log\n*.tmp\n')
+
+    assert hash_build_context(tmp_path) != before
+
+
+def test_build_context_hash_respects_dockerignore(tmp_path):
+    (tmp_path / '.dockerignore').write_text('*.log\n')
+    (tmp_path / 'Dockerfile').write_text('FROM python:3.12\n')
+    before = hash_build_context(tmp_path)
+
+    (tmp_path / 'app.log').write_text('')
+
+    assert hash_build_context(tmp_path) == before
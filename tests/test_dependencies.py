@@ -0,0 +1,63 @@
+import pytest
+
+from kubeyard import base_command
+from kubeyard import dependencies
+from kubeyard import kubernetes_api
+from kubeyard.kubernetes_gateway import PodStatus
+
+
+def pod_status(ready):
+    return PodStatus('dev-postgres-1', 'Running', ['true' if ready else 'false'], set(), False)
+
+
+class FakeGateway:
+    def __init__(self, *watches):
+        self.watches = list(watches)
+        self.timeouts = []
+
+    def watch_pods(self, *, selector, timeout):
+        self.timeouts.append(timeout)
+        for item in self.watches.pop(0):
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(dependencies, 'WATCH_RETRY_DELAY', 0)
+
+
+class PostgresDependency(dependencies.KubernetesDependency):
+    name = 'dev-postgres'
+
+
+def make_dependency(gateway):
+    return PostgresDependency(gateway=gateway)
+
+
+def test_interrupted_watch_starts_again():
+    gateway = FakeGateway(
+        [pod_status(ready=False), kubernetes_api.Gone(410, 'too old resource version')],
+        [pod_status(ready=False), ConnectionResetError()],
+        [pod_status(ready=False), pod_status(ready=True)],
+    )
+
+    make_dependency(gateway)._wait_until_ready()
+
+    assert len(gateway.timeouts) == 3
+    assert gateway.timeouts == sorted(gateway.timeouts, reverse=True)
+
+
+def test_other_api_errors_are_not_retried():
+    gateway = FakeGateway([kubernetes_api.KubernetesApiError(403, 'forbidden')])
+
+    with pytest.raises(kubernetes_api.KubernetesApiError):
+        make_dependency(gateway)._wait_until_ready()
+
+
+def test_timeout_is_reported():
+    gateway = FakeGateway([pod_status(ready=False), TimeoutError()])
+
+    with pytest.raises(base_command.CommandException, match='Last status: dev-postgres-1: Running'):
+        make_dependency(gateway)._wait_until_ready()
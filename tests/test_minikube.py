@@ -0,0 +1,22 @@
+from kubeyard import docker_engine
+from kubeyard import minikube
+
+
+def test_minikube_container_is_inspected_on_host_docker(monkeypatch):
+    monkeypatch.setenv('DOCKER_HOST', 'tcp://192.168.49.2:2376')
+    monkeypatch.setenv('DOCKER_TLS_VERIFY', '1')
+    monkeypatch.setenv('DOCKER_CERT_PATH', '/home/user/.minikube/certs')
+    monkeypatch.setenv('MINIKUBE_ACTIVE_DOCKERD', 'minikube')
+    clients = []
+
+    class FakeEngineClient:
+        def __init__(self, env):
+            clients.append(env)
+
+        def inspect_container(self, name):
+            return {'State': {'StartedAt': '2024-01-01T00:00:00Z'}}
+
+    monkeypatch.setattr(docker_engine, 'DockerEngineClient', FakeEngineClient)
+
+    assert minikube.DockerCluster().started_at() == '2024-01-01T00:00:00Z'
+    assert not set(minikube.Cluster.docker_env_keys) & set(clients[0])